@@ -4,17 +4,174 @@ This module abstracts the botocore session and clients
 to provide a simpler interface.
 """
 from __future__ import unicode_literals, print_function
+import copy
+import logging
+import threading
+
+from botocore.config import Config
+
+from .gcdt_defaults import AWSCLIENT_CONFIG
+from .gcdt_response_cache import ResponseCache
+from .gcdt_throttling import TokenBucket, ThrottleAwareRetryHandler
+
+log = logging.getLogger(__name__)
 
 
 class AWSClient(object):
     # note this is heavily inspired by TypedAWSClient:
     # https://github.com/awslabs/chalice/blob/master/chalice/awsclient.py
-    def __init__(self, session):
+    def __init__(self, session, **kwargs):
+        """AWSClient is safe to be shared across threads.
+
+        :param session: botocore session
+        :param kwargs: override AWSCLIENT_CONFIG (max_pool_connections,
+            connect_timeout, read_timeout, max_attempts, response_cache,
+            rate_limits)
+        """
         self._session = session
         self._client_cache = {}
+        self._client_locks = {}  # one lock per client under construction
+        self._lock = threading.Lock()
+        self._session_lock = threading.Lock()  # session is not thread safe
+        self._config = dict(AWSCLIENT_CONFIG, **kwargs)
+        self._retries_configured = set()  # guarded by the session lock
+        self._response_cache = None
+        if self._config.get('response_cache'):
+            self._response_cache = ResponseCache()
+
+    def get_client(self, service_name, region_name=None):
+        """Get the client for the service (create it if necessary).
+
+        :param service_name: botocore service name, e.g. 'cloudformation'
+        :param region_name: defaults to the region of the session
+        :return: botocore client
+        """
+        key = (service_name, region_name)
+        client = self._client_cache.get(key)
+        if client is None:
+            with self._lock:
+                client_lock = self._client_locks.setdefault(
+                    key, threading.Lock())
+            # other clients can be created in the meantime
+            with client_lock:
+                client = self._client_cache.get(key)
+                if client is None:
+                    client = self._create_client(service_name, region_name)
+                    self._client_cache[key] = client
+        return client
+
+    def create_clients(self, service_names, region_name=None):
+        """Create the clients in advance (e.g. before the process forks).
+
+        Note: the botocore session is not thread safe so the clients are
+        created one after the other.
+
+        :param service_names: list of botocore service names
+        :param region_name: defaults to the region of the session
+        """
+        for service_name in service_names:
+            self.get_client(service_name, region_name)
+
+    def close_connections(self):
+        """Close the pooled connections of all clients. Call this before the
+        process forks so the child processes do not share our sockets (the
+        clients open new connections on their next request).
+        """
+        with self._lock:
+            clients = list(self._client_cache.values())
+        for client in clients:
+            client._endpoint.http_session.close()
+
+    def get_credentials(self):
+        return self._session.get_credentials()
+
+    def register(self, event_name, handler, unique_id=None):
+        """Register a handler for botocore events of all clients
+        (e.g. 'after-call.*.*').
+
+        :param event_name:
+        :param handler:
+        :param unique_id: handler is only registered once
+        """
+        with self._session_lock:
+            self._session.register(event_name, handler, unique_id=unique_id)
+
+    def get_cache_stats(self):
+        """Hit and miss counts of the response cache.
+
+        :return: dictionary or None if the response cache is not used
+        """
+        if self._response_cache:
+            return self._response_cache.get_stats()
+
+    def _get_client_config(self):
+        options = dict(
+            (k, v) for k, v in self._config.items()
+            if k in ['max_pool_connections', 'connect_timeout',
+                     'read_timeout'] and v is not None)
+        if options:
+            return Config(**options)
+
+    def _create_client(self, service_name, region_name):
+        # all changes to the session (and its event emitter) are made while
+        # we hold the session lock
+        with self._session_lock:
+            self._configure_retries(service_name)
+            client = self._session.create_client(
+                service_name, region_name=region_name,
+                config=self._get_client_config())
+        if self._response_cache:
+            self._response_cache.wrap_client(client)
+        return client
+
+    def _get_bucket(self, endpoint_prefix):
+        rate_limits = self._config.get('rate_limits') or {}
+        rate = rate_limits.get(endpoint_prefix,
+                               rate_limits.get('__default__'))
+        if rate:
+            return TokenBucket(rate)
+
+    def _configure_retries(self, service_name):
+        """Register a throttle-aware retry handler for the service and rate
+        limit the requests. This happens before the first client of the
+        service is created, botocore does not register its own retry
+        handler then (same unique id).
+
+        Note: the caller holds the session lock.
 
-    def get_client(self, service_name):
-        if service_name not in self._client_cache:
-            self._client_cache[service_name] = self._session.create_client(
-                service_name)
-        return self._client_cache[service_name]
+        :param service_name: botocore service name
+        """
+        from botocore import retryhandler, translate
+        endpoint_prefix = self._session.get_service_model(
+            service_name).endpoint_prefix
+        if endpoint_prefix in self._retries_configured:
+            return
+        original_config = self._session.get_component(
+            'data_loader').load_data('_retry')
+        if not original_config:
+            return
+        # build_retry_config modifies the config
+        original_config = copy.deepcopy(original_config)
+        retry_config = translate.build_retry_config(
+            endpoint_prefix, original_config.get('retry', {}),
+            original_config.get('definitions', {}))
+        max_attempts = self._config.get('max_attempts')
+        if max_attempts is None:
+            max_attempts = retry_config['__default__']['max_attempts']
+        retry_config['__default__']['max_attempts'] = max_attempts
+        checker = retryhandler.create_checker_from_retry_config(retry_config)
+        bucket = self._get_bucket(endpoint_prefix)
+        handler = ThrottleAwareRetryHandler(checker, max_attempts, bucket)
+        event_name = 'needs-retry.%s' % endpoint_prefix
+        unique_id = 'retry-config-%s' % endpoint_prefix
+        log.debug('configure %d max_attempts for %s', max_attempts,
+                  endpoint_prefix)
+        self._session.unregister(event_name, unique_id=unique_id)
+        self._session.register(event_name, handler, unique_id=unique_id)
+        if bucket:
+            # every attempt takes a token
+            self._session.register(
+                'request-created.%s' % endpoint_prefix,
+                lambda **kwargs: bucket.acquire(),
+                unique_id='rate-limit-%s' % endpoint_prefix)
+        self._retries_configured.add(endpoint_prefix)
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""Run many gcdt tool invocations from a single process.
+
+The jobs of a batch are described in a json manifest:
+
+    {
+        "workers": 4,
+        "jobs": [
+            {"id": "vpc", "tool": "kumo", "command": "deploy",
+             "path": "infra/vpc"},
+            {"tool": "ramuda", "command": "deploy", "path": "lambda/foo",
+             "env": "dev", "dependsOn": ["vpc"]}
+        ]
+    }
+
+A job starts when all the jobs it depends on succeeded. Jobs which depend
+on a failed job are skipped.
+
+Plugins, botocore clients and credentials are set up once in the batch
+process. Since the gcdt tools work on the current working directory and on
+the 'ENV' environment variable (which are both process wide) every job is
+executed in a worker process forked from the warmed-up batch process.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import json
+import time
+import shlex
+import select
+import logging
+import importlib
+import traceback
+import multiprocessing
+
+from docopt import docopt
+
+from .gcdt_awsclient import AWSClient
+from .gcdt_cmd_dispatcher import cmd, get_command
+from .gcdt_defaults import TOOL_SERVICES, AWSCLIENT_CONFIG
+from .gcdt_lifecycle import lifecycle
+from .gcdt_metrics import setup_api_metrics
+from .gcdt_plugins import load_plugins
+from .gcdt_throttling import share_rate_limits
+from .servicediscovery import prefetch_stack_outputs
+from .utils import get_env, are_credentials_still_valid
+
+log = logging.getLogger(__name__)
+
+TOOLS = ['kumo', 'tenkai', 'ramuda', 'yugen']
+
+# the warmed-up awsclient is inherited by the forked worker processes
+_awsclient = None
+_api_metrics = None
+
+
+def read_manifest(manifest_file):
+    """Read the batch manifest and normalize the jobs.
+
+    :param manifest_file: path to the json manifest
+    :return: manifest dictionary
+    """
+    with open(manifest_file) as mfile:
+        manifest = json.load(mfile)
+    base_path = os.path.dirname(os.path.abspath(manifest_file))
+    jobs = []
+    for idx, job in enumerate(manifest.get('jobs', [])):
+        if job.get('tool') not in TOOLS:
+            raise Exception('job %d: unknown tool \'%s\'' %
+                            (idx, job.get('tool')))
+        if not job.get('command'):
+            raise Exception('job %d: command is missing' % idx)
+        if not job.get('env', get_env()):
+            raise Exception('job %d: env is missing' % idx)
+        jobs.append({
+            'id': job.get('id', str(idx)),
+            'tool': job['tool'],
+            'command': job['command'],
+            'path': os.path.join(base_path, job.get('path', '.')),
+            'env': job.get('env', get_env()),
+            'dependsOn': job.get('dependsOn', [])
+        })
+    check_dependencies(jobs)
+    manifest['jobs'] = jobs
+    return manifest
+
+
+def check_dependencies(jobs):
+    """Make sure the dependencies of the jobs form a DAG.
+
+    :param jobs: list of jobs
+    """
+    job_ids = [job['id'] for job in jobs]
+    if len(set(job_ids)) != len(job_ids):
+        raise Exception('job ids must be unique')
+    depends_on = dict((job['id'], job.get('dependsOn', [])) for job in jobs)
+    for job_id, dependencies in depends_on.items():
+        for dependency in dependencies:
+            if dependency not in depends_on:
+                raise Exception('job %s: unknown dependency \'%s\'' %
+                                (job_id, dependency))
+    # depth first search for cycles
+    done = set()
+
+    def _visit(job_id, path):
+        if job_id in path:
+            raise Exception('dependency cycle: %s' %
+                            ' -> '.join(path[path.index(job_id):] + [job_id]))
+        if job_id not in done:
+            for dependency in depends_on[job_id]:
+                _visit(dependency, path + [job_id])
+            done.add(job_id)
+
+    for job_id in job_ids:
+        _visit(job_id, [])
+
+
+def get_max_width(jobs):
+    """Max number of jobs on one level of the dependency DAG (jobs on the
+    same level can run at the same time).
+
+    :param jobs: list of jobs (dependencies form a DAG)
+    :return: max width
+    """
+    depends_on = dict((job['id'], job.get('dependsOn', [])) for job in jobs)
+    levels = {}
+
+    def _level(job_id):
+        if job_id not in levels:
+            levels[job_id] = 1 + max([_level(d) for d in depends_on[job_id]]
+                                     or [-1])
+        return levels[job_id]
+
+    widths = {}
+    for job_id in depends_on:
+        level = _level(job_id)
+        widths[level] = widths.get(level, 0) + 1
+    return max(widths.values() or [0])
+
+
+def warm_up(awsclient, jobs):
+    """Do the expensive parts of the tool startup once for all jobs.
+
+    :param awsclient:
+    :param jobs: list of jobs
+    """
+    global _awsclient, _api_metrics
+    _awsclient = awsclient
+    load_plugins()
+    # the result of the credentials check is cached for the workers
+    are_credentials_still_valid(awsclient)
+    # every worker reports the API calls of its job
+    _api_metrics = setup_api_metrics(awsclient)
+    # clients are created before we fork
+    tools = set([j['tool'] for j in jobs])
+    awsclient.create_clients(
+        set([s for tool in tools for s in TOOL_SERVICES[tool]]))
+    # import the heavy tool implementations
+    for tool in tools:
+        importlib.import_module('gcdt.%s_core' % tool)
+    if 'kumo' in tools:
+        # stack lookups of all kumo jobs are answered from the index
+        try:
+            prefetch_stack_outputs(awsclient)
+        except Exception as e:
+            log.warning('can not prefetch stack outputs: %s', e)
+    # the workers must not share the connections we opened (e.g. for the
+    # credentials check)
+    awsclient.close_connections()
+
+
+def _register_tool_cmds(tool):
+    """Make sure the cmd dispatcher only knows the cmds of the given tool.
+
+    :param tool:
+    :return: docopt string of the tool
+    """
+    return cmd.select('gcdt.%s_main' % tool).DOC
+
+
+def _run_job(job):
+    """Run the lifecycle for a single job (inside the worker process).
+
+    :param job:
+    :return: exit_code
+    """
+    os.chdir(job['path'])
+    os.environ['ENV'] = job['env']
+    doc = _register_tool_cmds(job['tool'])
+    arguments = docopt(doc, shlex.split(job['command']))
+    arguments.pop('--verbose', None)
+    command = get_command(arguments)
+    return lifecycle(_awsclient, job['env'], job['tool'], command, arguments)
+
+
+def redirect_output_to_fd(fd):
+    # redirect stdout and stderr of the worker process on fd level
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    # the worker exits after the job so we can replace the std streams
+    sys.stdout = os.fdopen(1, 'w', 0)
+    sys.stderr = os.fdopen(2, 'w', 0)
+
+
+def _redirect_output(logfile):
+    fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    redirect_output_to_fd(fd)
+    os.close(fd)
+
+
+def execute_job(job, logdir=None):
+    """Worker process entry point.
+
+    :param job:
+    :param logdir: write job output to '<logdir>/<job-id>.log'
+    :return: result dictionary
+    """
+    start = time.time()
+    if _api_metrics is not None:
+        # the counters of the parent (e.g. warm_up) are not part of the job
+        _api_metrics.reset(job_id=job['id'])
+    if logdir:
+        _redirect_output(os.path.join(logdir, '%s.log' % job['id']))
+    try:
+        exit_code = _run_job(job)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return {
+        'id': job['id'],
+        'exit_code': exit_code or 0,
+        'duration': time.time() - start
+    }
+
+
+def _skipped(job):
+    return {'id': job['id'], 'exit_code': None, 'duration': 0.0}
+
+
+def _worker(job, logdir, conn):
+    # worker process: send the result of the job to the batch process
+    conn.send(execute_job(job, logdir))
+    conn.close()
+
+
+def _start_worker(job, logdir):
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_worker,
+                                      args=(job, logdir, child_conn))
+    process.start()
+    # the pipe signals EOF when the worker dies without a result
+    child_conn.close()
+    return {'job': job, 'process': process, 'conn': parent_conn,
+            'start': time.time()}
+
+
+def _collect_result(worker):
+    try:
+        result = worker['conn'].recv()
+    except EOFError:
+        # e.g. killed by the OOM killer or a crash in native code
+        worker['process'].join()
+        log.error('worker of job %s died (exit code %s)',
+                  worker['job']['id'], worker['process'].exitcode)
+        result = {'id': worker['job']['id'], 'exit_code': 1,
+                  'duration': time.time() - worker['start']}
+    worker['conn'].close()
+    worker['process'].join()
+    return result
+
+
+def run_jobs(jobs, workers=4, logdir=None, fail_fast=False):
+    """Run the jobs on a bounded number of worker processes. A job starts
+    as soon as the jobs it depends on succeeded.
+
+    :param jobs: list of jobs
+    :param workers: max number of jobs running at the same time
+    :param logdir: folder for the job logs (default: use stdout)
+    :param fail_fast: do not start any more jobs after a job failed
+    :return: list of results (in order of the jobs), exit_code of skipped
+        jobs is None
+    """
+    if logdir and not os.path.exists(logdir):
+        os.makedirs(logdir)
+    results = {}
+    pending = list(jobs)
+    running = []
+    failed = False
+    try:
+        while pending or running:
+            progress = False
+            for job in list(pending):
+                dependencies = [results.get(d)
+                                for d in job.get('dependsOn', [])]
+                if (failed and fail_fast) or \
+                        any(r and r['exit_code'] != 0 for r in dependencies):
+                    pending.remove(job)
+                    results[job['id']] = _skipped(job)
+                    progress = True
+                elif len(running) < workers and all(dependencies):
+                    pending.remove(job)
+                    # every job gets a fresh worker forked from this process
+                    running.append(_start_worker(job, logdir))
+                    progress = True
+            if not running:
+                if not progress:
+                    raise Exception('can not resolve job dependencies')
+                continue
+            # note: timeout keeps us responsive to KeyboardInterrupt
+            ready, _, _ = select.select([w['conn'] for w in running],
+                                        [], [], 1)
+            for worker in list(running):
+                if worker['conn'] not in ready:
+                    continue
+                running.remove(worker)
+                result = _collect_result(worker)
+                results[result['id']] = result
+                if result['exit_code']:
+                    failed = True
+    finally:
+        for worker in running:
+            worker['process'].terminate()
+            worker['process'].join()
+    return [results[job['id']] for job in jobs]
+
+
+def print_summary(jobs, results):
+    """Print aggregated results of the batch run.
+
+    :param jobs:
+    :param results:
+    """
+    from tabulate import tabulate
+    table = [['Job', 'Tool', 'Command', 'Path', 'Env', 'Exit code',
+              'Duration']]
+    for job, result in zip(jobs, results):
+        exit_code = result['exit_code']
+        table.append([job['id'], job['tool'], job['command'],
+                      os.path.relpath(job['path']), job['env'],
+                      'skipped' if exit_code is None else exit_code,
+                      '%.1fs' % result['duration']])
+    print(tabulate(table, headers='firstrow'))
+    failed = len([r for r in results if r['exit_code']])
+    skipped = len([r for r in results if r['exit_code'] is None])
+    if skipped:
+        print('%d jobs, %d failed, %d skipped' % (len(results), failed,
+                                                  skipped))
+    else:
+        print('%d jobs, %d failed' % (len(results), failed))
+
+
+def run_batch(jobs, workers=4, logdir=None, fail_fast=False):
+    """Warm up and execute the jobs.
+
+    :param jobs: list of jobs
+    :param workers: max number of parallel jobs
+    :param logdir: folder for the job logs
+    :param fail_fast: do not start any more jobs after a job failed
+    :return: exit_code
+    """
+    import botocore.session
+    workers = int(workers)
+    if workers < 1:
+        raise Exception('workers must be at least 1')
+    # the workers get their own copy of the token buckets, the limits are
+    # shared by the jobs which can run at the same time
+    rate_limits = share_rate_limits(AWSCLIENT_CONFIG['rate_limits'],
+                                    min(workers, get_max_width(jobs)) or 1)
+    awsclient = AWSClient(
+        botocore.session.get_session(),
+        response_cache=bool(os.environ.get('GCDT_RESPONSE_CACHE')),
+        rate_limits=rate_limits)
+    warm_up(awsclient, jobs)
+    results = run_jobs(jobs, workers=workers, logdir=logdir,
+                       fail_fast=fail_fast)
+    print_summary(jobs, results)
+    if any(r['exit_code'] != 0 for r in results):
+        return 1
+    return 0
+
+
+def batch(manifest_file, workers=None, logdir=None, fail_fast=False):
+    """Execute all jobs of the manifest.
+
+    :param manifest_file: path to the json manifest
+    :param workers: max number of parallel jobs (overrides manifest)
+    :param logdir: folder for the job logs
+    :param fail_fast: do not start any more jobs after a job failed
+    :return: exit_code
+    """
+    manifest = read_manifest(manifest_file)
+    if not workers:
+        workers = manifest.get('workers', 4)
+    return run_batch(manifest['jobs'], workers=workers, logdir=logdir,
+                     fail_fast=fail_fast or manifest.get('failFast', False))
@@ -5,6 +5,7 @@ The order of cmd registration in your generator file matters. Please make sure
 you place cmds from specific to less-specific to catch-all.
 """
 from __future__ import unicode_literals, print_function
+import importlib
 
 
 # based on https://github.com/finklabs/banana/blob/master/banana/docopt_cmd.py
@@ -14,6 +15,7 @@ from __future__ import unicode_literals, print_function
 # http://python-3-patterns-idioms-test.readthedocs.io/en/latest/PythonDecorators.html
 class cmd(object):
     _specs = []  # list of tuples (spec, function)
+    _modules = {}  # module name -> list of tuples (spec, function)
 
     def __init__(self, spec):
         """
@@ -33,10 +35,25 @@ class cmd(object):
 
     @classmethod
     def register(cls, spec, func, prepend=False):
+        module_specs = cls._modules.setdefault(func.__module__, [])
         if prepend:
             cls._specs.insert(0, (spec, func))
+            module_specs.insert(0, (spec, func))
         else:
             cls._specs.append((spec, func))
+            module_specs.append((spec, func))
+
+    @classmethod
+    def select(cls, module_name):
+        """Dispatch only to the cmds registered by the given module (e.g.
+        when one process runs the commands of different tools).
+
+        :param module_name: e.g. 'gcdt.kumo_main', imported if necessary
+        :return: the module
+        """
+        module = importlib.import_module(module_name)
+        cls._specs[:] = cls._modules.get(module_name, [])
+        return module
 
     @classmethod
     def dispatch(cls, arguments, **kwargs):
@@ -27,6 +27,79 @@ DEFAULT_CONFIG = {
 }
 
 
+# settings for the botocore clients created by AWSClient
+# (None means botocore default)
+AWSCLIENT_CONFIG = {
+    'max_pool_connections': 20,
+    'connect_timeout': None,
+    'read_timeout': None,
+    'max_attempts': None,
+    'response_cache': False,  # see gcdt_response_cache
+    # requests per second per service shared by all threads of a process
+    # (see gcdt_throttling, None means no limit), gcdt batch divides them
+    # by the number of workers
+    'rate_limits': {
+        '__default__': 25,
+        'cloudformation': 8,
+        'lambda': 15
+    }
+}
+
+
+# error codes of AWS API calls which were throttled
+# (see gcdt_throttling, gcdt_metrics)
+THROTTLING_ERROR_CODES = [
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'RequestThrottledException', 'TooManyRequestsException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'RequestThrottled', 'SlowDown', 'PriorRequestNotComplete'
+]
+
+
+# read operations answered by the response cache (ttl in seconds)
+RESPONSE_CACHE_TTLS = {
+    'cloudformation.DescribeStacks': 60,
+    'apigateway.GetRestApis': 60,
+    'apigateway.GetResources': 60,
+    'lambda.GetFunction': 60,
+    'lambda.GetFunctionConfiguration': 60
+}
+
+
+# outputs of stacks in the stack outputs index are refreshed after
+# STACK_OUTPUTS_TTL seconds (see servicediscovery, GCDT_STACK_OUTPUTS_TTL
+# overrides it, 0 disables the index)
+# the index is opt-in: outputs changed outside of gcdt are stale for ttl
+STACK_OUTPUTS_TTL = 0
+
+
+# cloudformation quotas checked by the kumo pre-flight validation
+# the template size is a hard limit, AWS raises the quotas for the number of
+# resources, parameters and outputs from time to time so these only warn
+TEMPLATE_LIMITS = {
+    'TemplateBody': 51200,  # bytes
+    'TemplateURL': 1048576,  # bytes
+    'Resources': 500,
+    'Parameters': 200,
+    'Outputs': 200
+}
+
+
+# event driven status: SQS long polling (max 20 seconds), the describe APIs
+# are polled with EVENT_FALLBACK_INTERVAL if no event arrives
+EVENT_WAIT_TIME = 20
+EVENT_FALLBACK_INTERVAL = 60
+
+
+# services the gcdt tools use, clients for them are created in advance
+TOOL_SERVICES = {
+    'kumo': ['cloudformation', 's3', 'sts'],
+    'tenkai': ['codedeploy', 's3'],
+    'ramuda': ['lambda', 's3', 'events'],
+    'yugen': ['apigateway', 'lambda']
+}
+
+
 # note this config is used in the config_reader to "overlay" the
 # gcdt_defaults of gcdt.
 CONFIG_READER_CONFIG = {
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Event driven status of stacks and deployments.
+
+Instead of polling the describe APIs every few seconds kumo and tenkai can
+wait for the events of cloudformation and codedeploy. The events are
+published to a SNS topic:
+
+    export GCDT_EVENT_TOPIC=arn:aws:sns:eu-west-1:123456789012:gcdt-events
+
+kumo attaches the topic as NotificationARNs to the stacks. For every wait
+gcdt creates a SQS queue which is subscribed to the topic, so each gcdt
+process receives its own copy of the events and drops the events of other
+stacks and deployments. The queue is deleted after the wait. The describe
+APIs are still polled with EVENT_FALLBACK_INTERVAL in case an event is lost
+or the queue is not available.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+from contextlib import contextmanager
+
+from .gcdt_defaults import EVENT_WAIT_TIME, EVENT_FALLBACK_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+def get_event_topic():
+    """SNS topic for the cloudformation and codedeploy events.
+
+    :return: topic arn or None
+    """
+    return os.environ.get('GCDT_EVENT_TOPIC') or None
+
+
+def _get_queue_policy(queue_arn, topic):
+    return json.dumps({
+        'Version': '2012-10-17',
+        'Statement': [{
+            'Effect': 'Allow',
+            'Principal': {'Service': 'sns.amazonaws.com'},
+            'Action': 'sqs:SendMessage',
+            'Resource': queue_arn,
+            'Condition': {'ArnEquals': {'aws:SourceArn': topic}}
+        }]
+    })
+
+
+@contextmanager
+def open_event_queue(awsclient, topic):
+    """Queue which receives the events of the topic while we wait.
+
+    The queue is created and subscribed to the topic on enter and removed
+    on exit. If that fails we yield None and the caller polls.
+
+    :param awsclient:
+    :param topic: topic arn (None: no events, the caller polls)
+    :return: EventQueue or None
+    """
+    if not topic:
+        yield None
+        return
+    client_sqs = awsclient.get_client('sqs')
+    client_sns = awsclient.get_client('sns')
+    queue_url, subscription = None, None
+    try:
+        # queue names can not be reused for 60 seconds after the delete
+        name = 'gcdt-events-%s-%s' % (
+            socket.gethostname().split('.')[0][:20], uuid.uuid4().hex)
+        queue_url = client_sqs.create_queue(QueueName=name)['QueueUrl']
+        queue_arn = client_sqs.get_queue_attributes(
+            QueueUrl=queue_url,
+            AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+        client_sqs.set_queue_attributes(
+            QueueUrl=queue_url,
+            Attributes={'Policy': _get_queue_policy(queue_arn, topic)})
+        subscription = client_sns.subscribe(
+            TopicArn=topic, Protocol='sqs',
+            Endpoint=queue_arn)['SubscriptionArn']
+    except Exception as e:
+        log.warning('can not subscribe to the event topic, falling back to '
+                    'polling: %s', e)
+    try:
+        yield EventQueue(client_sqs, queue_url) if subscription else None
+    finally:
+        try:
+            if subscription:
+                client_sns.unsubscribe(SubscriptionArn=subscription)
+            if queue_url:
+                client_sqs.delete_queue(QueueUrl=queue_url)
+        except Exception as e:
+            log.warning('can not remove the event queue %s: %s',
+                        queue_url, e)
+
+
+def parse_stack_event(message):
+    """Parse the notification cloudformation sends to the NotificationARNs.
+
+    The message consists of lines like "ResourceStatus='CREATE_COMPLETE'".
+
+    :param message: SNS message
+    :return: dict with the fields of the stack event
+    """
+    event = {}
+    for line in message.splitlines():
+        key, sep, value = line.partition('=')
+        if sep and len(value) >= 2 and value[0] == value[-1] == '\'':
+            event[key] = value[1:-1]
+    return event
+
+
+def parse_deployment_event(message):
+    """Parse the notification of a codedeploy trigger.
+
+    :param message: SNS message
+    :return: dict with deploymentId, status, ... (empty if this is no
+        codedeploy notification)
+    """
+    try:
+        event = json.loads(message)
+    except ValueError:
+        return {}
+    if not isinstance(event, dict):
+        return {}
+    return event
+
+
+def _get_message(body):
+    # SNS wraps the message unless raw message delivery is enabled
+    try:
+        envelope = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(envelope, dict) and \
+            envelope.get('Type') == 'Notification' and 'Message' in envelope:
+        return envelope['Message']
+    return body
+
+
+class EventQueue(object):
+    def __init__(self, client, queue_url):
+        """SQS queue which receives the events from the event topic (only
+        this gcdt process reads the queue).
+
+        :param client: sqs client (or a stand-in with the same methods)
+        :param queue_url:
+        """
+        self._client = client
+        self._queue_url = queue_url
+        self.available = True
+
+    def _receive(self, wait_time):
+        response = self._client.receive_message(
+            QueueUrl=self._queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=wait_time
+        )
+        return response.get('Messages', [])
+
+    def _delete(self, message):
+        # events of other stacks and deployments are of no use to us
+        self._client.delete_message(QueueUrl=self._queue_url,
+                                    ReceiptHandle=message['ReceiptHandle'])
+
+    def wait(self, match, timeout=EVENT_FALLBACK_INTERVAL):
+        """Wait until an event arrives which matches or until the timeout
+        expires. If the queue is not available this falls back to sleeping
+        for the timeout so the caller continues to poll.
+
+        :param match: function which gets the message and returns True if
+            the caller is interested in it
+        :param timeout: seconds
+        :return: True if a matching event arrived
+        """
+        deadline = time.time() + timeout
+        while self.available:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                messages = self._receive(
+                    int(min(EVENT_WAIT_TIME, max(1, remaining))))
+                matched = False
+                for message in messages:
+                    if match(_get_message(message['Body'])):
+                        matched = True
+                    self._delete(message)
+            except Exception as e:
+                log.warning('event queue is not available, falling back to '
+                            'polling: %s', e)
+                self.available = False
+                break
+            if matched:
+                return True
+        remaining = deadline - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        return False
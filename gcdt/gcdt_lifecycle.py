@@ -3,23 +3,24 @@ from __future__ import unicode_literals, print_function
 import os
 import sys
 import imp
+import time
 import logging
 from copy import deepcopy
 
 from docopt import docopt
-import botocore.session
 from clint.textui import colored
 from botocore.vendored import requests
 from logging.config import dictConfig
 
 from . import gcdt_signals
-from .gcdt_defaults import DEFAULT_CONFIG
+from .gcdt_defaults import DEFAULT_CONFIG, TOOL_SERVICES
 from .utils import get_context, check_gcdt_update, are_credentials_still_valid, \
     get_env
 from .gcdt_cmd_dispatcher import cmd, get_command
-from .gcdt_plugins import load_plugins
+from .gcdt_plugins import load_plugins, load_plugins_for_signal
 from .gcdt_awsclient import AWSClient
 from .gcdt_logging import logging_config
+from .gcdt_metrics import setup_api_metrics
 from .gcdt_signals import check_hook_mechanism_is_intact, \
     check_register_present
 
@@ -60,69 +61,138 @@ def _load_hooks(path):
     return module
 
 
-# lifecycle implementation adapted from
-# https://github.com/finklabs/aws-deploy/blob/master/aws_deploy/tool.py
-def lifecycle(awsclient, env, tool, command, arguments):
-    """Tool lifecycle which provides hooks into the different stages of the
-    command execution. See signals for hook details.
+def _get_receiver_name(receiver):
+    return '%s.%s' % (getattr(receiver, '__module__', None),
+                      getattr(receiver, '__name__', repr(receiver)))
+
+
+def _send_signal(signal, payload):
+    """Fire the signal after loading the plugins which listen to it.
+
+    The duration of the signal and of each receiver is recorded in
+    context['timings'].
+
+    :param signal: one of the gcdt_signals
+    :param payload: context or (context, config)
     """
-    load_plugins()
-    context = get_context(awsclient, env, tool, command, arguments)
-    # every tool needs a awsclient so we provide this via the context
-    context['_awsclient'] = awsclient
-    log.debug('### context:')
-    log.debug(context)
-    if 'error' in context:
-        # no need to send an 'error' signal here
-        return 1
+    context = payload[0] if isinstance(payload, tuple) else payload
+    timings = context.setdefault('timings', {'phases': [], 'receivers': []})
+    start = time.time()
+    load_plugins_for_signal(signal.name)
+    for receiver in signal.receivers_for(payload):
+        receiver_start = time.time()
+        receiver(payload)
+        timings['receivers'].append({
+            'phase': signal.name,
+            'receiver': _get_receiver_name(receiver),
+            'duration': time.time() - receiver_start
+        })
+    timings['phases'].append({
+        'phase': signal.name,
+        'duration': time.time() - start
+    })
+
+
+def _log_timings(context):
+    """Print the timings as table in DEBUG mode (--verbose).
+
+    :param context:
+    """
+    if 'timings' not in context or not log.isEnabledFor(logging.DEBUG):
+        return
+    from tabulate import tabulate
+    table = [['Phase', 'Receiver', 'Duration']]
+    for phase in context['timings']['phases']:
+        table.append([phase['phase'], '', '%.3fs' % phase['duration']])
+        for receiver in context['timings']['receivers']:
+            if receiver['phase'] == phase['phase']:
+                table.append(['', receiver['receiver'],
+                              '%.3fs' % receiver['duration']])
+    log.debug('### timings:\n%s', tabulate(table, headers='firstrow'))
 
-    ## initialized
-    gcdt_signals.initialized.send(context)
-    check_gcdt_update()
 
+def read_config(context, lookups=True):
+    """Read the config like the lifecycle does: config reader, lookups
+    (e.g. SSM parameters and secrets) and validation are provided by the
+    plugins which listen to the signals.
+
+    :param context: tool context (see get_context)
+    :param lookups: resolve the lookups and validate the config (otherwise
+        the config contains the 'lookup:...' strings)
+    :return: config
+    """
     config = deepcopy(DEFAULT_CONFIG)
     # TODO move this to glomex-checks plugin!
     #if not check_vpn_connection(config['reposerver']):
     #    print(colored.red('Can not connect to VPN please activate your VPN!'))
     #    return 1
 
-    gcdt_signals.config_read_init.send((context, config))
-    gcdt_signals.config_read_finalized.send((context, config))
+    _send_signal(gcdt_signals.config_read_init, (context, config))
+    _send_signal(gcdt_signals.config_read_finalized, (context, config))
     # TODO we might want to be able to override config via env variables?
     # here would be the right place to do this
     if 'hookfile' in config:
         # load hooks from hookfile
         _load_hooks(config['hookfile'])
+    if not lookups:
+        return config
 
     ## lookup
     # credential retrieval should be done using lookups
-    gcdt_signals.lookup_init.send((context, config))
-    gcdt_signals.lookup_finalized.send((context, config))
+    _send_signal(gcdt_signals.lookup_init, (context, config))
+    _send_signal(gcdt_signals.lookup_finalized, (context, config))
     log.debug('### config after lookup:')
     log.debug(config)
 
     ## config validation
-    gcdt_signals.config_validation_init.send((context, config))
-    gcdt_signals.config_validation_finalized.send((context, config))
+    _send_signal(gcdt_signals.config_validation_init, (context, config))
+    _send_signal(gcdt_signals.config_validation_finalized, (context, config))
+    return config
+
+
+# lifecycle implementation adapted from
+# https://github.com/finklabs/aws-deploy/blob/master/aws_deploy/tool.py
+def lifecycle(awsclient, env, tool, command, arguments):
+    """Tool lifecycle which provides hooks into the different stages of the
+    command execution. See signals for hook details.
+    """
+    load_plugins(lazy=True)
+    context = get_context(awsclient, env, tool, command, arguments)
+    # every tool needs a awsclient so we provide this via the context
+    context['_awsclient'] = awsclient
+    log.debug('### context:')
+    log.debug(context)
+    if 'error' in context:
+        # no need to send an 'error' signal here
+        return 1
+
+    ## initialized
+    _send_signal(gcdt_signals.initialized, context)
+    check_gcdt_update()
+
+    config = read_config(context)
 
     ## check credentials are valid (AWS services)
     if are_credentials_still_valid(awsclient):
         context['error'] = \
             'Your credentials have expired... Please renew and try again!'
         log.error(context['error'])
-        gcdt_signals.error.send((context, config))
+        _send_signal(gcdt_signals.error, (context, config))
+        _log_timings(context)
         return 1
 
     ## bundle step
-    gcdt_signals.bundle_pre.send((context, config))
-    gcdt_signals.bundle_init.send((context, config))
-    gcdt_signals.bundle_finalized.send((context, config))
+    _send_signal(gcdt_signals.bundle_pre, (context, config))
+    _send_signal(gcdt_signals.bundle_init, (context, config))
+    _send_signal(gcdt_signals.bundle_finalized, (context, config))
     if 'error' in context:
-        gcdt_signals.error.send((context, config))
+        _send_signal(gcdt_signals.error, (context, config))
+        _log_timings(context)
         return 1
 
     ## dispatch command providing context and config (= tooldata)
-    gcdt_signals.command_init.send((context, config))
+    _send_signal(gcdt_signals.command_init, (context, config))
+    start = time.time()
     try:
         exit_code = cmd.dispatch(arguments,
                                  context=context,
@@ -131,15 +201,21 @@ def lifecycle(awsclient, env, tool, command, arguments):
         print(str(e))
         context['error'] = str(e)
         exit_code = 1
+    context['timings']['phases'].append({
+        'phase': 'command',
+        'duration': time.time() - start
+    })
     if exit_code:
-        gcdt_signals.error.send((context, config))
+        _send_signal(gcdt_signals.error, (context, config))
+        _log_timings(context)
         return 1
 
-    gcdt_signals.command_finalized.send((context, config))
+    _send_signal(gcdt_signals.command_finalized, (context, config))
 
     # TODO reporting (in case you want to get a summary / output to the user)
 
-    gcdt_signals.finalized.send(context)
+    _send_signal(gcdt_signals.finalized, context)
+    _log_timings(context)
     return 0
 
 
@@ -148,6 +224,8 @@ def main(doc, tool, dispatch_only=None):
 
     :param doc: docopt string
     :param tool: gcdt tool (gcdt, kumo, tenkai, ramuda, yugen)
+    :param dispatch_only: commands that do not need a lifecycle, a
+        (command, option) tuple is dispatched only if the option is given
     :return: exit_code
     """
     arguments = docopt(doc, sys.argv[1:])
@@ -167,10 +245,24 @@ def main(doc, tool, dispatch_only=None):
     assert tool in ['gcdt', 'kumo', 'tenkai', 'ramuda', 'yugen']
 
     command = get_command(arguments)
-    if command in dispatch_only:
+    if command in dispatch_only or any(
+            isinstance(d, tuple) and d[0] == command and arguments.get(d[1])
+            for d in dispatch_only):
         # handle commands that do not need a lifecycle
         check_gcdt_update()
         return cmd.dispatch(arguments)
     else:
-        awsclient = AWSClient(botocore.session.get_session())
-        return lifecycle(awsclient, env, tool, command, arguments)
+        import botocore.session
+        awsclient = AWSClient(
+            botocore.session.get_session(),
+            response_cache=bool(os.environ.get('GCDT_RESPONSE_CACHE')))
+        # the metrics handlers are registered before the clients are created
+        # (gcdt_metrics holds the reference to the active ApiMetrics)
+        setup_api_metrics(awsclient)
+        awsclient.create_clients(TOOL_SERVICES.get(tool, []))
+        exit_code = lifecycle(awsclient, env, tool, command, arguments)
+        cache_stats = awsclient.get_cache_stats()
+        if cache_stats:
+            log.info('response cache: %d hits, %d misses',
+                     cache_stats['hits'], cache_stats['misses'])
+        return exit_code
@@ -3,11 +3,15 @@
 """The 'gcdt' tool provides 'common' tasks.
 """
 from __future__ import unicode_literals, print_function
+import os
 import sys
 
 from . import utils
 from . import gcdt_lifecycle
+from .gcdt_batch import batch
+from .gcdt_server import serve, submit
 from .gcdt_cmd_dispatcher import cmd
+from .gcdt_awsclient import AWSClient
 from banana.router import Router
 from banana.routes import run
 from whaaaaat import color_print as cp
@@ -20,8 +24,15 @@ DOC = '''Usage:
         gcdt version
         gcdt list
         gcdt generate <generator>
+        gcdt batch [--workers=<n>] [--logdir=<dir>] [--fail-fast] <manifest>
+        gcdt serve [--socket=<path>]
+        gcdt submit [--socket=<path>] <tool> <command>
 
 -h --help           show this
+--workers=<n>       max number of jobs running in parallel
+--logdir=<dir>      write the output of each job to a separate logfile
+--fail-fast         do not start any more jobs after a job failed
+--socket=<path>     Unix socket of the gcdt server (default in gcdt cache folder)
 '''
 
 
@@ -51,9 +62,33 @@ def list_cmd():
         print('  - %s' % g)
 
 
+@cmd(spec=['batch', '--workers', '--logdir', '--fail-fast', '<manifest>'])
+def batch_cmd(workers, logdir, fail_fast, manifest):
+    return batch(manifest, workers=workers, logdir=logdir,
+                 fail_fast=fail_fast)
+
+
+@cmd(spec=['serve', '--socket'])
+def serve_cmd(socket):
+    import botocore.session
+
+    def _create_awsclient():
+        return AWSClient(
+            botocore.session.get_session(),
+            response_cache=bool(os.environ.get('GCDT_RESPONSE_CACHE')))
+
+    return serve(_create_awsclient, socket and os.path.expanduser(socket))
+
+
+@cmd(spec=['submit', '--socket', '<tool>', '<command>'])
+def submit_cmd(socket, tool, command):
+    return submit(tool, command, socket and os.path.expanduser(socket))
+
+
 def main():
     sys.exit(gcdt_lifecycle.main(DOC, 'gcdt',
-                                 dispatch_only=['version', 'generate', 'list']))
+                                 dispatch_only=['version', 'generate', 'list',
+                                                'batch', 'serve', 'submit']))
 
 
 if __name__ == '__main__':
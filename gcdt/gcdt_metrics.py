@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Collect metrics for the AWS API calls of a gcdt command.
+
+Counts, latency histograms, errors, retries and throttling are recorded
+per service and operation via the botocore event hooks of AWSClient.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import json
+import time
+import logging
+import threading
+
+from . import gcdt_signals
+from .gcdt_defaults import THROTTLING_ERROR_CODES
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# the ApiMetrics which receive the lifecycle signals (the signals only hold
+# weak references to the receivers)
+_active = None
+
+
+def _get_operation(model):
+    return '%s.%s' % (model.service_model.endpoint_prefix, model.name)
+
+
+def _get_bucket(duration):
+    for bucket in LATENCY_BUCKETS:
+        if duration <= bucket:
+            return '<=%s' % bucket
+    return '>%s' % LATENCY_BUCKETS[-1]
+
+
+class ApiMetrics(object):
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._job_id = None
+
+    def register(self, awsclient):
+        """Hook into the API calls made via awsclient.
+
+        :param awsclient:
+        """
+        awsclient.register('before-parameter-build.*.*', self._before_call,
+                           unique_id='gcdt-metrics-before-call')
+        awsclient.register('after-call.*.*', self._after_call,
+                           unique_id='gcdt-metrics-after-call')
+        awsclient.register('needs-retry.*.*', self._needs_retry,
+                           unique_id='gcdt-metrics-needs-retry')
+
+    def reset(self, job_id=None):
+        """Forget the API calls recorded so far (e.g. in a forked worker
+        which inherited the counters of its parent).
+
+        :param job_id: the metrics file of a batch job is
+            '<GCDT_METRICS_FILE>-<job_id>' so the jobs do not overwrite
+            each other
+        """
+        with self._lock:
+            self._operations = {}
+            self._job_id = job_id
+
+    def _get_stats(self, operation):
+        # note: caller needs to hold the lock
+        if operation not in self._operations:
+            self._operations[operation] = {
+                'count': 0, 'errors': 0, 'retries': 0, 'throttled': 0,
+                'duration': 0.0, 'max_duration': 0.0, 'histogram': {}
+            }
+        return self._operations[operation]
+
+    def _before_call(self, model, context, **kwargs):
+        context['gcdt_metrics_start'] = time.time()
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        duration = time.time() - context.get('gcdt_metrics_start', time.time())
+        metadata = parsed.get('ResponseMetadata', {})
+        with self._lock:
+            stats = self._get_stats(_get_operation(model))
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            bucket = _get_bucket(duration)
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+            stats['retries'] += metadata.get('RetryAttempts', 0)
+            if http_response.status_code >= 300:
+                stats['errors'] += 1
+
+    def _needs_retry(self, response=None, operation=None, **kwargs):
+        # called for every attempt, so we see throttling even if the
+        # retry succeeds
+        if response is None or operation is None:
+            return
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            with self._lock:
+                self._get_stats(_get_operation(operation))['throttled'] += 1
+
+    def get_summary(self):
+        """Aggregated metrics of all API calls.
+
+        :return: dictionary
+        """
+        with self._lock:
+            operations = json.loads(json.dumps(self._operations))
+        summary = {'operations': operations}
+        for key in ['count', 'errors', 'retries', 'throttled', 'duration']:
+            summary[key] = sum(o[key] for o in operations.values())
+        return summary
+
+    def print_summary(self, summary=None):
+        """Log the summary (table of all operations in DEBUG mode).
+
+        :param summary:
+        """
+        if summary is None:
+            summary = self.get_summary()
+        log.info('%d AWS API calls in %.1fs (%d errors, %d retries, '
+                 '%d throttled)', summary['count'], summary['duration'],
+                 summary['errors'], summary['retries'], summary['throttled'])
+        if not summary['operations'] or not log.isEnabledFor(logging.DEBUG):
+            return
+        from tabulate import tabulate
+        table = [['Operation', 'Calls', 'Errors', 'Retries', 'Throttled',
+                  'Avg', 'Max']]
+        for name, stats in sorted(summary['operations'].items(),
+                                  key=lambda o: o[1]['duration'],
+                                  reverse=True):
+            table.append([name, stats['count'], stats['errors'],
+                          stats['retries'], stats['throttled'],
+                          '%.3fs' % (stats['duration'] / stats['count']
+                                     if stats['count'] else 0),
+                          '%.3fs' % stats['max_duration']])
+        log.debug('### AWS API calls:\n%s', tabulate(table,
+                                                     headers='firstrow'))
+
+    def on_command_finalized(self, params):
+        """Receiver for the 'command_finalized' signal so the summary in
+        context['api_metrics'] is available to the 'finalized' receivers.
+
+        :param params: context, config
+        """
+        context, _ = params
+        context['api_metrics'] = self.get_summary()
+
+    def on_finalized(self, context):
+        """Receiver for the 'finalized' signal: updates the summary in
+        context['api_metrics'], prints it and writes it to the file given
+        in the GCDT_METRICS_FILE environment variable.
+
+        :param context:
+        """
+        self._report(context)
+
+    def on_error(self, params):
+        """Receiver for the 'error' signal: a failing command is reported
+        like a successful one.
+
+        :param params: context, config
+        """
+        context, _ = params
+        self._report(context)
+
+    def _report(self, context):
+        summary = self.get_summary()
+        context['api_metrics'] = summary
+        self.print_summary(summary)
+        metrics_file = os.environ.get('GCDT_METRICS_FILE')
+        if metrics_file:
+            if self._job_id is not None:
+                root, ext = os.path.splitext(metrics_file)
+                metrics_file = '%s-%s%s' % (root, self._job_id, ext)
+            # write to a temporary file first so nobody reads a partially
+            # written file
+            tmp_file = '%s.%d.tmp' % (metrics_file, os.getpid())
+            with open(tmp_file, 'w') as mfile:
+                json.dump(summary, mfile, indent=2, sort_keys=True)
+            os.rename(tmp_file, metrics_file)
+
+
+def setup_api_metrics(awsclient):
+    """Record the API calls of awsclient and report them when the gcdt
+    lifecycle is finalized.
+
+    :param awsclient:
+    :return: ApiMetrics (the signals use weak references so the module
+        keeps a reference to the active one until the next setup)
+    """
+    global _active
+    if _active is not None:
+        # only one summary per lifecycle
+        gcdt_signals.command_finalized.disconnect(
+            _active.on_command_finalized)
+        gcdt_signals.finalized.disconnect(_active.on_finalized)
+        gcdt_signals.error.disconnect(_active.on_error)
+    api_metrics = ApiMetrics()
+    api_metrics.register(awsclient)
+    gcdt_signals.command_finalized.connect(api_metrics.on_command_finalized)
+    gcdt_signals.finalized.connect(api_metrics.on_finalized)
+    gcdt_signals.error.connect(api_metrics.on_error)
+    _active = api_metrics
+    return api_metrics
@@ -1,30 +1,183 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import os
+import sys
+import json
+import hashlib
 import logging
+import importlib
 
-import pkg_resources
+from blinker import NamedSignal
 
+from gcdt import gcdt_signals
 from gcdt.gcdt_signals import check_hook_mechanism_is_intact, \
     check_register_present
+from gcdt.utils import read_cache_file, write_cache_file
 
 log = logging.getLogger(__name__)
 
+PLUGIN_INDEX_FILE = 'plugin_index.json'
+
+_registered_plugins = []  # plugins that are already registered
+_pending_plugins = {}  # signal name -> plugins waiting for the signal
+_plugin_signals = {}  # plugin -> names of the signals it listens to
+
 
 # TODO we have all plugins in one single repo so we need a mechanism to filter
 # the ones we want to use!
 
 
-def load_plugins(group='gcdt10'):
+def _register_plugin(plugin):
+    """Register the plugin so it listens to gcdt_signals.
+
+    :param plugin: plugin module
+    :return: True if the plugin is registered
+    """
+    if plugin in _registered_plugins:
+        return True
+    if check_hook_mechanism_is_intact(plugin):
+        if check_register_present(plugin):
+            before = _get_receivers()
+            plugin.register()
+            _registered_plugins.append(plugin)
+            _plugin_signals[plugin] = sorted(set(
+                name for name, _ in _get_receivers() - before))
+            return True
+    else:
+        log.warning('No valid hook configuration: %s. Not using hooks!', plugin)
+    return False
+
+
+def load_plugins(group='gcdt10', lazy=False):
     """Load and register installed gcdt plugins.
+
+    :param group: entry point group of the plugins
+    :param lazy: use the plugin index and import plugins on demand
+        (see load_plugins_for_signal)
     """
+    if lazy and _load_plugin_index(group):
+        return
     # on using entrypoints:
     # http://stackoverflow.com/questions/774824/explain-python-entry-points
     # TODO: make sure we do not have conflicting generators installed!
+    # pkg_resources scans all installed distributions on import
+    import pkg_resources
+    index = []
     for ep in pkg_resources.iter_entry_points(group, name=None):
         plugin = ep.load()  # load the plugin
-        if check_hook_mechanism_is_intact(plugin):
-            if check_register_present(plugin):
-                plugin.register()   # register the plugin so it listens to gcdt_signals
-        else:
-            log.warning('No valid hook configuration: %s. Not using hooks!', plugin)
+        _register_plugin(plugin)
+        if lazy:
+            # note: entry points can share a plugin so we use the signals
+            # recorded when the plugin was registered
+            index.append({
+                'name': ep.name,
+                'module': ep.module_name,
+                'attrs': list(ep.attrs),
+                'signals': _plugin_signals.get(plugin, []),
+                'files': _get_plugin_files(ep)
+            })
+    if lazy:
+        write_cache_file(PLUGIN_INDEX_FILE, {
+            'fingerprint': get_environment_fingerprint(),
+            'group': group,
+            'plugins': index
+        })
+
+
+def load_plugins_for_signal(signal_name):
+    """Import and register the plugins interested in the signal.
+
+    :param signal_name: name of the signal that is about to fire
+    """
+    for entry in _pending_plugins.pop(signal_name, []):
+        plugin = importlib.import_module(entry['module'])
+        for attr in entry['attrs']:
+            plugin = getattr(plugin, attr)
+        log.debug('lazy loading plugin \'%s\' for signal \'%s\'',
+                  entry['name'], signal_name)
+        _register_plugin(plugin)
+        # the plugin is registered for all of its signals now
+        for pending in _pending_plugins.values():
+            if entry in pending:
+                pending.remove(entry)
+
+
+def get_environment_fingerprint():
+    """Fingerprint of the installed distributions.
+
+    Installing or removing a distribution changes the modification time of
+    the folder it is installed to, so we use the folders on sys.path
+    together with their modification times.
+
+    :return: fingerprint
+    """
+    entries = [sys.executable]
+    for path in sys.path:
+        if os.path.exists(path):
+            entries.append('%s:%s' % (path, os.path.getmtime(path)))
+    return hashlib.sha1(json.dumps(entries)).hexdigest()
+
+
+def _get_plugin_files(ep):
+    """Files which change when the code of the plugin or its distribution
+    changes (also for 'develop' installs which are not below sys.path).
+
+    :param ep: entry point
+    :return: dictionary path -> modification time
+    """
+    paths = []
+    source = getattr(sys.modules.get(ep.module_name), '__file__', None)
+    if source:
+        if source.endswith(('.pyc', '.pyo')):
+            source = source[:-1]
+        paths.append(source)
+        if os.path.basename(source) == '__init__.py':
+            # all modules of the plugin package
+            for root, _, files in os.walk(os.path.dirname(source)):
+                paths.extend(os.path.join(root, f) for f in files
+                             if f.endswith('.py'))
+    dist = getattr(ep, 'dist', None)
+    if dist is not None:
+        # the metadata is rewritten when the version or the entry points
+        # change
+        paths.extend(p for p in [getattr(dist, 'egg_info', None),
+                                 dist.location] if p)
+    return dict((p, os.path.getmtime(p)) for p in paths if os.path.exists(p))
+
+
+def _files_unchanged(files):
+    for path, mtime in files.items():
+        if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+            return False
+    return True
+
+
+def _get_receivers():
+    # (signal name, receiver id) of all receivers connected to gcdt_signals
+    receivers = set()
+    for sig in vars(gcdt_signals).values():
+        if isinstance(sig, NamedSignal):
+            receivers.update((sig.name, r) for r in sig.receivers)
+    return receivers
+
+
+def _load_plugin_index(group):
+    """Prepare lazy loading of the plugins from the plugin index.
+
+    :param group: entry point group of the plugins
+    :return: True if the index is valid for the current environment
+    """
+    index = read_cache_file(PLUGIN_INDEX_FILE)
+    if not index or index.get('group') != group or \
+            index.get('fingerprint') != get_environment_fingerprint():
+        return False
+    if not all(_files_unchanged(entry.get('files', {}))
+               for entry in index['plugins']):
+        return False
+    for entry in index['plugins']:
+        for signal_name in entry['signals']:
+            pending = _pending_plugins.setdefault(signal_name, [])
+            if entry not in pending:
+                pending.append(entry)
+    return True
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Read-through cache for idempotent AWS API calls.
+
+Only the operations configured in RESPONSE_CACHE_TTLS are cached. Any call
+of a mutating operation invalidates the cached responses of the same service
+and region which might refer to the same resource (before and after the
+call). Responses of reads which overlap with a mutating call of the same
+service and region are not cached.
+Identical calls which are in flight at the same time in different threads
+are coalesced into a single API call.
+"""
+from __future__ import unicode_literals, print_function
+import json
+import copy
+import time
+import logging
+import threading
+
+from .gcdt_defaults import RESPONSE_CACHE_TTLS
+
+log = logging.getLogger(__name__)
+
+READ_PREFIXES = ('Describe', 'Get', 'List', 'Head')
+
+
+def _is_cacheable(operation_name, response):
+    # stacks in transition change their state and outputs so we keep
+    # asking cloudformation for them
+    if operation_name == 'DescribeStacks':
+        return not any(s.get('StackStatus', '').endswith('_IN_PROGRESS')
+                       for s in response.get('Stacks', []))
+    return True
+
+
+def _is_arn_or_id(value):
+    # e.g. stack id, function ARN or partial ARN ('123456789012:function:f')
+    return isinstance(value, basestring) and ':' in value
+
+
+def _refers_to_same_resource(params, mutating_params):
+    # the resource is the same unless an identifying parameter differs
+    # (e.g. StackName, FunctionName, restApiId)
+    # a name and an ARN (or id) might refer to the same resource
+    for key, value in params.items():
+        if key in mutating_params and mutating_params[key] != value and \
+                not (_is_arn_or_id(value) or
+                     _is_arn_or_id(mutating_params[key])):
+            return False
+    return True
+
+
+class ResponseCache(object):
+    def __init__(self, ttls=None):
+        """
+        :param ttls: '<service>.<Operation>' -> ttl in seconds
+            (default RESPONSE_CACHE_TTLS)
+        """
+        self._ttls = RESPONSE_CACHE_TTLS if ttls is None else ttls
+        self._entries = {}  # key -> (expires, params, response)
+        self._in_flight = {}  # key -> threading.Event
+        # (service, region) -> number of mutating calls started / running
+        self._generations = {}
+        self._mutating = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def wrap_client(self, client):
+        """Route the API calls of the botocore client through the cache.
+
+        :param client: botocore client
+        :return: client
+        """
+        make_api_call = client._make_api_call
+
+        def _cached_api_call(operation_name, api_params):
+            return self.call(client, make_api_call, operation_name,
+                             api_params)
+
+        client._make_api_call = _cached_api_call
+        return client
+
+    def call(self, client, make_api_call, operation_name, api_params):
+        """Answer the call from the cache or make the API call.
+
+        :param client: botocore client
+        :param make_api_call: the original _make_api_call of the client
+        :param operation_name: e.g. 'DescribeStacks'
+        :param api_params: parameters of the call
+        :return: response
+        """
+        service = client.meta.service_model.endpoint_prefix
+        region = client.meta.region_name
+        ttl = self._ttls.get('%s.%s' % (service, operation_name))
+        if ttl is None:
+            if operation_name.startswith(READ_PREFIXES):
+                return make_api_call(operation_name, api_params)
+            return self._mutate(service, region, make_api_call,
+                                operation_name, api_params)
+
+        key = (service, region, operation_name,
+               json.dumps(api_params, sort_keys=True, default=str))
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.time():
+                    self.hits += 1
+                    return copy.deepcopy(entry[2])
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    # we make the call
+                    in_flight = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    generation = self._generations.get((service, region), 0)
+                    break
+            # an identical call is in flight so we wait for its response
+            in_flight.wait()
+
+        try:
+            response = make_api_call(operation_name, api_params)
+            if _is_cacheable(operation_name, response):
+                with self._lock:
+                    # the response might be outdated if a mutating call
+                    # started in the meantime
+                    if not self._mutating.get((service, region)) and \
+                            self._generations.get((service, region), 0) == \
+                            generation:
+                        self._entries[key] = (time.time() + ttl, api_params,
+                                              copy.deepcopy(response))
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.set()
+
+    def _mutate(self, service, region, make_api_call, operation_name,
+                api_params):
+        scope = (service, region)
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            self._mutating[scope] = self._mutating.get(scope, 0) + 1
+        self.invalidate(service, region, api_params)
+        try:
+            return make_api_call(operation_name, api_params)
+        finally:
+            # reads which ran concurrently must not serve the old state
+            with self._lock:
+                self._mutating[scope] -= 1
+                self._generations[scope] += 1
+            self.invalidate(service, region, api_params)
+
+    def invalidate(self, service, region, api_params):
+        """Remove the cached responses which might be affected by a mutating
+        call.
+
+        :param service: endpoint prefix of the service
+        :param region:
+        :param api_params: parameters of the mutating call
+        """
+        with self._lock:
+            for key, (_, params, _) in self._entries.items():
+                if key[:2] == (service, region) and \
+                        _refers_to_same_resource(params, api_params):
+                    log.debug('invalidate cached %s.%s', service, key[2])
+                    del self._entries[key]
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
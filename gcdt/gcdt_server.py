@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Long running gcdt server which executes tool commands for thin clients.
+
+`gcdt serve` sets up plugins, botocore clients and credentials once and then
+listens on a Unix socket. `gcdt submit` sends a job to the server:
+
+    {"tool": "kumo", "command": "deploy", "path": "/abs/path", "env": "dev"}
+
+The server forks a worker per job (like gcdt batch) which streams the output
+of the job back over the socket. The exit code of the job is sent after the
+output, separated by EXIT_CODE_MARKER.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import json
+import socket
+import logging
+import SocketServer
+
+from .gcdt_batch import TOOLS, warm_up, execute_job, redirect_output_to_fd
+from .utils import get_cache_dir, get_env, are_credentials_still_valid
+
+log = logging.getLogger(__name__)
+
+EXIT_CODE_MARKER = b'\x00gcdt-exit-code:'
+
+
+def get_default_socket():
+    return os.path.join(get_cache_dir(), 'gcdt.sock')
+
+
+class _JobHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        # note: we are in the forked worker process
+        try:
+            job = json.loads(self.rfile.readline())
+            if job.get('tool') not in TOOLS:
+                raise Exception('unknown tool \'%s\'' % job.get('tool'))
+            if not all(job.get(k) for k in ['command', 'path', 'env']):
+                raise Exception('job needs command, path and env')
+        except Exception as e:
+            self.wfile.write('%s\n%s1\n' % (e, EXIT_CODE_MARKER))
+            return
+        job.setdefault('id', str(os.getpid()))
+        log.info('job %s: %s %s (%s) in %s', job['id'], job['tool'],
+                 job['command'], job['env'], job['path'])
+        redirect_output_to_fd(self.connection.fileno())
+        result = execute_job(job)
+        sys.stdout.write('%s%d\n' % (EXIT_CODE_MARKER, result['exit_code']))
+
+
+class _ForkingUnixServer(SocketServer.ForkingMixIn,
+                         SocketServer.UnixStreamServer):
+    create_awsclient = None  # set by serve
+    awsclient = None
+
+    def warm_up(self):
+        self.awsclient = self.create_awsclient()
+        warm_up(self.awsclient, [{'tool': tool} for tool in TOOLS])
+
+    def process_request(self, request, client_address):
+        # note: we are in the server process, the workers inherit the
+        # result of the credentials check (cached until they expire)
+        if self.create_awsclient is not None:
+            if are_credentials_still_valid(self.awsclient):
+                log.info('credentials are not valid any more, setting up '
+                         'a new session')
+                self.warm_up()
+            else:
+                # in case the check opened a connection
+                self.awsclient.close_connections()
+        SocketServer.ForkingMixIn.process_request(self, request,
+                                                  client_address)
+
+
+def serve(create_awsclient, socket_path=None):
+    """Execute submitted jobs until the server is interrupted.
+
+    :param create_awsclient: returns a new AWSClient, the server starts
+        over with a new one if the credentials expire
+    :param socket_path: path of the Unix socket
+    :return: exit_code
+    """
+    socket_path = socket_path or get_default_socket()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # stale socket from a previous server
+    # jobs use our credentials so only our user may submit them
+    umask = os.umask(0o077)
+    try:
+        server = _ForkingUnixServer(socket_path, _JobHandler)
+    finally:
+        os.umask(umask)
+    server.create_awsclient = create_awsclient
+    server.warm_up()
+    log.info('gcdt server listening on %s', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+    return 0
+
+
+def submit(tool, command, socket_path=None, out=None):
+    """Submit a job to the gcdt server and stream its output.
+
+    :param tool: kumo, tenkai, ramuda, yugen
+    :param command: tool command line, e.g. 'deploy --override-stack-policy'
+    :param socket_path: path of the Unix socket
+    :param out: stream for the job output (default: stdout)
+    :return: exit_code of the job
+    """
+    socket_path = socket_path or get_default_socket()
+    out = out or sys.stdout
+    job = {'tool': tool, 'command': command, 'path': os.getcwd(),
+           'env': get_env()}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as e:
+        log.error('can not connect to gcdt server on %s: %s', socket_path, e)
+        return 1
+    try:
+        sock.sendall(json.dumps(job) + '\n')
+        pending = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            if EXIT_CODE_MARKER[:1] in pending + chunk:
+                # the exit code follows the marker
+                pending += chunk
+                continue
+            out.write(chunk)
+            out.flush()
+    finally:
+        sock.close()
+    output, _, exit_code = pending.partition(EXIT_CODE_MARKER)
+    out.write(output)
+    try:
+        return int(exit_code.strip())
+    except ValueError:
+        log.error('gcdt server did not report an exit code')
+        return 1
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Client side rate limiting and throttle-aware retries for AWS API calls.
+
+Every service gets a token bucket which is shared by all threads. Each
+request (including retries) takes a token from the bucket of its service.
+When AWS throttles a request the rate of the bucket is reduced and it
+recovers slowly with every successful request.
+Retries use exponential backoff with full jitter so parallel gcdt runs do
+not retry in lockstep.
+"""
+from __future__ import unicode_literals, print_function
+import time
+import random
+import logging
+import threading
+
+from .gcdt_defaults import THROTTLING_ERROR_CODES
+
+log = logging.getLogger(__name__)
+
+# backoff in seconds (base * 2^attempt with full jitter, capped)
+THROTTLING_BACKOFF_BASE = 1.0
+ERROR_BACKOFF_BASE = 0.1
+MAX_BACKOFF = 20.0
+
+
+def is_throttled(response):
+    """Check whether AWS throttled the request.
+
+    :param response: (http_response, parsed) or None
+    :return: True / False
+    """
+    if response is None:
+        return False
+    http_response, parsed = response
+    return http_response.status_code == 429 or \
+        parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def get_backoff(attempts, throttled=False):
+    """Exponential backoff with full jitter.
+
+    :param attempts: number of attempts so far (starts with 1)
+    :param throttled: backoff for throttling is longer than for errors
+    :return: delay in seconds
+    """
+    base = THROTTLING_BACKOFF_BASE if throttled else ERROR_BACKOFF_BASE
+    return random.uniform(0, min(MAX_BACKOFF, base * 2 ** (attempts - 1)))
+
+
+def share_rate_limits(rate_limits, processes):
+    """The token buckets live in one process, parallel worker processes
+    share the budget by getting an equal part of each rate limit.
+
+    :param rate_limits: requests per second per service (None: no limit)
+    :param processes: number of processes running at the same time
+    :return: rate limits per process (at least one request per second)
+    """
+    processes = max(1, processes)
+    return dict((service, max(1.0, rate / float(processes)) if rate else rate)
+                for service, rate in (rate_limits or {}).items())
+
+
+class TokenBucket(object):
+    def __init__(self, rate, min_rate=None):
+        """Thread safe token bucket.
+
+        :param rate: tokens per second (and burst capacity, at least one
+            token)
+        :param min_rate: lower bound for the rate after throttling (at
+            least one token per second unless rate is lower)
+        """
+        self.max_rate = float(rate)
+        self.min_rate = min(self.max_rate,
+                            max(1.0, float(min_rate or rate / 10.0)))
+        self.rate = self.max_rate
+        self._tokens = self._capacity()
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        # a bucket must hold a whole token, otherwise acquire never returns
+        return max(1.0, self.rate)
+
+    def _refill(self):
+        # note: caller needs to hold the lock
+        now = time.time()
+        self._tokens = min(self._capacity(),
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """Take a token, wait until one is available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        """AWS throttled us so we halve the rate."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, self._capacity())
+
+    def succeeded(self):
+        """Recover slowly from throttling."""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+class ThrottleAwareRetryHandler(object):
+    def __init__(self, checker, max_attempts, bucket=None):
+        """Replacement for the botocore 'needs-retry' handler.
+
+        :param checker: botocore checker that decides which errors to retry
+        :param max_attempts: max attempts for throttled requests
+        :param bucket: TokenBucket of the service
+        """
+        self._checker = checker
+        self._max_attempts = max_attempts
+        self._bucket = bucket
+
+    def __call__(self, attempts, response, caught_exception, **kwargs):
+        """
+        :return: delay in seconds or None if the request is not retried
+        """
+        throttled = is_throttled(response)
+        if self._bucket:
+            if throttled:
+                self._bucket.throttled()
+            elif response is not None and response[0].status_code < 300:
+                self._bucket.succeeded()
+        if throttled:
+            retry = attempts < self._max_attempts
+        else:
+            retry = self._checker(attempts, response, caught_exception)
+        if not retry:
+            return None
+        delay = get_backoff(attempts, throttled)
+        log.debug('retry attempt %d in %.2fs (%s)', attempts, delay,
+                  'throttled' if throttled else 'error')
+        return delay
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Wait until AWS resources are ready instead of sleeping for a guessed time.
+
+A waiter calls a check function with an exponential backoff (with jitter)
+until the check reports that the resource is ready or the deadline expires.
+The check returns a tuple (done, value): if done the value is the result of
+the wait, otherwise it is the observed state of the resource. The backoff
+starts again from the initial delay whenever the state changes, so we check
+frequently while things happen and rarely while they do not.
+
+Many waiters are served from one loop (wait_for_all), so waiting for many
+resources takes as long as waiting for the slowest one.
+"""
+from __future__ import unicode_literals, print_function
+import time
+import heapq
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class WaiterTimeout(Exception):
+    pass
+
+
+class Waiter(object):
+    def __init__(self, name, check, delay=1, max_delay=15, timeout=600):
+        """Wait for one resource.
+
+        :param name: used in log and error messages, e.g. 'change set ABC'
+        :param check: function which returns (done, value)
+        :param delay: initial delay between checks in seconds
+        :param max_delay: max delay between checks in seconds
+        :param timeout: in seconds
+        """
+        self.name = name
+        self._check = check
+        self._initial_delay = delay
+        self._delay = delay
+        self._max_delay = max_delay
+        self._timeout = timeout
+        self._state = _UNSET
+        self.deadline = None
+        self.done = False
+        self.result = None
+
+    def start(self, now):
+        self.deadline = now + self._timeout
+
+    def poll(self):
+        """Check the resource once.
+
+        :return: True if the resource is ready
+        """
+        done, value = self._check()
+        if done:
+            self.done = True
+            self.result = value
+        elif value != self._state:
+            if self._state is not _UNSET:
+                log.debug('%s: state changed to %s', self.name, value)
+                self._delay = self._initial_delay
+            self._state = value
+        return self.done
+
+    def next_delay(self):
+        """Delay until the next check (full jitter on the upper half)."""
+        delay = random.uniform(self._delay / 2.0, self._delay)
+        self._delay = min(self._max_delay, self._delay * 2)
+        return delay
+
+
+def wait_for_all(waiters, sleep=None):
+    """Wait until all resources are ready.
+
+    :param waiters: list of Waiter
+    :param sleep: function which waits for the given seconds, it may return
+        early (e.g. when an event arrived) (default: time.sleep)
+    :return: list of the results in the order of the waiters
+    """
+    sleep = sleep or time.sleep
+    now = time.time()
+    schedule = []
+    for index, waiter in enumerate(waiters):
+        waiter.start(now)
+        schedule.append((now, index, waiter))
+    heapq.heapify(schedule)
+    while schedule:
+        when, index, waiter = heapq.heappop(schedule)
+        remaining = when - time.time()
+        if remaining > 0:
+            sleep(remaining)
+        if waiter.poll():
+            continue
+        now = time.time()
+        if now >= waiter.deadline:
+            raise WaiterTimeout('timeout while waiting for %s' % waiter.name)
+        heapq.heappush(schedule, (min(now + waiter.next_delay(),
+                                      waiter.deadline), index, waiter))
+    return [w.result for w in waiters]
+
+
+def wait_for(check, name, sleep=None, **kwargs):
+    """Wait until the resource is ready.
+
+    :param check: function which returns (done, value)
+    :param name: used in log and error messages
+    :param sleep: see wait_for_all
+    :param kwargs: delay, max_delay, timeout (see Waiter)
+    :return: the value of the check once done
+    """
+    return wait_for_all([Waiter(name, check, **kwargs)], sleep=sleep)[0]
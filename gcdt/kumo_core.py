@@ -2,25 +2,50 @@
 from __future__ import unicode_literals, print_function
 import imp
 import json
+import hashlib
 import random
 import string
 import sys
 import time
 import logging
+import multiprocessing
+from collections import OrderedDict
 
 import os
 import six
+from botocore.exceptions import ClientError
 from clint.textui import colored, prompt
-from pyspin.spin import Default, Spinner
-from tabulate import tabulate
 
-from .utils import get_env
-from .s3 import upload_file_to_s3
+from .utils import get_env, get_context
+from .s3 import key_exists, upload_content_to_s3
+from .servicediscovery import invalidate_stack_outputs, get_account_id
+from .gcdt_events import get_event_topic, open_event_queue, \
+    parse_stack_event
+from .gcdt_waiter import wait_for
+from .gcdt_defaults import TEMPLATE_LIMITS
+from .kumo_validate import validate_template
 from .gcdt_signals import check_hook_mechanism_is_intact, \
     check_register_present
 
 log = logging.getLogger(__name__)
 
+# template metadata key which holds the fingerprint of the last deployment
+FINGERPRINT_KEY = 'gcdt:kumo:fingerprint'
+# a stack which is not in one of these states is always updated
+FINGERPRINT_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+CHANGE_SET_FINISHED_STATUSES = ['CREATE_COMPLETE', 'FAILED',
+                                'DELETE_COMPLETE']
+# kumo list shows all stacks which are not deleted
+STACK_LIST_STATUSES = [
+    'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE',
+    'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
+    'DELETE_IN_PROGRESS', 'DELETE_FAILED', 'UPDATE_IN_PROGRESS',
+    'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED',
+    'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS',
+    'UPDATE_ROLLBACK_COMPLETE'
+]
+
 
 def load_cloudformation_template(path=None):
     """Load cloudformation template from path.
@@ -77,6 +102,8 @@ def print_parameter_diff(awsclient, config):
         # probably the stack is not existent
         return None
 
+    from tabulate import tabulate
+    from pyspin.spin import Default, Spinner
     changed = 0
     table = []
     table.append(['Parameter', 'Current Value', 'New Value'])
@@ -175,6 +202,7 @@ def _get_stack_state(client_cf, stackname):
 
 
 def _json2table(data):
+    from tabulate import tabulate
     filter_terms = ['ResponseMetadata']
     table = []
     try:
@@ -197,10 +225,111 @@ def _get_stack_events_last_timestamp(awsclient, stackname):
     client = awsclient.get_client('cloudformation')
     stack_id = _get_stack_id(awsclient, stackname)
     response = client.describe_stack_events(StackName=stack_id)
-    return response['StackEvents'][-1]['Timestamp']
+    # the newest event comes first
+    return response['StackEvents'][0]['Timestamp']
+
+
+def _get_new_stack_events(client, stack_id, seen_events, last_event=None):
+    """Page through the stack events (newest first) until we reach events we
+    have already seen.
+
+    :param client: cloudformation client
+    :param stack_id:
+    :param seen_events: set of EventIds
+    :param last_event: timestamp, older events are ignored
+    :return: list of new events (newest first)
+    """
+    new_events = []
+    kwargs = {'StackName': stack_id}
+    while True:
+        response = client.describe_stack_events(**kwargs)
+        for event in response['StackEvents']:
+            if event['EventId'] in seen_events or \
+                    (last_event and event['Timestamp'] <= last_event):
+                return new_events
+            new_events.append(event)
+        if 'NextToken' not in response:
+            return new_events
+        kwargs['NextToken'] = response['NextToken']
+
+
+def iter_stack_events(awsclient, stack_id, last_event=None,
+                      poll_interval=5, event_queue=None):
+    """Generator which yields new events of the stack in chronological order.
+    It polls until the caller stops iterating.
+
+    :param awsclient:
+    :param stack_id: use the stack id so it works for deleted stacks
+    :param last_event: timestamp, only yield events after last_event
+    :param poll_interval: seconds between polls
+    :param event_queue: EventQueue which receives the stack events, we only
+        poll after an event of the stack arrived (or the fallback interval
+        expired)
+    """
+    client = awsclient.get_client('cloudformation')
+    seen_events = set()
+    while True:
+        new_events = _get_new_stack_events(client, stack_id, seen_events,
+                                           last_event)
+        for event in reversed(new_events):
+            seen_events.add(event['EventId'])
+            yield event
+        if event_queue:
+            event_queue.wait(
+                lambda message:
+                parse_stack_event(message).get('StackId') == stack_id)
+        else:
+            time.sleep(poll_interval)
+
+
+class StackProgress(object):
+    def __init__(self, stackname, resource_count=None):
+        """Track the progress of the stack resources from the stack events.
+
+        :param stackname:
+        :param resource_count: number of resources in the template
+            (default: resources we have seen events for)
+        """
+        self._stackname = stackname
+        self._resource_count = resource_count
+        self._resources = {}  # logical id -> status
+
+    def update(self, event):
+        if event['LogicalResourceId'] != self._stackname:
+            self._resources[event['LogicalResourceId']] = \
+                event['ResourceStatus']
+
+    @property
+    def done(self):
+        return len([s for s in self._resources.values()
+                    if not s.endswith('_IN_PROGRESS')])
+
+    @property
+    def total(self):
+        return max(self._resource_count or 0, len(self._resources))
+
+    def __str__(self):
+        return '%d/%d' % (self.done, self.total)
 
 
-def _poll_stack_events(awsclient, stackname, last_event=None):
+def _get_resource_count(template_body):
+    template = json.loads(template_body)
+    return len(template.get('Resources', {}))
+
+
+def _get_deployed_resource_count(awsclient, stackname):
+    # number of resources of the deployed stack (None if not available)
+    client_cf = awsclient.get_client('cloudformation')
+    try:
+        response = client_cf.describe_stack_resources(StackName=stackname)
+    except Exception as e:
+        log.debug('can not count the resources of %s: %s', stackname, e)
+        return None
+    return len(response.get('StackResources', []))
+
+
+def _poll_stack_events(awsclient, stackname, last_event=None,
+                       resource_count=None):
     # http://stackoverflow.com/questions/796008/cant-subtract-offset-naive-and-offset-aware-datetimes/25662061#25662061
     finished_statuses = ['CREATE_COMPLETE',
                          'CREATE_FAILED',
@@ -227,41 +356,42 @@ def _poll_stack_events(awsclient, stackname, last_event=None):
                         'DELETE_COMPLETE',
                         'UPDATE_COMPLETE']
 
-    seen_events = []
-    # print len(seen_events)
-    client = awsclient.get_client('cloudformation')
     status = ''
+    progress = StackProgress(stackname, resource_count)
     # for the delete command we need the stack_id
-    stack_id = _get_stack_id(awsclient, stackname)
-    print('%-50s %-25s %-50s %-25s\n' % ('Resource Status', 'Resource ID',
-                                         'Reason', 'Timestamp'))
-    while status not in finished_statuses:
-        response = client.describe_stack_events(StackName=stack_id)
-        for event in response['StackEvents'][::-1]:
-            if event['EventId'] not in seen_events and \
-                    (not last_event or event['Timestamp'] > last_event):
-                seen_events.append(event['EventId'])
-                resource_status = event['ResourceStatus']
-                resource_id = event['LogicalResourceId']
-                # this is not always present
-                try:
-                    reason = event['ResourceStatusReason']
-                except KeyError:
-                    reason = ''
-                timestamp = str(event['Timestamp'])
-                message = '%-50s %-25s %-50s %-25s\n' % (resource_status, resource_id,
-                                                         reason, timestamp)
-                if resource_status in failed_statuses:
-                    print(colored.red(message))
-                elif resource_status in warning_statuses:
-                    print(colored.yellow(message))
-                elif resource_status in success_statuses:
-                    print(colored.green(message))
-                else:
-                    print(message)
-                if event['LogicalResourceId'] == stackname:
-                    status = event['ResourceStatus']
-        time.sleep(5)
+    client_cf = awsclient.get_client('cloudformation')
+    stack = client_cf.describe_stacks(StackName=stackname)['Stacks'][0]
+    stack_id = stack['StackId']
+    topic = get_event_topic()
+    if topic not in stack.get('NotificationARNs', []):
+        # the stack does not send its events to the topic, we poll
+        topic = None
+    print('%-50s %-25s %-50s %-25s %s\n' % ('Resource Status', 'Resource ID',
+                                            'Reason', 'Timestamp',
+                                            'Progress'))
+    with open_event_queue(awsclient, topic) as event_queue:
+        for event in iter_stack_events(awsclient, stack_id, last_event,
+                                       event_queue=event_queue):
+            progress.update(event)
+            resource_status = event['ResourceStatus']
+            resource_id = event['LogicalResourceId']
+            # this is not always present
+            reason = event.get('ResourceStatusReason', '')
+            timestamp = str(event['Timestamp'])
+            message = '%-50s %-25s %-50s %-25s %s\n' % (
+                resource_status, resource_id, reason, timestamp, progress)
+            if resource_status in failed_statuses:
+                print(colored.red(message))
+            elif resource_status in warning_statuses:
+                print(colored.yellow(message))
+            elif resource_status in success_statuses:
+                print(colored.green(message))
+            else:
+                print(message)
+            if event['LogicalResourceId'] == stackname:
+                status = event['ResourceStatus']
+                if status in finished_statuses:
+                    break
     exit_code = 0
     if status not in success_statuses:
         exit_code = 1
@@ -327,18 +457,96 @@ def deploy_stack(awsclient, conf, cloudformation, override_stack_policy=False):
     """
     stackname = _get_stack_name(conf)
     parameters = _generate_parameters(conf)
+    # we generate the template only once per deployment
+    template_body = compact_template(cloudformation.generate_template())
+    if not _validate_stack(conf, template_body, parameters):
+        return 1
     if _stack_exists(awsclient, stackname):
         exit_code = _update_stack(awsclient, conf, cloudformation,
-                                  parameters, override_stack_policy)
+                                  parameters, override_stack_policy,
+                                  template_body=template_body)
     else:
         exit_code = _create_stack(awsclient, conf, cloudformation,
-                                  parameters)
+                                  parameters, template_body=template_body)
     _call_hook(awsclient, conf, stackname, parameters, cloudformation,
                hook='post_hook',
                message='CloudFormation is done, now executing post hook...')
     return exit_code
 
 
+def _validate_stack(conf, template_body, parameters):
+    # pre-flight validation so we fail before the upload and not after a
+    # rollback of the stack
+    # templates which are too large to be sent inline go via S3
+    errors, warnings = validate_template(template_body, parameters,
+                                         s3_upload=True)
+    for warning in warnings:
+        print(colored.yellow('Warning: %s' % warning))
+    for error in errors:
+        print(colored.red('Error: %s' % error))
+    if errors:
+        print(colored.red('template validation failed, bailing out...'))
+    return not errors
+
+
+def get_fingerprint(template_body, parameters, stack_policy):
+    """Fingerprint of everything a stack update would change.
+
+    :param template_body: generated template
+    :param parameters: parameter list
+    :param stack_policy:
+    :return: sha1 hexdigest
+    """
+    data = {
+        'template': json.loads(template_body),
+        'parameters': sorted(
+            [p['ParameterKey'], p['ParameterValue']] for p in parameters),
+        'stack_policy': json.loads(stack_policy)
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+def _add_fingerprint(template_body, fingerprint):
+    # the fingerprint is stored in the template metadata, a stack tag would
+    # be propagated to all resources of the stack on every update
+    template = json.loads(template_body, object_pairs_hook=OrderedDict)
+    template.setdefault('Metadata', OrderedDict())[FINGERPRINT_KEY] = \
+        fingerprint
+    return json.dumps(template, separators=(',', ':'))
+
+
+def _get_deployed_fingerprint(awsclient, stackname):
+    # fingerprint of the last deployment
+    # (None if the last deployment did not complete)
+    client_cf = awsclient.get_client('cloudformation')
+    stack = client_cf.describe_stacks(StackName=stackname)['Stacks'][0]
+    if stack['StackStatus'] not in FINGERPRINT_STATUSES:
+        return None
+    try:
+        summary = client_cf.get_template_summary(StackName=stackname)
+        metadata = json.loads(summary.get('Metadata') or '{}')
+    except Exception as e:
+        log.debug('can not read the template metadata of %s: %s',
+                  stackname, e)
+        return None
+    return metadata.get(FINGERPRINT_KEY)
+
+
+def _get_notification_arns(awsclient, stackname=None):
+    # the event topic is added to the notifications of the stack
+    topic = get_event_topic()
+    if not topic:
+        return {}
+    arns = []
+    if stackname:
+        client_cf = awsclient.get_client('cloudformation')
+        stack = client_cf.describe_stacks(StackName=stackname)['Stacks'][0]
+        arns = stack.get('NotificationARNs', [])
+    if topic not in arns:
+        arns = arns + [topic]
+    return {'NotificationARNs': arns}
+
+
 def _get_stack_policy(cloudformation):
     default_stack_policy = json.dumps({
         'Statement': [
@@ -409,93 +617,176 @@ def _get_stack_policy_during_update(cloudformation, override_stack_policy):
     return stack_policy_during_update
 
 
-def _create_stack(awsclient, conf, cloudformation, parameters):
+def _create_stack(awsclient, conf, cloudformation, parameters,
+                  template_body=None):
     # create stack with all the information we have
     client_cf = awsclient.get_client('cloudformation')
     stackname = _get_stack_name(conf)
+    if template_body is None:
+        template_body = compact_template(cloudformation.generate_template())
+    stack_policy = _get_stack_policy(cloudformation)
+    template_body = _add_fingerprint(
+        template_body,
+        get_fingerprint(template_body, parameters, stack_policy))
     _call_hook(awsclient, conf, stackname, parameters, cloudformation,
                hook='pre_create_hook')
-    if _get_artifact_bucket(conf):
-        response = client_cf.create_stack(
-            StackName=_get_stack_name(conf),
-            TemplateURL=_s3_upload(awsclient, conf, cloudformation),
-            Parameters=parameters,
-            Capabilities=[
-                'CAPABILITY_IAM',
-            ],
-            StackPolicyBody=_get_stack_policy(cloudformation),
-        )
-    else:
-        # if we have no artifacts bucket configured then upload the template directly
-        response = client_cf.create_stack(
-            StackName=_get_stack_name(conf),
-            TemplateBody=cloudformation.generate_template(),
-            Parameters=parameters,
-            Capabilities=[
-                'CAPABILITY_IAM',
-            ],
-            StackPolicyBody=_get_stack_policy(cloudformation),
-        )
+    response = client_cf.create_stack(
+        StackName=_get_stack_name(conf),
+        Parameters=parameters,
+        Capabilities=[
+            'CAPABILITY_IAM',
+        ],
+        StackPolicyBody=stack_policy,
+        **dict(_get_template_location(awsclient, conf, cloudformation,
+                                      template_body),
+               **_get_notification_arns(awsclient))
+    )
 
-    exit_code = _poll_stack_events(awsclient, stackname)
+    exit_code = _poll_stack_events(awsclient, stackname,
+                                   resource_count=_get_resource_count(
+                                       template_body))
+    invalidate_stack_outputs(awsclient, stackname)
     _call_hook(awsclient, conf, stackname, parameters, cloudformation,
                hook='post_create_hook',
                message='CloudFormation is done, now executing post create hook...')
     return exit_code
 
 
-def _s3_upload(awsclient, conf, cloudformation):
-    region = awsclient.get_client('s3').meta.region_name
+def _get_template_key(region, template_body):
+    # templates are content addressed so identical templates of different
+    # stacks and envs are uploaded only once
+    if isinstance(template_body, unicode):
+        template_body = template_body.encode('utf-8')
+    return 'kumo/%s/templates/%s.json' % (
+        region, hashlib.sha256(template_body).hexdigest())
+
+
+def compact_template(template_body):
+    """Serialize the template compactly for the transport to cloudformation
+    (troposphere pretty prints the template).
+
+    :param template_body: template json
+    :return: compact template json
+    """
+    template = json.loads(template_body, object_pairs_hook=OrderedDict)
+    return json.dumps(template, separators=(',', ':'))
+
+
+def _prepare_template_bucket(awsclient):
+    # bucket for templates which are too large to be sent inline
+    client_s3 = awsclient.get_client('s3')
+    region = client_s3.meta.region_name
+    bucket = 'gcdt-kumo-templates-%s-%s' % (get_account_id(awsclient), region)
+    try:
+        client_s3.head_bucket(Bucket=bucket)
+        return bucket
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code == '403':
+            raise Exception('S3 bucket %s for the templates exists but is '
+                            'not accessible with your credentials (403), '
+                            'please configure an artifactBucket' % bucket)
+        if code not in ['404', 'NoSuchBucket']:
+            raise
+    params = {'Bucket': bucket}
+    if region != 'us-east-1':
+        params['CreateBucketConfiguration'] = {'LocationConstraint': region}
+    try:
+        client_s3.create_bucket(**params)
+    except ClientError as e:
+        # another gcdt process created the bucket in the meantime
+        if e.response.get('Error', {}).get('Code') != \
+                'BucketAlreadyOwnedByYou':
+            raise
+    # cloudformation needs the templates only during the deployment
+    client_s3.put_bucket_lifecycle_configuration(
+        Bucket=bucket,
+        LifecycleConfiguration={'Rules': [{
+            'ID': 'expire-templates', 'Prefix': 'kumo/',
+            'Status': 'Enabled', 'Expiration': {'Days': 30}
+        }]})
+    return bucket
+
+
+def _get_template_location(awsclient, conf, cloudformation, template_body):
+    # templates are sent inline unless we have an artifact bucket or they
+    # exceed the limit for inline templates
     bucket = _get_artifact_bucket(conf)
-    dest_key = 'kumo/%s/%s-cloudformation.json' % (region, _get_stack_name(conf))
-    source_file = generate_template_file(conf, cloudformation)
-    upload_file_to_s3(awsclient, bucket, dest_key, source_file)
+    size = len(template_body.encode('utf-8')
+               if isinstance(template_body, unicode) else template_body)
+    if not bucket and size > TEMPLATE_LIMITS['TemplateBody']:
+        bucket = _prepare_template_bucket(awsclient)
+        print('template exceeds %d bytes, uploading it to S3 bucket %s' %
+              (TEMPLATE_LIMITS['TemplateBody'], bucket))
+    if bucket:
+        return {'TemplateURL': _s3_upload(awsclient, conf, cloudformation,
+                                          template_body=template_body,
+                                          bucket=bucket)}
+    return {'TemplateBody': template_body}
+
+
+def _s3_upload(awsclient, conf, cloudformation, template_body=None,
+               bucket=None):
+    region = awsclient.get_client('s3').meta.region_name
+    bucket = bucket or _get_artifact_bucket(conf)
+    if template_body is None:
+        template_body = compact_template(cloudformation.generate_template())
+    dest_key = _get_template_key(region, template_body)
+    if key_exists(awsclient, bucket, dest_key):
+        log.debug('template already uploaded to s3://%s/%s', bucket, dest_key)
+    else:
+        upload_content_to_s3(awsclient, bucket, dest_key, template_body)
     s3url = 'https://s3-%s.amazonaws.com/%s/%s' % (region, bucket, dest_key)
     return s3url
 
 
 def _update_stack(awsclient, conf, cloudformation, parameters,
-                  override_stack_policy):
+                  override_stack_policy, template_body=None):
     # update stack with all the information we have
     exit_code = 0
     client_cf = awsclient.get_client('cloudformation')
     stackname = _get_stack_name(conf)
+    if template_body is None:
+        template_body = compact_template(cloudformation.generate_template())
+    stack_policy = _get_stack_policy(cloudformation)
+    fingerprint = get_fingerprint(template_body, parameters, stack_policy)
+    if fingerprint == _get_deployed_fingerprint(awsclient, stackname):
+        # template, parameters and stack policy are unchanged so we skip
+        # the upload and the update (the hooks run like for any update)
+        _call_hook(awsclient, conf, stackname, parameters, cloudformation,
+                   hook='pre_update_hook')
+        print(colored.yellow('No updates are to be performed.'))
+        _call_hook(awsclient, conf, stackname, parameters, cloudformation,
+                   hook='post_update_hook',
+                   message='CloudFormation is done, now executing post update hook...')
+        return exit_code
+    # note: cloudformation does not update a stack if only the metadata
+    # changed, so the fingerprint of a stack deployed without one lands
+    # with the next change of a resource
+    template_body = _add_fingerprint(template_body, fingerprint)
     last_event = _get_stack_events_last_timestamp(awsclient, stackname)
     try:
         _call_hook(awsclient, conf, stackname, parameters, cloudformation,
                    hook='pre_update_hook')
-        #try:
-        if _get_artifact_bucket(conf):
-            response = client_cf.update_stack(
-                StackName=_get_stack_name(conf),
-                TemplateURL=_s3_upload(awsclient, conf, cloudformation),
-                Parameters=parameters,
-                Capabilities=[
-                    'CAPABILITY_IAM',
-                ],
-                StackPolicyBody=_get_stack_policy(cloudformation),
-                StackPolicyDuringUpdateBody=_get_stack_policy_during_update(
-                    cloudformation,
-                    override_stack_policy)
-
-            )
-        else:
-            # if we have no artifacts bucket configured then upload the template directly
-            #except ConfigMissingException:
-            response = client_cf.update_stack(
-                StackName=_get_stack_name(conf),
-                TemplateBody=cloudformation.generate_template(),
-                Parameters=parameters,
-                Capabilities=[
-                    'CAPABILITY_IAM',
-                ],
-                StackPolicyBody=_get_stack_policy(cloudformation),
-                StackPolicyDuringUpdateBody=_get_stack_policy_during_update(
-                    cloudformation,
-                    override_stack_policy)
-            )
-
-        exit_code = _poll_stack_events(awsclient, stackname, last_event)
+        response = client_cf.update_stack(
+            StackName=_get_stack_name(conf),
+            Parameters=parameters,
+            Capabilities=[
+                'CAPABILITY_IAM',
+            ],
+            StackPolicyBody=stack_policy,
+            StackPolicyDuringUpdateBody=_get_stack_policy_during_update(
+                cloudformation,
+                override_stack_policy),
+            **dict(_get_template_location(awsclient, conf, cloudformation,
+                                          template_body),
+                   **_get_notification_arns(awsclient, stackname))
+        )
+
+        exit_code = _poll_stack_events(awsclient, stackname, last_event,
+                                       resource_count=_get_resource_count(
+                                           template_body))
+        invalidate_stack_outputs(awsclient, stackname)
         _call_hook(awsclient, conf, stackname, parameters, cloudformation,
                    hook='post_update_hook',
                    message='CloudFormation is done, now executing post update hook...')
@@ -518,78 +809,169 @@ def delete_stack(awsclient, conf):
     client_cf = awsclient.get_client('cloudformation')
     stackname = _get_stack_name(conf)
     last_event = _get_stack_events_last_timestamp(awsclient, stackname)
+    resource_count = _get_deployed_resource_count(awsclient, stackname)
     response = client_cf.delete_stack(
         StackName=_get_stack_name(conf),
     )
-    return _poll_stack_events(awsclient, stackname, last_event)
+    exit_code = _poll_stack_events(awsclient, stackname, last_event,
+                                   resource_count=resource_count)
+    invalidate_stack_outputs(awsclient, stackname)
+    return exit_code
 
 
-def list_stacks(awsclient):
-    """Print out the list of stacks deployed at AWS cloud.
+def iter_stacks(awsclient, prefix=None, statuses=None):
+    """Iterate over the stacks deployed at AWS cloud. The stacks are
+    yielded as the pages of the response arrive.
 
     :param awsclient:
-    :return:
+    :param prefix: only stacks whose name starts with prefix
+    :param statuses: only stacks in these states (default: all stacks
+        which are not deleted)
+    :return: generator of stack summaries
     """
     client_cf = awsclient.get_client('cloudformation')
-    response = client_cf.list_stacks(
-        StackStatusFilter=[
-            'CREATE_IN_PROGRESS', 'CREATE_COMPLETE', 'ROLLBACK_IN_PROGRESS',
-            'ROLLBACK_COMPLETE', 'DELETE_IN_PROGRESS', 'DELETE_FAILED',
-            'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS',
-            'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_IN_PROGRESS',
-            'UPDATE_ROLLBACK_FAILED', 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS',
-            'UPDATE_ROLLBACK_COMPLETE',
-        ]
-    )
-    result = {}
+    params = {'StackStatusFilter': statuses or STACK_LIST_STATUSES}
+    while True:
+        response = client_cf.list_stacks(**params)
+        for summary in response['StackSummaries']:
+            if prefix is None or summary['StackName'].startswith(prefix):
+                yield summary
+        if not response.get('NextToken'):
+            break
+        params['NextToken'] = response['NextToken']
+
+
+def list_stacks(awsclient, prefix=None, statuses=None, as_json=False,
+                out=None):
+    """Print out the list of stacks deployed at AWS cloud.
+
+    :param awsclient:
+    :param prefix: only stacks whose name starts with prefix
+    :param statuses: only stacks in these states
+    :param as_json: print one json document per stack (json lines)
+    :param out: output stream (default: stdout)
+    :return: number of stacks
+    """
+    out = out or sys.stdout
     stack_sum = 0
-    for summary in response['StackSummaries']:
-        result['StackName'] = summary["StackName"]
-        result['CreationTime'] = summary['CreationTime']
-        result['StackStatus'] = summary['StackStatus']
-        print(_json2table(result))
+    for summary in iter_stacks(awsclient, prefix, statuses):
+        if as_json:
+            line = json.dumps({
+                'StackName': summary['StackName'],
+                'StackStatus': summary['StackStatus'],
+                'CreationTime': summary['CreationTime'].isoformat()
+            }, sort_keys=True)
+        else:
+            line = '%-60s %-30s %s' % (summary['StackName'],
+                                       summary['StackStatus'],
+                                       summary['CreationTime'])
+        out.write(line + '\n')
         stack_sum += 1
-    print('listed %s stacks' % str(stack_sum))
+    if not as_json:
+        out.write('listed %s stacks\n' % str(stack_sum))
+    return stack_sum
 
 
 def create_change_set(awsclient, conf, cloudformation):
     client = awsclient.get_client('cloudformation')
     change_set_name = ''.join(random.SystemRandom().choice(
         string.ascii_uppercase) for _ in range(8))
+    template_body = compact_template(cloudformation.generate_template())
     response = client.create_change_set(
         StackName=_get_stack_name(conf),
-        TemplateBody=cloudformation.generate_template(),
         Parameters=_generate_parameters(conf),
         Capabilities=[
             'CAPABILITY_IAM',
         ],
-        ChangeSetName=change_set_name
+        ChangeSetName=change_set_name,
+        **_get_template_location(awsclient, conf, cloudformation,
+                                 template_body)
     )
     # print json2table(response)
     # TODO catch nonexistant stack (ValidationError)
     return change_set_name, _get_stack_name(conf)
 
 
-def describe_change_set(awsclient, change_set_name, stack_name):
-    """Print out the change_set to console.
-    This needs to run create_change_set first.
+def wait_for_change_set(client, change_set_name, stack_name, delay=1,
+                        max_delay=15, timeout=600):
+    """Wait until cloudformation finished creating the change set. The
+    polling interval grows exponentially (with jitter) so many parallel
+    previews do not get throttled.
 
-    :param awsclient:
+    :param client: cloudformation client
     :param change_set_name:
     :param stack_name:
+    :param delay: initial polling interval in seconds
+    :param max_delay: max polling interval in seconds
+    :param timeout: in seconds
+    :return: first page of the describe_change_set response
     """
-    client = awsclient.get_client('cloudformation')
-
-    status = None
-    while status not in ['CREATE_COMPLETE', 'FAILED']:
+    def _check():
         response = client.describe_change_set(
             ChangeSetName=change_set_name,
             StackName=stack_name)
-        status = response['Status']
-        #print('##### %s' % status)
-        if status == 'CREATE_COMPLETE':
-            for change in response['Changes']:
-                print(_json2table(change['ResourceChange']))
+        if response['Status'] in CHANGE_SET_FINISHED_STATUSES:
+            return True, response
+        return False, None
+
+    return wait_for(_check, 'change set %s' % change_set_name, delay=delay,
+                    max_delay=max_delay, timeout=timeout)
+
+
+def _get_change_set_changes(client, change_set_name, stack_name, response):
+    # all changes (the changes are paginated)
+    changes = list(response.get('Changes', []))
+    while response.get('NextToken'):
+        response = client.describe_change_set(
+            ChangeSetName=change_set_name,
+            StackName=stack_name,
+            NextToken=response['NextToken'])
+        changes.extend(response.get('Changes', []))
+    return changes
+
+
+def _get_resource_change(change):
+    resource_change = change['ResourceChange']
+    return {
+        'Action': resource_change.get('Action'),
+        'LogicalResourceId': resource_change.get('LogicalResourceId'),
+        'PhysicalResourceId': resource_change.get('PhysicalResourceId'),
+        'ResourceType': resource_change.get('ResourceType'),
+        'Replacement': resource_change.get('Replacement'),
+        'Scope': resource_change.get('Scope', []),
+        'Details': resource_change.get('Details', [])
+    }
+
+
+def describe_change_set(awsclient, change_set_name, stack_name,
+                        print_changes=True):
+    """Wait for the change_set and print it out to console.
+    This needs to run create_change_set first.
+
+    :param awsclient:
+    :param change_set_name:
+    :param stack_name:
+    :param print_changes: print a table for each change
+    :return: diff (dictionary)
+    """
+    client = awsclient.get_client('cloudformation')
+    response = wait_for_change_set(client, change_set_name, stack_name)
+    changes = _get_change_set_changes(client, change_set_name, stack_name,
+                                      response)
+    diff = {
+        'StackName': stack_name,
+        'ChangeSetName': change_set_name,
+        'Status': response['Status'],
+        'StatusReason': response.get('StatusReason'),
+        'Changes': [_get_resource_change(c) for c in changes]
+    }
+    if print_changes:
+        if response['Status'] == 'FAILED':
+            print(colored.yellow('change set failed: %s' %
+                                 response.get('StatusReason')))
+        for change in changes:
+            print(_json2table(change['ResourceChange']))
+    return diff
 
 
 def _get_stack_name(conf):
@@ -602,12 +984,93 @@ def _get_artifact_bucket(conf):
         return bucket
 
 
-def generate_template_file(conf, cloudformation):
+def generate_template_file(conf, cloudformation, template_body=None,
+                           env=None):
     """Writes the template to disk
+
+    :param env: add the env to the file name (envs may share a StackName)
     """
-    template_body = cloudformation.generate_template()
-    template_file_name = _get_stack_name(conf) + '-generated-cf-template.json'
+    if template_body is None:
+        template_body = cloudformation.generate_template()
+    template_file_name = _get_stack_name(conf)
+    if env:
+        template_file_name += '-%s' % env
+    template_file_name += '-generated-cf-template.json'
     with open(template_file_name, 'w') as opened_file:
         opened_file.write(template_body)
     print('wrote cf-template for %s to disk: %s' % (get_env(), template_file_name))
     return template_file_name
+
+
+def read_env_config(env, lookups=True):
+    """Read the kumo config of the env like the lifecycle does (config
+    reader, lookups and validation plugins).
+
+    :param env:
+    :param lookups: resolve the lookups and validate the config
+    :return: kumo config
+    """
+    import botocore.session
+    from .gcdt_awsclient import AWSClient
+    from .gcdt_lifecycle import read_config
+    from .gcdt_plugins import load_plugins
+    load_plugins(lazy=True)
+    awsclient = AWSClient(botocore.session.get_session())
+    context = get_context(awsclient, env, 'kumo', 'generate')
+    context['_awsclient'] = awsclient
+    config = read_config(context, lookups=lookups)
+    if 'error' in context:
+        raise Exception(context['error'])
+    if 'kumo' not in config:
+        raise Exception('no kumo config found for env %s' % env)
+    return config['kumo']
+
+
+def _generate_env_template(env):
+    # runs in a worker process so the module level state of the template
+    # (e.g. get_env() at import time) is isolated per env
+    start = time.time()
+    result = {'env': env, 'file': None, 'error': None}
+    try:
+        os.environ['ENV'] = env
+        conf = read_env_config(env)
+        cloudformation, found = load_cloudformation_template()
+        if not found:
+            raise Exception('no cloudformation.py found')
+        result['file'] = generate_template_file(conf, cloudformation,
+                                                env=env)
+    except Exception as e:
+        result['error'] = str(e)
+    result['duration'] = time.time() - start
+    return result
+
+
+def generate_template_files(envs, workers=4):
+    """Write the templates for all envs, the envs are generated
+    concurrently in separate worker processes.
+
+    Note: the config of every env is read like the lifecycle reads it
+    (config reader, lookups and validation plugins).
+
+    :param envs: list of envs
+    :param workers: max number of worker processes
+    :return: exit_code
+    """
+    from tabulate import tabulate
+    start = time.time()
+    pool = multiprocessing.Pool(processes=min(workers, len(envs)),
+                                maxtasksperchild=1)
+    try:
+        results = pool.map(_generate_env_template, envs)
+    finally:
+        pool.close()
+        pool.join()
+    table = [['Env', 'Template', 'Duration']]
+    for result in results:
+        table.append([result['env'],
+                      result['file'] or colored.red(result['error']),
+                      '%.2fs' % result['duration']])
+    print(tabulate(table, headers='firstrow'))
+    print('generated %d templates in %.2fs' % (
+        len([r for r in results if not r['error']]), time.time() - start))
+    return 1 if any(r['error'] for r in results) else 0
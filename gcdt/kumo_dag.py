@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Deploy many kumo stacks in parallel while respecting their dependencies.
+
+The dependencies between the stacks are derived from the
+'lookup:stack:<stackname>:<output>' lookups in the kumo config of the stacks
+(read by the config reader plugins without resolving the lookups). Additional dependencies can be declared in the kumo
+config of a stack:
+
+    "kumo": {
+        "dependsOn": ["infra-dev-vpc"],
+        "cloudformation": {...}
+    }
+
+Dependencies on stacks which are not part of the deployment are assumed to be
+deployed already.
+"""
+from __future__ import unicode_literals, print_function
+import os
+import re
+import logging
+
+from .gcdt_batch import check_dependencies, run_batch
+from .kumo_core import read_env_config
+from .utils import get_env
+
+log = logging.getLogger(__name__)
+
+STACK_LOOKUP = re.compile(r'^lookup:stack:([^:]+):')
+
+
+def _iter_strings(data):
+    # all string values of a nested config
+    if isinstance(data, dict):
+        for value in data.values():
+            for string in _iter_strings(value):
+                yield string
+    elif isinstance(data, list):
+        for value in data:
+            for string in _iter_strings(value):
+                yield string
+    elif isinstance(data, basestring):
+        yield data
+
+
+def read_stack_config(path, env):
+    """Read the kumo config of the stack in path.
+
+    :param path: stack folder
+    :param env:
+    :return: kumo config, stack name and the names of the stacks it
+        depends on
+    """
+    cwd = os.getcwd()
+    # the config reader plugins read the config of the current folder
+    os.chdir(path)
+    try:
+        config = read_env_config(env, lookups=False)
+    except Exception as e:
+        raise Exception('%s: %s' % (path, e))
+    finally:
+        os.chdir(cwd)
+    stackname = config.get('cloudformation', {}).get('StackName')
+    if not stackname:
+        raise Exception('%s: StackName is missing' % path)
+    depends_on = set(config.get('dependsOn', []))
+    for string in _iter_strings(config):
+        match = STACK_LOOKUP.match(string)
+        if match:
+            depends_on.add(match.group(1))
+    depends_on.discard(stackname)
+    return config, stackname, sorted(depends_on)
+
+
+def get_stack_jobs(paths, env, override_stack_policy=False):
+    """Create the batch jobs to deploy the stacks.
+
+    :param paths: list of stack folders
+    :param env:
+    :param override_stack_policy:
+    :return: list of jobs (job id is the stack name)
+    """
+    command = 'deploy'
+    if override_stack_policy:
+        command += ' --override-stack-policy'
+    stacks = []
+    for path in paths:
+        _, stackname, depends_on = read_stack_config(path, env)
+        stacks.append((stackname, os.path.abspath(path), depends_on))
+    stacknames = set(s[0] for s in stacks)
+    jobs = []
+    for stackname, path, depends_on in stacks:
+        external = [d for d in depends_on if d not in stacknames]
+        if external:
+            log.debug('%s: assume %s is deployed', stackname,
+                      ', '.join(external))
+        jobs.append({
+            'id': stackname,
+            'tool': 'kumo',
+            'command': command,
+            'path': path,
+            'env': env,
+            'dependsOn': [d for d in depends_on if d in stacknames]
+        })
+    check_dependencies(jobs)
+    return jobs
+
+
+def deploy_stacks(paths, override_stack_policy=False, workers=4,
+                  logdir=None, fail_fast=False):
+    """Deploy the stacks, independent stacks are deployed in parallel.
+
+    :param paths: list of stack folders
+    :param override_stack_policy:
+    :param workers: max number of stacks deployed at the same time
+    :param logdir: write the output of each deployment to a logfile
+    :param fail_fast: do not start any more deployments after a failure
+    :return: exit_code
+    """
+    jobs = get_stack_jobs(paths, get_env(), override_stack_policy)
+    for job in jobs:
+        if job['dependsOn']:
+            print('%s depends on %s' % (job['id'],
+                                        ', '.join(job['dependsOn'])))
+    return run_batch(jobs, workers=workers, logdir=logdir,
+                     fail_fast=fail_fast)
@@ -16,8 +16,10 @@ from clint.textui import colored
 from . import utils
 from .kumo_core import print_parameter_diff, delete_stack, \
     deploy_stack, generate_template_file, list_stacks, create_change_set, \
-    describe_change_set, load_cloudformation_template, call_pre_hook
+    describe_change_set, load_cloudformation_template, call_pre_hook, \
+    generate_template_files
 from .kumo_viz import cfn_viz, svg_output
+from .kumo_dag import deploy_stacks
 from .gcdt_cmd_dispatcher import cmd
 from . import gcdt_lifecycle
 
@@ -25,15 +27,24 @@ from . import gcdt_lifecycle
 # creating docopt parameters and usage help
 DOC = '''Usage:
         kumo deploy [--override-stack-policy] [-v]
-        kumo list [-v]
+        kumo deploy-all [--override-stack-policy] [--workers=<n>] [--logdir=<dir>] [--fail-fast] [-v] <stack>...
+        kumo list [--prefix=<prefix>] [--status=<status>] [--json] [-v]
         kumo delete -f [-v]
-        kumo generate [-v]
-        kumo preview [-v]
+        kumo generate [--envs=<envs>] [--workers=<n>] [-v]
+        kumo preview [--json] [-v]
         kumo version
-        kumo dot [-v]
+        kumo dot [--cluster] [-v]
 
 -h --help           show this
 -v --verbose        show debug messages
+--workers=<n>       max number of parallel workers (default: 4)
+--logdir=<dir>      write the output of each deployment to a separate logfile
+--fail-fast         do not start any more deployments after a failure
+--json              print the changes as json (list: one line per stack)
+--prefix=<prefix>   only list stacks whose name starts with prefix
+--status=<status>   only list stacks in these states (comma separated)
+--cluster           group the resources by resource type
+--envs=<envs>       generate the templates for these envs (comma separated)
 '''
 
 
@@ -52,14 +63,14 @@ def version_cmd():
     utils.version()
 
 
-@cmd(spec=['dot'])
-def dot_cmd(**tooldata):
+@cmd(spec=['dot', '--cluster'])
+def dot_cmd(cluster, **tooldata):
     conf = tooldata.get('config')
     cloudformation = load_template()
     with NamedTemporaryFile(delete=False) as temp_dot:
         cfn_viz(json.loads(cloudformation.generate_template()),
                 parameters=conf,
-                out=temp_dot)
+                out=temp_dot, cluster_by_type=cluster)
         temp_dot.close()
         exit_code = svg_output(temp_dot.name)
         os.unlink(temp_dot.name)
@@ -80,6 +91,14 @@ def deploy_cmd(override, **tooldata):
     return exit_code
 
 
+@cmd(spec=['deploy-all', '--override-stack-policy', '--workers', '--logdir',
+           '--fail-fast', '<stack>'])
+def deploy_all_cmd(override, workers, logdir, fail_fast, stacks):
+    return deploy_stacks(stacks, override_stack_policy=override,
+                         workers=int(workers or 4), logdir=logdir,
+                         fail_fast=fail_fast)
+
+
 @cmd(spec=['delete', '-f'])
 def delete_cmd(force, **tooldata):
     context = tooldata.get('context')
@@ -88,35 +107,50 @@ def delete_cmd(force, **tooldata):
     return delete_stack(awsclient, conf)
 
 
-@cmd(spec=['generate'])
-def generate_cmd(**tooldata):
+@cmd(spec=['generate', '--envs', '--workers'])
+def generate_cmd(envs, workers, **tooldata):
+    if envs:
+        # dispatch only, the config of every env is read separately
+        return generate_template_files(envs.split(','),
+                                       workers=int(workers or 4))
     conf = tooldata.get('config')
     cloudformation = load_template()
     generate_template_file(conf, cloudformation)
     return 0
 
 
-@cmd(spec=['list'])
-def list_cmd(**tooldata):
+@cmd(spec=['list', '--prefix', '--status', '--json'])
+def list_cmd(prefix, status, as_json, **tooldata):
     context = tooldata.get('context')
     awsclient = context.get('_awsclient')
-    list_stacks(awsclient)
+    statuses = status.split(',') if status else None
+    list_stacks(awsclient, prefix=prefix, statuses=statuses, as_json=as_json)
 
 
-@cmd(spec=['preview'])
-def preview_cmd(**tooldata):
+@cmd(spec=['preview', '--json'])
+def preview_cmd(as_json, **tooldata):
     context = tooldata.get('context')
     conf = tooldata.get('config')
     awsclient = context.get('_awsclient')
     cloudformation = load_template()
-    print_parameter_diff(awsclient, conf)
+    if not as_json:
+        print_parameter_diff(awsclient, conf)
     change_set, stack_name = create_change_set(awsclient, conf,
                                                cloudformation)
-    describe_change_set(awsclient, change_set, stack_name)
+    diff = describe_change_set(awsclient, change_set, stack_name,
+                               print_changes=not as_json)
+    if as_json:
+        print(json.dumps(diff, indent=2, sort_keys=True))
+    if diff['Status'] == 'FAILED' and \
+            'didn\'t contain changes' not in (diff['StatusReason'] or ''):
+        return 1
+    return 0
 
 
 def main():
-    sys.exit(gcdt_lifecycle.main(DOC, 'kumo'))
+    sys.exit(gcdt_lifecycle.main(DOC, 'kumo',
+                                 dispatch_only=['version', 'deploy-all',
+                                                ('generate', '--envs')]))
 
 
 if __name__ == '__main__':
@@ -7,6 +7,11 @@ from __future__ import unicode_literals, print_function
 import troposphere
 from troposphere.cloudformation import AWSCustomObject
 
+from .servicediscovery import get_outputs_for_stack
+
+# name of the exports created by add_exports and used by StackReference
+EXPORT_NAME_FORMAT = '${StackName}-${Output}'
+
 
 class StackLookup(object):
     """Class to handle stack lookups
@@ -72,6 +77,69 @@ class StackLookup(object):
             )
 
 
+class StackReference(object):
+    """Drop-in replacement for StackLookup without the lookup Lambda.
+    The outputs of the other stack are either imported via Fn::ImportValue
+    (the other stack needs to export them, see add_exports) or resolved
+    from the stack outputs index when the template is generated.
+    Note: gcdt.kumo_util StackReference(stack_name) can be used in
+    cloudformation.py templates!
+    """
+
+    def __init__(self, stack_name, awsclient=None,
+                 export_name_format=EXPORT_NAME_FORMAT):
+        """
+        :param stack_name: name of the other stack (string or the parameter
+            stating the stack name)
+        :param awsclient: resolve the outputs when the template is
+            generated (default: Fn::ImportValue)
+        :param export_name_format: name of the exports (Fn::Sub format with
+            the variables StackName and Output)
+        """
+        if isinstance(stack_name, troposphere.Parameter):
+            stack_name = troposphere.Ref(stack_name)
+        self.stack_name = stack_name
+        self.awsclient = awsclient
+        self.export_name_format = export_name_format
+
+    def get_att(self, parameter, as_reference=True):
+        """Retrieves an output from an existing stack
+        :param parameter: The output parameter which should be retrieved
+        :param as_reference: Is the parameter a reference (Default) or a string
+        :return: Value of parameter to retrieve
+        """
+        output = troposphere.Ref(parameter) if as_reference else parameter
+        if self.awsclient is not None:
+            if as_reference or not isinstance(self.stack_name, basestring):
+                raise Exception('outputs of stacks given as parameter can '
+                                'not be resolved when the template is '
+                                'generated')
+            outputs = get_outputs_for_stack(self.awsclient,
+                                            self.stack_name) or {}
+            if output not in outputs:
+                raise Exception('stack \'%s\' has no output \'%s\'' %
+                                (self.stack_name, output))
+            return outputs[output]
+        return troposphere.ImportValue(troposphere.Sub(
+            self.export_name_format,
+            StackName=self.stack_name, Output=output))
+
+
+def add_exports(template, export_name_format=EXPORT_NAME_FORMAT):
+    """Export all outputs of the template so other stacks can import them
+    via StackReference.
+
+    :param template: The cloudformation template
+    :param export_name_format: name of the exports (Fn::Sub format with
+        the variables StackName and Output)
+    """
+    for name, output in template.outputs.items():
+        if 'Export' not in output.properties:
+            output.Export = troposphere.Export(troposphere.Sub(
+                export_name_format,
+                StackName=troposphere.Ref('AWS::StackName'), Output=name))
+
+
 def ensure_ebs_volume_tags_autoscaling_group(awsclient, as_group_name, tags):
     # note: gcdt.kumo_util ensure_ebs_volume_tags_autoscaling_group(awsclient, ...)
     # is used in dataplatform cloudformation.py templates!
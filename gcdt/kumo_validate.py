@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Pre-flight validation of the generated cloudformation template.
+
+The checks run locally in a few milliseconds so kumo fails before it uploads
+the template instead of after a rollback of the stack.
+"""
+from __future__ import unicode_literals, print_function
+import json
+
+from .gcdt_defaults import TEMPLATE_LIMITS
+from .kumo_viz import _find_refs, IMPORT_PREFIX
+
+PSEUDO_PARAMETERS = [
+    'AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue',
+    'AWS::Partition', 'AWS::Region', 'AWS::StackId', 'AWS::StackName',
+    'AWS::URLSuffix'
+]
+
+
+def _check_limits(template, template_body, s3_upload, limits):
+    errors, warnings = [], []
+    if isinstance(template_body, unicode):
+        template_body = template_body.encode('utf-8')
+    size = len(template_body)
+    if s3_upload:
+        if size > limits['TemplateURL']:
+            errors.append('template size %d bytes exceeds the limit of %d '
+                          'bytes' % (size, limits['TemplateURL']))
+    elif size > limits['TemplateBody']:
+        errors.append('template size %d bytes exceeds the limit of %d bytes '
+                      'for inline templates' % (size, limits['TemplateBody']))
+    for section in ['Resources', 'Parameters', 'Outputs']:
+        count = len(template.get(section, {}))
+        if count > limits[section]:
+            warnings.append('%d %s exceed the limit of %d' % (
+                count, section.lower(), limits[section]))
+    return errors, warnings
+
+
+def _check_refs(template):
+    errors = []
+    resources = template.get('Resources', {})
+    targets = set(resources) | set(template.get('Parameters', {})) | \
+        set(PSEUDO_PARAMETERS)
+    conditions = template.get('Conditions', {})
+    for section in ['Resources', 'Outputs']:
+        for name, details in sorted(template.get(section, {}).items()):
+            for ref in _find_refs(name, details):
+                if ref['from'].startswith(IMPORT_PREFIX):
+                    continue
+                if ref['type'] == 'Fn::GetAtt':
+                    if ref['from'] not in resources:
+                        errors.append('%s: Fn::GetAtt of unknown resource '
+                                      '\'%s\'' % (name, ref['from']))
+                elif ref['from'] not in targets:
+                    errors.append('%s: Ref to unknown resource or parameter '
+                                  '\'%s\'' % (name, ref['from']))
+            depends_on = details.get('DependsOn', [])
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            for dependency in depends_on:
+                if dependency not in resources:
+                    errors.append('%s: DependsOn unknown resource \'%s\'' %
+                                  (name, dependency))
+            condition = details.get('Condition')
+            if condition is not None and condition not in conditions:
+                errors.append('%s: unknown condition \'%s\'' %
+                              (name, condition))
+    return errors
+
+
+def _check_parameters(template, parameters):
+    # parameters is the parameter list created from the config
+    # cloudformation rejects parameters the template does not declare
+    errors = []
+    configured = set(p['ParameterKey'] for p in parameters)
+    declared = template.get('Parameters', {})
+    for name, details in sorted(declared.items()):
+        if name not in configured and 'Default' not in details:
+            errors.append('parameter \'%s\' is missing in the config' % name)
+    for name in sorted(configured - set(declared)):
+        errors.append('config value \'%s\' is not a parameter of the '
+                      'template' % name)
+    return errors
+
+
+def validate_template(template_body, parameters, s3_upload=False,
+                      limits=None):
+    """Validate the template before it is deployed.
+
+    :param template_body: generated template
+    :param parameters: parameter list (see kumo_core._generate_parameters)
+    :param s3_upload: the template is uploaded to S3 (not sent inline)
+    :param limits: cloudformation limits (default TEMPLATE_LIMITS)
+    :return: errors, warnings
+    """
+    limits = limits or TEMPLATE_LIMITS
+    try:
+        template = json.loads(template_body)
+    except ValueError as e:
+        return ['template is no valid json: %s' % e], []
+    if not template.get('Resources'):
+        return ['template has no resources'], []
+    errors, warnings = _check_limits(template, template_body, s3_upload,
+                                     limits)
+    if 'Transform' not in template:
+        # transforms (e.g. AWS::Serverless) add resources we do not know
+        errors.extend(_check_refs(template))
+    errors.extend(_check_parameters(template, parameters))
+    return errors, warnings
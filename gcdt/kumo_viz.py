@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 """Visualize cloudformation template."""
 from __future__ import unicode_literals, print_function
+import re
 import sys
 from numbers import Number
-from compiler.ast import flatten
 import subprocess
 
 # based on original version from https://github.com/benbc/cloud-formation-viz
@@ -19,8 +19,21 @@ import subprocess
 #    cfn_viz(template, parameters={'KeyName': 'abc123'})
 
 
-def cfn_viz(template, parameters={}, outputs={}, out=sys.stdout):
+# variables in Fn::Sub strings: ${Name} or ${Name.Attribute} (not ${!Literal})
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+IMPORT_PREFIX = 'Import:'
+
+
+def cfn_viz(template, parameters={}, outputs={}, out=sys.stdout,
+            cluster_by_type=False):
     """Render dot output for cloudformation.template in json format.
+
+    :param template: cloudformation template
+    :param parameters: parameter values which are shown in the graph
+    :param outputs: output values which are shown in the graph
+    :param out: output stream
+    :param cluster_by_type: group the resources by resource type (useful for
+        huge templates)
     """
     known_sg, open_sg = _analyze_sg(template['Resources'])
     (graph, edges) = _extract_graph(template.get('Description', ''),
@@ -29,8 +42,16 @@ def cfn_viz(template, parameters={}, outputs={}, out=sys.stdout):
     _handle_terminals(template, graph, 'Parameters', 'source', parameters)
     _handle_terminals(template, graph, 'Outputs', 'sink', outputs)
     graph['subgraphs'].append(_handle_pseudo_params(graph['edges']))
+    imports = _handle_imports(graph['edges'])
+    if imports['nodes']:
+        graph['subgraphs'].append(imports)
+    if cluster_by_type:
+        _cluster_by_type(graph)
 
-    _render(graph, out=out)
+    lines = []
+    _render(graph, lines=lines)
+    # write the graph at once instead of line by line
+    out.write('\n'.join(lines) + '\n')
 
 
 def _analyze_sg(elem):
@@ -98,6 +119,37 @@ def _handle_pseudo_params(edges):
     return graph
 
 
+def _handle_imports(edges):
+    # values imported from other stacks via Fn::ImportValue
+    graph = {
+        'name': 'Imports', 'nodes': [], 'edges': [], 'subgraphs': []
+    }
+    graph['shape'] = 'ellipse'
+    imports = set()
+    for e in edges:
+        if e['from'].startswith(IMPORT_PREFIX):
+            imports.add(e['from'])
+    graph['nodes'].extend({'name': n} for n in sorted(imports))
+    return graph
+
+
+def _cluster_by_type(graph):
+    # move the resource nodes into one cluster per resource type
+    clusters = {}
+    nodes = []
+    for node in graph['nodes']:
+        if 'type' in node:
+            clusters.setdefault(node['type'], []).append(node)
+        else:
+            nodes.append(node)
+    graph['nodes'] = nodes
+    graph['subgraphs'][:0] = [
+        {'name': 'cluster_%s' % resource_type, 'label': resource_type,
+         'nodes': clusters[resource_type], 'edges': [], 'subgraphs': []}
+        for resource_type in sorted(clusters)
+    ]
+
+
 def _get_fillcolor(resource_type, properties, known_sg=[], open_sg=[]):
     """Determine fillcolor for resources (public ones in this case)
     """
@@ -144,8 +196,13 @@ def _extract_graph(name, elem, known_sg=[], open_sg=[]):
                     if fillcolor:
                         node['fillcolor'] = fillcolor
         graph['nodes'].append(node)
-        # edges.extend(flatten(find_refs(item, details)))
-        edges.extend(flatten(_find_refs(item, details)))
+        edges.extend(_find_refs(item, details))
+        if isinstance(details, dict) and 'DependsOn' in details:
+            depends_on = details['DependsOn']
+            if isinstance(depends_on, basestring):
+                depends_on = [depends_on]
+            edges.extend({'from': d, 'to': item, 'type': 'DependsOn'}
+                         for d in depends_on)
     return graph, edges
 
 
@@ -157,75 +214,122 @@ def _extract_graph_terminals(name, elem, values={}):
         if item in values:
             node['value'] = values[item]
         graph['nodes'].append(node)
-        edges.extend(flatten(_find_refs(item, details)))
+        edges.extend(_find_refs(item, details))
     return graph, edges
 
 
+def _get_sub_refs(context, value):
+    # refs in a Fn::Sub string (variables from the map are no refs)
+    if isinstance(value, list):
+        string, variables = value[0], value[1] if len(value) > 1 else {}
+    else:
+        string, variables = value, {}
+    assert isinstance(string, basestring), 'Expected a string: %s' % value
+    refs = []
+    for variable in SUB_VARIABLE.findall(string):
+        name, _, attribute = variable.strip().partition('.')
+        if name not in variables:
+            # ${Name.Attribute} works like Fn::GetAtt
+            refs.append({'from': name, 'to': context,
+                         'type': 'Fn::GetAtt' if attribute else 'Ref'})
+    return refs, variables
+
+
 def _find_refs(context, elem):
-    if isinstance(elem, dict):
-        refs = []
-        for k, v in elem.iteritems():
-            if unicode(k) == unicode('Ref'):
+    """Find the Ref, Fn::GetAtt, Fn::Sub and Fn::ImportValue references in
+    elem (depth first, without recursion so huge templates are no problem).
+
+    :param context: name of the node which contains elem
+    :param elem: part of the template
+    :return: list of edges (type is 'Ref', 'Fn::GetAtt' or 'Fn::ImportValue')
+    """
+    refs = []
+    # the stack contains elements and (key, value) pairs of dictionaries,
+    # children are pushed in reverse order to keep the document order
+    stack = [elem]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, tuple):
+            k, v = item
+            if k == 'Ref':
                 assert isinstance(v, basestring), 'Expected a string: %s' % v
-                refs.append({'from': v, 'to': context})
-            elif unicode(k) == unicode('Fn::GetAtt'):
+                refs.append({'from': v, 'to': context, 'type': k})
+            elif k == 'Fn::GetAtt':
                 assert isinstance(v, list), 'Expected a list: %s' % v
-                refs.append({'from': v[0], 'to': context})
+                refs.append({'from': v[0], 'to': context, 'type': k})
+            elif k == 'Fn::Sub':
+                sub_refs, variables = _get_sub_refs(context, v)
+                refs.extend(sub_refs)
+                stack.append(variables)
+            elif k == 'Fn::ImportValue' and isinstance(v, basestring):
+                refs.append({'from': IMPORT_PREFIX + v, 'to': context,
+                             'type': k})
             else:
-                refs.extend(_find_refs(context, v))
-        return refs
-    elif isinstance(elem, list):
-        return map(lambda e: _find_refs(context, e), elem)
-    elif isinstance(elem, basestring):
-        return []
-    elif isinstance(elem, bool):
-        return []
-    elif isinstance(elem, Number):
-        return []
-    else:
-        raise AssertionError('Unexpected type: %s' % elem)
+                stack.append(v)
+        elif isinstance(item, dict):
+            stack.extend(reversed(item.items()))
+        elif isinstance(item, list):
+            stack.extend(reversed(item))
+        elif not isinstance(item, (basestring, bool, Number)) and \
+                item is not None:
+            raise AssertionError('Unexpected type: %s' % item)
+    return refs
+
 
+def _render(graph, subgraph=False, lines=None):
+    """Render the graph as dot.
+
+    :param graph:
+    :param subgraph: render as subgraph
+    :param lines: list the dot lines are appended to
+    :return: lines
+    """
+    if lines is None:
+        lines = []
+    add = lines.append
 
-def _render(graph, subgraph=False, out=sys.stdout):
     def _render_node(n):
         # helper to render a node (this adds type and fillcolor)
         # styles here: http://www.graphviz.org/doc/info/attrs.html#d:fillcolor
         if 'fillcolor' in n:
             # fillcolor ON
-            print('node [style="filled"];', file=out)
-            print('node [fillcolor="%s"]' % n['fillcolor'], file=out)
+            add('node [style="filled"];')
+            add('node [fillcolor="%s"]' % n['fillcolor'])
         if 'value' in n:
             # use HTML labels:
             # http://stackoverflow.com/questions/19280229/graphviz-putting-a-caption-on-a-node-in-addition-to-a-label
-            print('"%s"[label=<%s<BR /><FONT POINT-SIZE="8">[=%s]</FONT>>]' %
-                  (n['name'], n['name'], n['value']), file=out)
+            add('"%s"[label=<%s<BR /><FONT POINT-SIZE="8">[=%s]</FONT>>]' %
+                (n['name'], n['name'], n['value']))
         elif 'type' in n:
-            print('"%s"[label=<<FONT POINT-SIZE="8">[%s]</FONT><BR />%s>]' %
-                  (n['name'], n['type'], n['name']), file=out)
+            add('"%s"[label=<<FONT POINT-SIZE="8">[%s]</FONT><BR />%s>]' %
+                (n['name'], n['type'], n['name']))
         else:
-            print('"%s"' % n['name'], file=out)
+            add('"%s"' % n['name'])
         if 'fillcolor' in n:
             # fillcolor OFF
-            print('node [style=""];', file=out)
-            print('node [fillcolor=""]', file=out)
+            add('node [style=""];')
+            add('node [fillcolor=""]')
 
     if subgraph:
-        print('subgraph "%s" {' % graph['name'], file=out)
+        add('subgraph "%s" {' % graph['name'])
     else:
-        print('digraph "%s" {' % graph['name'], file=out)
-    print('labeljust=l;', file=out)
-    print('node [shape={}];'.format(graph.get('shape', 'box')), file=out)
+        add('digraph "%s" {' % graph['name'])
+    add('labeljust=l;')
+    if 'label' in graph:
+        add('label="%s";' % graph['label'])
+    add('node [shape={}];'.format(graph.get('shape', 'box')))
     if 'style' in graph:
-        print('node [style="%s"]' % graph['style'], file=out)
+        add('node [style="%s"]' % graph['style'])
     if 'rank' in graph:
-        print('rank=%s' % graph['rank'], file=out)
+        add('rank=%s' % graph['rank'])
     for node in graph['nodes']:
         _render_node(node)
     for s in graph['subgraphs']:
-        _render(s, True, out)
+        _render(s, True, lines)
     for e in graph['edges']:
-        print('"%s" -> "%s";' % (e['from'], e['to']), file=out)
-    print('}', file=out)
+        add('"%s" -> "%s";' % (e['from'], e['to']))
+    add('}')
+    return lines
 
 
 def svg_output(dotfile, outfile='cloudformation.svg'):
@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
-from pip._vendor import pkg_resources
-import pip.commands.list
+# note: pip is expensive to import so we only import it in case we need it
 
 
 def get_dist(dist_name, lookup_dirs=None):
     """Get dist for installed version of dist_name avoiding pkg_resources cache
     """
     # note: based on pip/utils/__init__.py, get_installed_version(...)
+    from pip._vendor import pkg_resources
 
     # Create a requirement that we'll look for inside of setuptools.
     req = pkg_resources.Requirement.parse(dist_name)
@@ -32,6 +32,7 @@ def get_package_versions(package):
     :param package: name of the package
     :return: installed version, latest available version
     """
+    import pip.commands.list
     list_command = pip.commands.list.ListCommand()
     options, args = list_command.parse_args([])
     packages = [get_dist(package)]
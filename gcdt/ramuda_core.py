@@ -9,7 +9,6 @@ import sys
 import os
 import shutil
 import uuid
-import time
 from datetime import datetime, timedelta
 import json
 import logging
@@ -22,6 +21,7 @@ from gcdt.ramuda_utils import json2table, s3_upload, \
     aggregate_datapoints, list_of_dict_equals, \
     create_aws_s3_arn, get_bucket_from_s3_arn, get_rule_name_from_event_arn, \
     build_filter_rules
+from .gcdt_waiter import wait_for
 
 
 log = logging.getLogger(__name__)
@@ -347,9 +347,7 @@ def _create_lambda(awsclient, function_name, role, handler_filename,
     # FIXME: 23.08.2016 WHY update configuration after create?
     # timing issue:
     # http://jenkins.dev.dp.glomex.cloud/job/packages/job/gcdt_pull_request/32/console
-    #       1) we need to wait till the function is available for update
-    #          is there a better way than sleep?
-    time.sleep(15)
+    #       1) the update is retried until the function is available
     #       2) I believe this was implemented as shortcut to set subnet, and sg
     #          a way better way is to set this is using the using VPCConfig argument!
     _update_lambda_configuration(
@@ -433,34 +431,76 @@ def _update_lambda_function_code(
     return 0
 
 
+def _is_not_ready(error):
+    # lambda rejects changes while the code of the function is updated and
+    # right after the create (until its role can be assumed)
+    code = error.response.get('Error', {}).get('Code')
+    message = error.response.get('Error', {}).get('Message', '')
+    return code == 'ResourceConflictException' or \
+        (code == 'InvalidParameterValueException' and
+         'role' in message.lower())
+
+
+def _call_when_ready(function_name, call, timeout=300):
+    """Retry a call which changes the lambda function (with backoff) until
+    lambda accepts it.
+
+    Note: botocore 1.5 does not know the State and LastUpdateStatus fields
+    of the function configuration, so we can not ask whether the function
+    is ready. Instead we retry while lambda says it is not.
+
+    :param function_name: used in log and error messages
+    :param call: function which makes the API call
+    :param timeout: in seconds
+    :return: the response of the call
+    """
+    def _check():
+        try:
+            return True, call()
+        except ClientError as e:
+            if not _is_not_ready(e):
+                raise
+            log.debug('lambda function %s is not ready: %s',
+                      function_name, e)
+            return False, e.response['Error']['Code']
+
+    return wait_for(_check, 'lambda function %s' % function_name,
+                    timeout=timeout)
+
+
 def _update_lambda_configuration(awsclient, function_name, role,
                                  handler_function,
                                  description, timeout, memory, subnet_ids=None,
                                  security_groups=None):
     client_lambda = awsclient.get_client('lambda')
+    # the configuration can not be updated during a create or code update
     if subnet_ids and security_groups:
         # print ('found vpc config')
-        response = client_lambda.update_function_configuration(
-            FunctionName=function_name,
-            Role=role,
-            Handler=handler_function,
-            Description=description,
-            Timeout=timeout,
-            MemorySize=memory,
-            VpcConfig={
-                'SubnetIds': subnet_ids,
-                'SecurityGroupIds': security_groups
-            }
-        )
+        response = _call_when_ready(
+            function_name,
+            lambda: client_lambda.update_function_configuration(
+                FunctionName=function_name,
+                Role=role,
+                Handler=handler_function,
+                Description=description,
+                Timeout=timeout,
+                MemorySize=memory,
+                VpcConfig={
+                    'SubnetIds': subnet_ids,
+                    'SecurityGroupIds': security_groups
+                }
+            ))
         print(json2table(response))
     else:
-        response = client_lambda.update_function_configuration(
-            FunctionName=function_name,
-            Role=role,
-            Handler=handler_function,
-            Description=description,
-            Timeout=timeout,
-            MemorySize=memory)
+        response = _call_when_ready(
+            function_name,
+            lambda: client_lambda.update_function_configuration(
+                FunctionName=function_name,
+                Role=role,
+                Handler=handler_function,
+                Description=description,
+                Timeout=timeout,
+                MemorySize=memory))
 
         print(json2table(response))
     function_version = response['Version']
@@ -8,8 +8,6 @@ import threading
 import time
 import logging
 
-from s3transfer import S3Transfer
-from tabulate import tabulate
 
 from . import utils
 
@@ -60,6 +58,7 @@ def json2table(json):
     :param json:
     :return:
     """
+    from tabulate import tabulate
     filter_terms = ['ResponseMetadata']
     table = []
     try:
@@ -174,6 +173,7 @@ class ProgressPercentage(object):
 
 @utils.retries(3)
 def s3_upload(awsclient, deploy_bucket, zipfile, lambda_name):
+    from s3transfer import S3Transfer
     client_s3 = awsclient.get_client('s3')
     region = client_s3.meta.region_name
     transfer = S3Transfer(client_s3)
@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import logging
-from s3transfer import S3Transfer
-from botocore.client import ClientError
+from botocore.exceptions import ClientError
 
 log = logging.getLogger(__name__)
 
@@ -76,6 +75,7 @@ def upload_file_to_s3(awsclient, bucket, key, filename):
     :param filename:
     :return:
     """
+    from s3transfer import S3Transfer
     client_s3 = awsclient.get_client('s3')
     transfer = S3Transfer(client_s3)
     # Upload /tmp/myfile to s3://bucket/key and print upload progress.
@@ -86,6 +86,40 @@ def upload_file_to_s3(awsclient, bucket, key, filename):
     return etag, version_id
 
 
+def key_exists(awsclient, bucket, key):
+    """Check whether an object exists in the bucket.
+
+    :param awsclient:
+    :param bucket:
+    :param key:
+    :return: True / False
+    """
+    client_s3 = awsclient.get_client('s3')
+    try:
+        client_s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            return False
+        raise
+
+
+def upload_content_to_s3(awsclient, bucket, key, content):
+    """Upload content from memory to AWS S3 bucket.
+
+    :param awsclient:
+    :param bucket:
+    :param key:
+    :param content: string
+    :return: etag, version_id
+    """
+    client_s3 = awsclient.get_client('s3')
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    response = client_s3.put_object(Bucket=bucket, Key=key, Body=content)
+    return response.get('ETag'), response.get('VersionId', None)
+
+
 def ls(awsclient, bucket, prefix=None):
     """List bucket contents
 
@@ -7,6 +7,18 @@ from __future__ import unicode_literals, print_function
 from distutils.version import StrictVersion
 from datetime import tzinfo, timedelta, datetime
 import re
+import os
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+from .gcdt_defaults import STACK_OUTPUTS_TTL
+from .utils import get_cache_dir, read_cache_file, write_cache_file, \
+    get_caller_identity
+
+log = logging.getLogger(__name__)
 
 
 ZERO = timedelta(0)
@@ -43,6 +55,171 @@ def parse_ts(ts):
             return dt
 
 
+def get_account_id(awsclient):
+    """Id of the AWS account of the credentials.
+
+    :param awsclient:
+    :return: account id
+    """
+    client_sts = awsclient.get_client('sts')
+    return client_sts.get_caller_identity()['Account']
+
+
+def _get_outputs(stack):
+    if 'Outputs' in stack:
+        result = {}
+        for output in stack['Outputs']:
+            result[output['OutputKey']] = output['OutputValue']
+        return result
+
+
+@contextmanager
+def _locked(name):
+    # serialize updates of the cache file between gcdt processes
+    with open(os.path.join(get_cache_dir(), name + '.lock'), 'w') as lfile:
+        fcntl.flock(lfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lfile, fcntl.LOCK_UN)
+
+
+class StackOutputsIndex(object):
+    def __init__(self, ttl=None):
+        """Outputs of the stacks of an account and region. The outputs are
+        memoized in the process and stored in the gcdt cache folder so other
+        gcdt processes can use them, too.
+
+        :param ttl: outputs are refreshed after ttl seconds (default:
+            GCDT_STACK_OUTPUTS_TTL or STACK_OUTPUTS_TTL, 0 disables the index)
+        """
+        self._ttl = ttl
+        self._scopes = {}  # (access key, region) -> '<account>-<region>'
+        self._stacks = {}  # scope -> {stack_name: [timestamp, outputs]}
+        self._mtimes = {}  # scope -> mtime of the cache file we read
+        self._lock = threading.RLock()
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return int(os.environ.get('GCDT_STACK_OUTPUTS_TTL',
+                                      STACK_OUTPUTS_TTL))
+        return self._ttl
+
+    def _get_scope(self, awsclient):
+        region = awsclient.get_client('cloudformation').meta.region_name
+        credentials = awsclient.get_credentials()
+        access_key = credentials.access_key if credentials else None
+        key = (access_key, region)
+        if key not in self._scopes:
+            # the identity is cached (see utils.get_caller_identity)
+            identity = get_caller_identity(awsclient)
+            account = identity['Account'] if identity else \
+                get_account_id(awsclient)
+            self._scopes[key] = '%s-%s' % (account, region)
+        return self._scopes[key]
+
+    def _get_stacks(self, scope):
+        # note: caller needs to hold the lock
+        # reload the cache file if another process changed it
+        name = 'stack_outputs_%s.json' % scope
+        try:
+            mtime = os.path.getmtime(os.path.join(get_cache_dir(), name))
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != self._mtimes.get(scope):
+            self._stacks[scope] = read_cache_file(name) or {}
+            self._mtimes[scope] = mtime
+        return self._stacks.setdefault(scope, {})
+
+    def _update(self, scope, stacks=None, remove=None):
+        name = 'stack_outputs_%s.json' % scope
+        with self._lock:
+            try:
+                with _locked(name):
+                    data = read_cache_file(name) or {}
+                    now = time.time()
+                    for stack_name, entry in data.items():
+                        if entry[0] + self.ttl <= now:
+                            del data[stack_name]
+                    data.update(stacks or {})
+                    for stack_name in remove or []:
+                        data.pop(stack_name, None)
+                    write_cache_file(name, data)
+                    self._mtimes[scope] = os.path.getmtime(
+                        os.path.join(get_cache_dir(), name))
+                    self._stacks[scope] = data
+            except (IOError, OSError) as e:
+                # we keep the outputs in memory only
+                log.debug('can not write %s: %s', name, e)
+                data = self._stacks.setdefault(scope, {})
+                data.update(stacks or {})
+                for stack_name in remove or []:
+                    data.pop(stack_name, None)
+
+    def get(self, awsclient, stack_name):
+        """Outputs of the stack.
+
+        :param awsclient:
+        :param stack_name:
+        :return: dictionary containing the stack outputs
+        """
+        if self.ttl <= 0:
+            client_cf = awsclient.get_client('cloudformation')
+            response = client_cf.describe_stacks(StackName=stack_name)
+            if response['Stacks']:
+                return _get_outputs(response['Stacks'][0])
+            return
+        scope = self._get_scope(awsclient)
+        with self._lock:
+            entry = self._get_stacks(scope).get(stack_name)
+        if entry and entry[0] + self.ttl > time.time():
+            return entry[1]
+        client_cf = awsclient.get_client('cloudformation')
+        response = client_cf.describe_stacks(StackName=stack_name)
+        if response['Stacks']:
+            outputs = _get_outputs(response['Stacks'][0])
+            self._update(scope, {stack_name: [time.time(), outputs]})
+            return outputs
+
+    def prefetch(self, awsclient):
+        """Read the outputs of all stacks of the account and region (one
+        describe_stacks call per 100 stacks).
+
+        :param awsclient:
+        :return: number of stacks
+        """
+        if self.ttl <= 0:
+            return 0
+        scope = self._get_scope(awsclient)
+        client_cf = awsclient.get_client('cloudformation')
+        stacks = {}
+        params = {}
+        while True:
+            response = client_cf.describe_stacks(**params)
+            now = time.time()
+            for stack in response['Stacks']:
+                stacks[stack['StackName']] = [now, _get_outputs(stack)]
+            if not response.get('NextToken'):
+                break
+            params['NextToken'] = response['NextToken']
+        self._update(scope, stacks)
+        return len(stacks)
+
+    def invalidate(self, awsclient, stack_name):
+        """Remove the outputs of a stack which was changed.
+
+        :param awsclient:
+        :param stack_name:
+        """
+        if self.ttl <= 0:
+            return
+        self._update(self._get_scope(awsclient), remove=[stack_name])
+
+
+_stack_outputs_index = StackOutputsIndex()
+
+
 # gets Outputs for a given StackName
 def get_outputs_for_stack(awsclient, stack_name):
     """
@@ -50,17 +227,31 @@ def get_outputs_for_stack(awsclient, stack_name):
     Note: gcdt.servicediscovery get_outputs_for_stack((awsclient, stack_name)
     is used in many cloudformation.py templates!
 
+    The outputs are served from the stack outputs index.
+
     :param awsclient:
     :param stack_name:
     :return: dictionary containing the stack outputs
     """
-    client_cf = awsclient.get_client('cloudformation')
-    response = client_cf.describe_stacks(StackName=stack_name)
-    if response['Stacks'] and 'Outputs' in response['Stacks'][0]:
-        result = {}
-        for output in response['Stacks'][0]['Outputs']:
-            result[output['OutputKey']] = output['OutputValue']
-        return result
+    return _stack_outputs_index.get(awsclient, stack_name)
+
+
+def prefetch_stack_outputs(awsclient):
+    """Read the outputs of all stacks into the stack outputs index.
+
+    :param awsclient:
+    :return: number of stacks
+    """
+    return _stack_outputs_index.prefetch(awsclient)
+
+
+def invalidate_stack_outputs(awsclient, stack_name):
+    """Remove the outputs of a changed stack from the stack outputs index.
+
+    :param awsclient:
+    :param stack_name:
+    """
+    _stack_outputs_index.invalidate(awsclient, stack_name)
 
 
 def get_ssl_certificate(awsclient, domain):
@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import os
 import json
-import time
 
 from clint.textui import colored
 
 from .s3 import upload_file_to_s3
+from .gcdt_defaults import EVENT_FALLBACK_INTERVAL
+from .gcdt_events import get_event_topic, open_event_queue, \
+    parse_deployment_event
+from .gcdt_waiter import wait_for, WaiterTimeout
+
+# trigger which sends the deployment events to the gcdt event topic
+TRIGGER_NAME = 'gcdt-tenkai'
+TRIGGER_EVENTS = ['DeploymentSuccess', 'DeploymentFailure', 'DeploymentStop']
 
 
 def deploy(awsclient, applicationName, deploymentGroupName,
@@ -24,6 +32,12 @@ def deploy(awsclient, applicationName, deploymentGroupName,
                                       _build_bundle_key(applicationName),
                                       bundlefile)
 
+    topic = get_event_topic()
+    if topic and os.environ.get('GCDT_EVENT_TRIGGER'):
+        # note: the trigger stays in the deployment group
+        _ensure_deployment_trigger(awsclient, applicationName,
+                                   deploymentGroupName, topic)
+
     client_codedeploy = awsclient.get_client('codedeploy')
     response = client_codedeploy.create_deployment(
         applicationName=applicationName,
@@ -59,36 +73,97 @@ def _build_bundle_key(application_name):
     return '%s/bundle.tar.gz' % application_name
 
 
+def _ensure_deployment_trigger(awsclient, application_name,
+                               deployment_group_name, topic):
+    # permanently adds the trigger to the deployment group (opt-in via
+    # GCDT_EVENT_TRIGGER), the service role of the deployment group needs
+    # sns:Publish on the topic
+    client_codedeploy = awsclient.get_client('codedeploy')
+    group = client_codedeploy.get_deployment_group(
+        applicationName=application_name,
+        deploymentGroupName=deployment_group_name)['deploymentGroupInfo']
+    triggers = group.get('triggerConfigurations', [])
+    trigger = {
+        'triggerName': TRIGGER_NAME,
+        'triggerTargetArn': topic,
+        'triggerEvents': TRIGGER_EVENTS
+    }
+    if trigger in triggers:
+        return
+    triggers = [t for t in triggers if t['triggerName'] != TRIGGER_NAME]
+    client_codedeploy.update_deployment_group(
+        applicationName=application_name,
+        currentDeploymentGroupName=deployment_group_name,
+        triggerConfigurations=triggers + [trigger])
+
+
+def _get_deployment_topic(awsclient, deployment_id):
+    # the event topic if the deployment group has a trigger for it
+    topic = get_event_topic()
+    if not topic:
+        return None
+    client_codedeploy = awsclient.get_client('codedeploy')
+    info = client_codedeploy.get_deployment(
+        deploymentId=deployment_id)['deploymentInfo']
+    group = client_codedeploy.get_deployment_group(
+        applicationName=info['applicationName'],
+        deploymentGroupName=info['deploymentGroupName'])['deploymentGroupInfo']
+    if any(t['triggerTargetArn'] == topic
+           for t in group.get('triggerConfigurations', [])):
+        return topic
+
+
 def deployment_status(awsclient, deploymentId, iterations=100):
     """Wait until an deployment is in an steady state and output information.
 
     :param deploymentId:
-    :param iterations:
+    :param iterations: the deployment has iterations * 10 seconds to
+        reach a steady state
     :return: exit_code
     """
-    counter = 0
+    topic = _get_deployment_topic(awsclient, deploymentId)
+    with open_event_queue(awsclient, topic) as event_queue:
+        return _wait_for_deployment(awsclient, deploymentId, iterations,
+                                    event_queue)
+
+
+def _wait_for_deployment(awsclient, deploymentId, iterations, event_queue):
+    # without an event_queue we poll every 10 seconds
     steady_states = ['Succeeded', 'Failed', 'Stopped']
     client_codedeploy = awsclient.get_client('codedeploy')
 
-    while counter <= iterations:
+    def _check():
         response = client_codedeploy.get_deployment(deploymentId=deploymentId)
         status = response['deploymentInfo']['status']
-
-        if status not in steady_states:
+        if status != 'Failed':
             print('Deployment: %s - State: %s' % (deploymentId, status))
-            # sys.stdout.flush()
-            time.sleep(10)
-        elif status == 'Failed':
-            print(
-                colored.red('Deployment: {} failed: {}'.format(
-                    deploymentId,
-                    json.dumps(response['deploymentInfo']['errorInformation'],
-                               indent=2)
-                ))
-            )
-            return 1
-        else:
-            print('Deployment: %s - State: %s' % (deploymentId, status))
-            break
-
+        if status in steady_states:
+            return True, response
+        return False, status
+
+    sleep, max_delay = None, 10
+    if event_queue:
+        # wake up as soon as an event of the deployment arrives
+        sleep = lambda seconds: event_queue.wait(
+            lambda message: parse_deployment_event(message).get(
+                'deploymentId') == deploymentId,
+            timeout=seconds)
+        max_delay = EVENT_FALLBACK_INTERVAL
+    try:
+        response = wait_for(_check, 'deployment %s' % deploymentId,
+                            sleep=sleep, delay=2, max_delay=max_delay,
+                            timeout=iterations * 10)
+    except WaiterTimeout as e:
+        print(colored.red(str(e)))
+        return 1
+
+    if response['deploymentInfo']['status'] == 'Failed':
+        print(
+            colored.red('Deployment: {} failed: {}'.format(
+                deploymentId,
+                json.dumps(response['deploymentInfo']['errorInformation'],
+                           indent=2)
+            ))
+        )
+        return 1
     return 0
@@ -3,7 +3,11 @@ from __future__ import unicode_literals, print_function
 import logging
 import getpass
 import subprocess
-from time import sleep
+import json
+import sys
+import calendar
+from time import sleep, time
+from distutils.version import LooseVersion
 
 import os
 from clint.textui import prompt, colored
@@ -157,14 +161,97 @@ def _execute_script(file_name):
         return 1
 
 
-def check_gcdt_update():
+def get_cache_dir():
+    """Folder for gcdt cache files (use GCDT_CACHE_DIR to change it).
+
+    :return: path to the cache folder
+    """
+    cache_dir = os.getenv('GCDT_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'gcdt'))
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # another gcdt process might have created it in the meantime
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
+def read_cache_file(name):
+    """Read json data from a file in the gcdt cache folder.
+
+    :param name: name of the cache file
+    :return: data or None if the file does not exist or is corrupt
+    """
+    cache_file = os.path.join(get_cache_dir(), name)
+    try:
+        with open(cache_file) as cfile:
+            return json.load(cfile)
+    except (IOError, ValueError):
+        return None
+
+
+def write_cache_file(name, data):
+    """Write json data to a file in the gcdt cache folder.
+
+    Note: the data is written to a temporary file first so concurrent
+    gcdt processes never read a partially written file.
+
+    :param name: name of the cache file
+    :param data: json serializable data
+    """
+    cache_file = os.path.join(get_cache_dir(), name)
+    tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'w') as cfile:
+        json.dump(data, cfile)
+    os.rename(tmp_file, cache_file)
+
+
+UPDATE_CHECK_FILE = 'update_check.json'
+UPDATE_CHECK_TTL = 24 * 60 * 60  # seconds
+
+
+def _refresh_latest_version():
+    # query the package index and store the result in the cache
+    try:
+        _, latest_version = get_package_versions('gcdt')
+        if latest_version is not None:
+            write_cache_file(UPDATE_CHECK_FILE, {
+                'latest_version': str(latest_version),
+                'timestamp': time()
+            })
+    except Exception as e:
+        log.debug('gcdt update check failed: %s', e)
+
+
+def check_gcdt_update(ttl=UPDATE_CHECK_TTL):
     """Check whether a newer gcdt is available and output a warning.
 
+    The latest available version is cached. In case the cached information
+    is older than ttl it is refreshed in a detached process so the check
+    never delays the command (a thread would hold the import lock while it
+    imports pip). Set GCDT_OFFLINE to skip the check.
+
+    :param ttl: max age of the cached version information in seconds
+    :return: the refresh process in case a refresh was started
     """
-    inst_version, latest_version = get_package_versions('gcdt')
-    if inst_version < latest_version:
+    if os.getenv('GCDT_OFFLINE'):
+        return
+    cached = read_cache_file(UPDATE_CHECK_FILE)
+    if cached and LooseVersion(__version__) < \
+            LooseVersion(cached['latest_version']):
         print(colored.yellow('Please consider an update to gcdt version: %s' %
-                             latest_version))
+                             cached['latest_version']))
+    if not cached or time() - cached['timestamp'] > ttl:
+        with open(os.devnull, 'r+') as devnull:
+            # we do not wait for the refresh on exit
+            return subprocess.Popen(
+                [sys.executable, '-c', 'from gcdt.utils import '
+                 '_refresh_latest_version; _refresh_latest_version()'],
+                stdin=devnull, stdout=devnull, stderr=devnull,
+                close_fds=True)
 
 
 # adapted from:
@@ -185,17 +272,61 @@ def dict_merge(a, b, path=None):
     return a
 
 
-# TODO test this properly!
-# TODO use logging
+# results of the credentials check per access key, forked processes (e.g.
+# gcdt batch workers) inherit the cache.
+_credentials_cache = {}
+# credentials without an expiry (e.g. access keys) may still be deactivated
+# so long running processes (gcdt serve) check them again after a while
+CREDENTIALS_CACHE_TTL = 15 * 60  # seconds
+
+
+def _get_credentials_expiry(credentials):
+    # only refreshable credentials (e.g. assume role) know their expiry
+    expiry = getattr(credentials, '_expiry_time', None)
+    if expiry is not None:
+        return calendar.timegm(expiry.utctimetuple())
+
+
+def get_caller_identity(awsclient):
+    """Identity (Account, Arn, UserId) of the credentials in use.
+
+    The identity is cached until the credentials expire (at most
+    CREDENTIALS_CACHE_TTL for credentials without an expiry).
+
+    :param awsclient:
+    :return: identity or None if the credentials are not valid
+    """
+    credentials = awsclient.get_credentials()
+    if credentials is None:
+        return None
+    cached = _credentials_cache.get(credentials.access_key)
+    if cached and cached['expiry'] > time():
+        return cached['identity']
+    expiry = _get_credentials_expiry(credentials) or \
+        time() + CREDENTIALS_CACHE_TTL
+    client_sts = awsclient.get_client('sts')
+    response = client_sts.get_caller_identity()
+    identity = {k: response[k] for k in ['Account', 'Arn', 'UserId']}
+    _credentials_cache[credentials.access_key] = {
+        'identity': identity,
+        'expiry': expiry
+    }
+    return identity
+
+
 def are_credentials_still_valid(awsclient):
     """Check whether the credentials have expired.
 
+    note: this uses the lightweight sts get_caller_identity call and the
+    result is cached (see get_caller_identity).
+
     :param awsclient:
     :return: exit_code
     """
-    client = awsclient.get_client('lambda')
     try:
-        client.list_functions()
+        if get_caller_identity(awsclient) is None:
+            print('No AWS credentials found')
+            return 1
     except Exception as e:
         log.debug(e)
         print(e)
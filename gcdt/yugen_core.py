@@ -6,8 +6,6 @@ import os
 import uuid
 
 from botocore.exceptions import ClientError
-from pybars import Compiler
-from tabulate import tabulate
 
 
 SWAGGER_FILE = 'swagger.yaml'
@@ -587,6 +585,7 @@ def _invoke_lambda_permission_exists(client_lambda, lambda_arn, source_arn):
 
 # TODO: possible to consolidate this with the one for ramuda?
 def _json2table(data):
+    from tabulate import tabulate
     filter_terms = ['ResponseMetadata']
     table = []
     try:
@@ -642,6 +641,7 @@ def _basepath_to_string_if_null(basepath):
 
 
 def _compile_template(swagger_template_file, template_params):
+    from pybars import Compiler
     compiler = Compiler()
     with codecs.open(swagger_template_file, 'r', 'utf-8') as f:
         template_file = f.read()
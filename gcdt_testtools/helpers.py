@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import os
+import json
 import subprocess
 import random
 import shutil
 import string
 from tempfile import NamedTemporaryFile, mkdtemp
 
+import mock
 import pytest
 
 
@@ -16,6 +18,18 @@ class Bunch:
         self.__dict__.update(kwds)
 
 
+def fake_awsclient(client, credentials=None):
+    """Stand-in for AWSClient which returns the same client for every
+    service (e.g. a mock.Mock which records the calls).
+
+    :param client: returned by get_client
+    :param credentials: returned by get_credentials
+    :return: awsclient
+    """
+    return Bunch(get_client=lambda service, region_name=None: client,
+                 get_credentials=lambda: credentials)
+
+
 def create_tempfile(contents):
     """Helper to create a named temporary file with contents.
     Note: caller has responsibility to clean up the temp file!
@@ -133,12 +147,75 @@ check_dot_precondition = pytest.mark.skipif(
 )
 
 
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def temp_cache_dir():
+    # use a temporary gcdt cache folder and cleanup after test
+    folder = mkdtemp()
+    cache_dir = os.environ.get('GCDT_CACHE_DIR')
+    os.environ['GCDT_CACHE_DIR'] = folder
+    yield folder
+    # cleanup
+    if cache_dir is None:
+        del os.environ['GCDT_CACHE_DIR']
+    else:
+        os.environ['GCDT_CACHE_DIR'] = cache_dir
+    shutil.rmtree(folder)
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def mocked_client():
+    # mock.Mock which stands in for the botocore clients of all services
+    client = mock.Mock()
+    client.meta.region_name = 'eu-west-1'
+    client.get_caller_identity.return_value = {
+        'Account': '123456789012', 'Arn': 'arn:aws:iam::123456789012:user/me',
+        'UserId': 'AIDAFAKE', 'ResponseMetadata': {}
+    }
+    return client
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def mocked_awsclient(mocked_client):
+    # fake_awsclient which returns the mocked_client for all services
+    return fake_awsclient(
+        mocked_client,
+        credentials=Bunch(access_key='AKIAFAKE', _expiry_time=None))
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def cleanup_credentials_cache():
+    # forget the cached credential checks (see utils.get_caller_identity)
+    from gcdt.utils import _credentials_cache
+    yield
+    _credentials_cache.clear()
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def json_config_reader():
+    # stand-in for the config reader plugin: reads gcdt_<env>.json
+    from gcdt import gcdt_signals
+
+    def _read_json_config(params):
+        context, config = params
+        config_file = 'gcdt_%s.json' % context['env']
+        if not os.path.isfile(config_file):
+            context['error'] = '%s: config file is missing' % config_file
+            return
+        with open(config_file) as cfile:
+            config.update(json.load(cfile))
+
+    gcdt_signals.config_read_init.connect(_read_json_config)
+    yield
+    gcdt_signals.config_read_init.disconnect(_read_json_config)
+
+
 @pytest.fixture(scope='function')  # 'function' or 'module'
 def preserve_env():
-    env = os.environ['ENV']
+    env = dict(os.environ)
     yield
-    # cleanup
-    os.environ['ENV'] = env
+    # cleanup (also removes variables the test added)
+    os.environ.clear()
+    os.environ.update(env)
 
 
 # pytest_vts
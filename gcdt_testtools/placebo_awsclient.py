@@ -42,8 +42,7 @@ class PlaceboAWSClient(AWSClient):
         :param session: botocore session
         :param data_path: basepath for your recordings
         """
-        self._session = session
-        self._client_cache = {}
+        super(PlaceboAWSClient, self).__init__(session)
         self._mode = None  # None, record, playback
         # TODO remove _prefix
         self._prefix = None  # not used!!
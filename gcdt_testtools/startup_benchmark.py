@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Measure the import time of the gcdt entry points.
+
+Usage:
+    python -m gcdt_testtools.startup_benchmark [<module>...]
+
+The benchmark prints the time spent to import each of the given modules
+(default: all gcdt tool main modules) together with a breakdown of the
+slowest modules (cumulative and self time) imported on the way.
+Every module is measured in a separate python process so the numbers are
+not influenced by modules imported for a previous measurement.
+"""
+from __future__ import unicode_literals, print_function
+import sys
+import json
+import time
+import subprocess
+
+ENTRY_POINTS = ['gcdt.gcdt_main', 'gcdt.kumo_main', 'gcdt.ramuda_main',
+                'gcdt.tenkai_main', 'gcdt.yugen_main']
+
+# third party packages that must not be imported by the entry points
+# (they are imported by the commands that need them)
+HEAVY_MODULES = ['troposphere', 'awacs', 'pybars', 'tabulate', 'pyspin',
+                 's3transfer', 'pip', 'pkg_resources']
+
+
+class ImportTimer(object):
+    """Wrap the builtin __import__ to record timings of modules imported for
+    the first time.
+    """
+    def __init__(self):
+        self.timings = {}  # name -> [cumulative, self]
+        self._stack = []
+        self._original_import = None
+
+    def _timed_import(self, name, *args, **kwargs):
+        before = set(sys.modules)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            # note: py2 relative imports leave None entries in sys.modules
+            new_modules = [m for m in set(sys.modules) - before
+                           if sys.modules[m] is not None]
+            if new_modules:
+                module = self._requested_module(name, new_modules)
+                self.timings[module] = [elapsed, elapsed - children]
+
+    @staticmethod
+    def _requested_module(name, new_modules):
+        # attribute the time to the module that was asked for
+        matches = [m for m in new_modules
+                   if m == name or m.endswith('.' + name)]
+        return min(matches or new_modules, key=len)
+
+    def __enter__(self):
+        import __builtin__
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, *args):
+        import __builtin__
+        __builtin__.__import__ = self._original_import
+
+
+def measure(module):
+    """Import module and return the timings (run in a fresh process!).
+
+    :param module: name of the module to import
+    :return: dictionary with total time, module timings and heavy modules
+    """
+    start = time.time()
+    with ImportTimer() as timer:
+        __import__(module)
+    return {
+        'module': module,
+        'total': time.time() - start,
+        'timings': timer.timings,
+        'heavy_modules': sorted(set(m.split('.')[0] for m in sys.modules
+                                    if m.split('.')[0] in HEAVY_MODULES))
+    }
+
+
+def measure_in_subprocess(module):
+    """Measure the import of module in a fresh python interpreter.
+
+    :param module: name of the module to import
+    :return: dictionary with total time, module timings and heavy modules
+    """
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import json; from gcdt_testtools.startup_benchmark import measure; '
+        'print(json.dumps(measure(%r)))' % str(module)])
+    return json.loads(output.splitlines()[-1])
+
+
+def print_report(result, top=15):
+    print('%s: %.3fs' % (result['module'], result['total']))
+    timings = sorted(result['timings'].items(), key=lambda t: t[1][0],
+                     reverse=True)
+    print('  %-45s %10s %10s' % ('module', 'cumulative', 'self'))
+    for name, (cumulative, self_time) in timings[:top]:
+        print('  %-45s %9.3fs %9.3fs' % (name, cumulative, self_time))
+    if result['heavy_modules']:
+        print('  heavy modules imported: %s' %
+              ', '.join(result['heavy_modules']))
+    print('')
+
+
+def main():
+    modules = sys.argv[1:] or ENTRY_POINTS
+    for module in modules:
+        print_report(measure_in_subprocess(module))
+
+
+if __name__ == '__main__':
+    main()
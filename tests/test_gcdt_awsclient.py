@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import threading
+
+import botocore.session
+import mock
+from nose.tools import assert_equal, assert_is, assert_is_not
+
+from gcdt.gcdt_awsclient import AWSClient
+
+
+def _get_session():
+    session = botocore.session.get_session()
+    session.set_config_variable('region', 'eu-west-1')
+    session.set_credentials('access_key', 'secret_key')
+    return session
+
+
+def test_get_client_cached_per_region():
+    awsclient = AWSClient(_get_session())
+    client = awsclient.get_client('s3')
+    assert_is(awsclient.get_client('s3'), client)
+    assert_equal(client.meta.region_name, 'eu-west-1')
+
+    us_client = awsclient.get_client('s3', region_name='us-east-1')
+    assert_is_not(us_client, client)
+    assert_equal(us_client.meta.region_name, 'us-east-1')
+
+
+def test_get_client_config():
+    awsclient = AWSClient(_get_session(), max_pool_connections=42,
+                          connect_timeout=5)
+    client = awsclient.get_client('cloudformation')
+    assert_equal(client.meta.config.max_pool_connections, 42)
+    assert_equal(client.meta.config.connect_timeout, 5)
+
+
+def test_get_client_max_attempts():
+    session = _get_session()
+    awsclient = AWSClient(session, max_attempts=2)
+    awsclient.get_client('cloudformation')
+    handler = session.get_component('event_emitter')._unique_id_handlers[
+        'retry-config-cloudformation']['handler']
+    assert_equal(handler._checker._max_attempts, 2)
+
+
+def test_get_client_threads():
+    awsclient = AWSClient(_get_session())
+    clients = []
+
+    def _get_client():
+        clients.append(awsclient.get_client('lambda'))
+
+    threads = [threading.Thread(target=_get_client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # all threads got the same client
+    assert_equal(len(set([id(c) for c in clients])), 1)
+
+
+def test_create_clients():
+    awsclient = AWSClient(_get_session())
+    awsclient.create_clients(['s3', 'lambda', 'events'])
+    assert_equal(sorted(awsclient._client_cache.keys()),
+                 [('events', None), ('lambda', None), ('s3', None)])
+
+
+def test_get_client_response_cache():
+    assert_equal(AWSClient(_get_session()).get_cache_stats(), None)
+
+    awsclient = AWSClient(_get_session(), response_cache=True)
+    client = awsclient.get_client('cloudformation')
+    # API calls are routed through the cache
+    assert '_make_api_call' in vars(client)
+    assert_equal(awsclient.get_cache_stats(), {'hits': 0, 'misses': 0})
+
+
+def test_close_connections():
+    awsclient = AWSClient(_get_session())
+    client = awsclient.get_client('s3')
+    with mock.patch.object(client._endpoint.http_session, 'close') as close:
+        awsclient.close_connections()
+    close.assert_called_once_with()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import json
+
+import mock
+import pytest
+
+from gcdt.gcdt_batch import read_manifest, run_jobs, _run_job, \
+    print_summary, check_dependencies, warm_up, execute_job, get_max_width, \
+    run_batch
+from gcdt.gcdt_cmd_dispatcher import cmd
+from gcdt_testtools.helpers import temp_folder, preserve_env  # fixtures!
+
+
+def _write_manifest(jobs, **kwargs):
+    manifest = {'jobs': jobs}
+    manifest.update(kwargs)
+    with open('manifest.json', 'w') as mfile:
+        json.dump(manifest, mfile)
+    return os.path.abspath('manifest.json')
+
+
+def test_read_manifest(temp_folder, preserve_env):
+    os.environ['ENV'] = 'DEV'
+    manifest_file = _write_manifest([
+        {'tool': 'kumo', 'command': 'deploy', 'path': 'stack_a'},
+        {'tool': 'ramuda', 'command': 'deploy', 'env': 'prod', 'id': 'foo'}
+    ], workers=2)
+
+    manifest = read_manifest(manifest_file)
+    assert manifest['workers'] == 2
+    assert manifest['jobs'] == [
+        {'id': '0', 'tool': 'kumo', 'command': 'deploy', 'env': 'dev',
+         'path': os.path.join(temp_folder[0], 'stack_a'), 'dependsOn': []},
+        {'id': 'foo', 'tool': 'ramuda', 'command': 'deploy', 'env': 'prod',
+         'path': os.path.join(temp_folder[0], '.'), 'dependsOn': []}
+    ]
+
+
+def test_read_manifest_unknown_tool(temp_folder):
+    manifest_file = _write_manifest([{'tool': 'sumo', 'command': 'deploy'}])
+    with pytest.raises(Exception) as einfo:
+        read_manifest(manifest_file)
+    assert einfo.match(r'unknown tool')
+
+
+@mock.patch('gcdt.gcdt_batch.lifecycle', return_value=0)
+def test_run_job(mocked_lifecycle, temp_folder, preserve_env):
+    specs = list(cmd._specs)
+    try:
+        job = {'id': '0', 'tool': 'kumo', 'env': 'prod', 'path': temp_folder[0],
+               'command': 'deploy --override-stack-policy -v'}
+        assert _run_job(job) == 0
+        assert os.environ['ENV'] == 'prod'
+        assert os.getcwd() == os.path.realpath(temp_folder[0])
+        args, _ = mocked_lifecycle.call_args
+        assert args[1:4] == ('prod', 'kumo', 'deploy')
+        assert args[4]['--override-stack-policy'] is True
+        assert '--verbose' not in args[4]
+    finally:
+        cmd._specs[:] = specs
+
+
+@mock.patch('gcdt.gcdt_batch.prefetch_stack_outputs')
+@mock.patch('gcdt.gcdt_batch.setup_api_metrics')
+@mock.patch('gcdt.gcdt_batch.are_credentials_still_valid')
+@mock.patch('gcdt.gcdt_batch.load_plugins')
+def test_warm_up_closes_connections(mocked_load_plugins,
+                                    mocked_are_credentials_still_valid,
+                                    mocked_setup_api_metrics,
+                                    mocked_prefetch_stack_outputs):
+    awsclient = mock.Mock()
+    warm_up(awsclient, [{'tool': 'kumo'}])
+    mocked_are_credentials_still_valid.assert_called_once_with(awsclient)
+    # no sockets are inherited by the forked workers
+    assert awsclient.mock_calls[-1] == mock.call.close_connections()
+
+
+@mock.patch('gcdt.gcdt_batch._api_metrics')
+@mock.patch('gcdt.gcdt_batch._run_job', return_value=0)
+def test_execute_job_resets_api_metrics(mocked_run_job, mocked_api_metrics):
+    result = execute_job({'id': 'a'})
+    assert result['exit_code'] == 0
+    # the API calls of warm_up are not counted for the job
+    mocked_api_metrics.reset.assert_called_once_with(job_id='a')
+
+
+def _fake_run_job(job):
+    if job['id'] == 'broken':
+        raise Exception('job failed')
+    if job['id'] == 'killed':
+        os._exit(137)  # e.g. the OOM killer
+    return 0
+
+
+@mock.patch('gcdt.gcdt_batch._run_job', side_effect=_fake_run_job)
+def test_run_jobs(mocked_run_job, temp_folder):
+    jobs = [{'id': id} for id in ['a', 'broken', 'c']]
+    results = run_jobs(jobs, workers=2, logdir='logs')
+    assert [(r['id'], r['exit_code']) for r in results] == \
+        [('a', 0), ('broken', 1), ('c', 0)]
+    assert os.path.isfile('logs/broken.log')
+    with open('logs/broken.log') as logfile:
+        assert 'job failed' in logfile.read()
+
+
+def test_check_dependencies():
+    check_dependencies([{'id': 'a'}, {'id': 'b', 'dependsOn': ['a']}])
+    with pytest.raises(Exception) as einfo:
+        check_dependencies([{'id': 'a', 'dependsOn': ['c']}])
+    assert einfo.match(r'unknown dependency')
+    with pytest.raises(Exception) as einfo:
+        check_dependencies([{'id': 'a', 'dependsOn': ['b']},
+                            {'id': 'b', 'dependsOn': ['c']},
+                            {'id': 'c', 'dependsOn': ['a']}])
+    assert einfo.match(r'dependency cycle: a -> b -> c -> a')
+
+
+def test_get_max_width():
+    assert get_max_width([]) == 0
+    # a chain runs one job at a time
+    assert get_max_width([{'id': 'a'}, {'id': 'b', 'dependsOn': ['a']},
+                          {'id': 'c', 'dependsOn': ['b']}]) == 1
+    assert get_max_width([{'id': 'vpc'},
+                          {'id': 'db', 'dependsOn': ['vpc']},
+                          {'id': 'app', 'dependsOn': ['vpc', 'db']},
+                          {'id': 'dns'}, {'id': 'cdn'}]) == 3
+
+
+@mock.patch('gcdt.gcdt_batch.print_summary')
+@mock.patch('gcdt.gcdt_batch.run_jobs', return_value=[])
+@mock.patch('gcdt.gcdt_batch.warm_up')
+@mock.patch('gcdt.gcdt_batch.AWSClient')
+def test_run_batch_rate_limits(mocked_awsclient, mocked_warm_up,
+                               mocked_run_jobs, mocked_print_summary):
+    jobs = [{'id': 'a'}, {'id': 'b', 'dependsOn': ['a']},
+            {'id': 'c', 'dependsOn': ['b']}]
+    with mock.patch('gcdt.gcdt_batch.AWSCLIENT_CONFIG',
+                    {'rate_limits': {'cloudformation': 8}}):
+        assert run_batch(jobs, workers='4') == 0
+    # the jobs of a chain do not share the limits
+    _, kwargs = mocked_awsclient.call_args
+    assert kwargs['rate_limits'] == {'cloudformation': 8.0}
+    _, kwargs = mocked_run_jobs.call_args
+    assert kwargs['workers'] == 4
+
+    with pytest.raises(Exception) as einfo:
+        run_batch(jobs, workers=0)
+    assert einfo.match(r'workers must be at least 1')
+
+
+def _fake_run_job_order(job):
+    # record the order of the jobs
+    with open('order.txt', 'a') as ofile:
+        ofile.write('%s\n' % job['id'])
+    return _fake_run_job(job)
+
+
+@mock.patch('gcdt.gcdt_batch._run_job', side_effect=_fake_run_job_order)
+def test_run_jobs_dependencies(mocked_run_job, temp_folder):
+    jobs = [
+        {'id': 'app', 'dependsOn': ['vpc', 'db']},
+        {'id': 'db', 'dependsOn': ['vpc']},
+        {'id': 'vpc'},
+        {'id': 'broken'},
+        {'id': 'monitoring', 'dependsOn': ['broken']},
+        {'id': 'alarms', 'dependsOn': ['monitoring']}
+    ]
+    results = run_jobs(jobs, workers=2)
+    assert [(r['id'], r['exit_code']) for r in results] == [
+        ('app', 0), ('db', 0), ('vpc', 0), ('broken', 1),
+        ('monitoring', None), ('alarms', None)]
+    with open('order.txt') as ofile:
+        order = ofile.read().split()
+    assert sorted(order) == ['app', 'broken', 'db', 'vpc']
+    assert order.index('vpc') < order.index('db') < order.index('app')
+
+
+@mock.patch('gcdt.gcdt_batch._run_job', side_effect=_fake_run_job)
+def test_run_jobs_fail_fast(mocked_run_job, temp_folder):
+    # 'x' and 'y' do not depend on 'broken'
+    jobs = [{'id': 'broken'}, {'id': 'x'}, {'id': 'y', 'dependsOn': ['x']}]
+    results = run_jobs(jobs, workers=1, fail_fast=True)
+    assert [(r['id'], r['exit_code']) for r in results] == [
+        ('broken', 1), ('x', None), ('y', None)]
+
+
+@mock.patch('gcdt.gcdt_batch._run_job', side_effect=_fake_run_job)
+def test_run_jobs_worker_died(mocked_run_job, temp_folder):
+    jobs = [{'id': 'killed'}, {'id': 'a'}, {'id': 'b', 'dependsOn': ['killed']}]
+    results = run_jobs(jobs, workers=2)
+    assert [(r['id'], r['exit_code']) for r in results] == [
+        ('killed', 1), ('a', 0), ('b', None)]
+
+
+def test_print_summary(capsys):
+    jobs = [{'id': '0', 'tool': 'kumo', 'command': 'deploy', 'path': '.',
+             'env': 'dev'}]
+    print_summary(jobs, [{'id': '0', 'exit_code': 1, 'duration': 1.0}])
+    out, err = capsys.readouterr()
+    assert 'deploy' in out
+    assert out.endswith('1 jobs, 1 failed\n')
+
+
+def test_print_summary_skipped(capsys):
+    jobs = [{'id': '0', 'tool': 'kumo', 'command': 'deploy', 'path': '.',
+             'env': 'dev'}]
+    print_summary(jobs, [{'id': '0', 'exit_code': None, 'duration': 0.0}])
+    out, err = capsys.readouterr()
+    assert 'skipped' in out
+    assert out.endswith('1 jobs, 0 failed, 1 skipped\n')
@@ -184,4 +184,17 @@ def test_cmd_exception_on_missing_option():
     assert result == {}
     assert einfo.match(r'No implementation for spec: .*')
 
+def test_cmd_select():
+    specs = list(cmd._specs)
+    try:
+        cmd.select('gcdt.tenkai_main')
+        assert [spec for spec, _ in cmd._specs] == \
+            [['version'], ['deploy'], ['bundle']]
+        # the cmds of this module are not dispatched any more
+        with pytest.raises(Exception):
+            cmd.dispatch({'cmd1': True})
+    finally:
+        cmd._specs[:] = specs
+
+
 # TODO: dispatch to get back the return value of the cmd
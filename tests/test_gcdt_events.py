@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import json
+import itertools
+
+import mock
+from nose.tools import assert_equal, assert_true, assert_false
+
+from gcdt.gcdt_events import EventQueue, open_event_queue, \
+    parse_stack_event, parse_deployment_event
+from gcdt.kumo_core import iter_stack_events, _get_notification_arns, \
+    _poll_stack_events
+from gcdt.tenkai_core import deploy, _wait_for_deployment, \
+    _get_deployment_topic, _ensure_deployment_trigger, TRIGGER_NAME, \
+    TRIGGER_EVENTS
+from gcdt_testtools.helpers import preserve_env  # fixtures!
+from gcdt_testtools.helpers import fake_awsclient
+
+STACK_ID = 'arn:aws:cloudformation:eu-west-1:123456789012:stack/mystack/1'
+
+
+class LocalQueue(object):
+    """Stand-in for the sqs client, messages live in memory."""
+    def __init__(self, messages=None):
+        self._ids = itertools.count()
+        self.messages = []
+        self.deleted = []
+        self.receive_calls = 0
+        for message in messages or []:
+            self.send(message)
+
+    def send(self, message, sns=True):
+        body = message
+        if sns:
+            body = json.dumps({'Type': 'Notification', 'Message': message})
+        handle = 'handle-%d' % next(self._ids)
+        self.messages.append({'ReceiptHandle': handle, 'Body': body})
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds):
+        self.receive_calls += 1
+        return {'Messages': self.messages[:MaxNumberOfMessages]}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+        self.messages = [m for m in self.messages
+                         if m['ReceiptHandle'] != ReceiptHandle]
+
+
+def _stack_event(stack_id, status='CREATE_COMPLETE'):
+    return ('StackId=\'%s\'\nTimestamp=\'2017-05-10T11:09:02.154Z\'\n'
+            'LogicalResourceId=\'mystack\'\nResourceStatus=\'%s\'\n'
+            'ResourceStatusReason=\'\'\n' % (stack_id, status))
+
+
+def test_parse_stack_event():
+    event = parse_stack_event(_stack_event(STACK_ID))
+    assert_equal(event['StackId'], STACK_ID)
+    assert_equal(event['ResourceStatus'], 'CREATE_COMPLETE')
+    assert_equal(event['ResourceStatusReason'], '')
+
+
+def test_parse_deployment_event():
+    assert_equal(parse_deployment_event(
+        '{"deploymentId": "d-1", "status": "SUCCEEDED"}')['deploymentId'],
+        'd-1')
+    assert_equal(parse_deployment_event(_stack_event(STACK_ID)), {})
+
+
+def _event_clients():
+    client = mock.Mock()
+    client.create_queue.return_value = {'QueueUrl': 'https://sqs/q'}
+    client.get_queue_attributes.return_value = {
+        'Attributes': {'QueueArn': 'arn:queue'}}
+    client.subscribe.return_value = {'SubscriptionArn': 'arn:subscription'}
+    return client, fake_awsclient(client)
+
+
+def test_open_event_queue():
+    client, awsclient = _event_clients()
+    with open_event_queue(awsclient, 'arn:topic') as queue:
+        assert isinstance(queue, EventQueue)
+        client.subscribe.assert_called_once_with(
+            TopicArn='arn:topic', Protocol='sqs', Endpoint='arn:queue')
+        # only the topic may send to the queue
+        _, kwargs = client.set_queue_attributes.call_args
+        policy = json.loads(kwargs['Attributes']['Policy'])
+        assert_equal(policy['Statement'][0]['Condition'],
+                     {'ArnEquals': {'aws:SourceArn': 'arn:topic'}})
+    # every gcdt process has its own queue which is removed after the wait
+    client.unsubscribe.assert_called_once_with(
+        SubscriptionArn='arn:subscription')
+    client.delete_queue.assert_called_once_with(QueueUrl='https://sqs/q')
+
+
+def test_open_event_queue_fallback_to_polling():
+    client, awsclient = _event_clients()
+    client.subscribe.side_effect = Exception('AuthorizationError')
+    with open_event_queue(awsclient, 'arn:topic') as queue:
+        assert queue is None
+    client.delete_queue.assert_called_once_with(QueueUrl='https://sqs/q')
+
+    with open_event_queue(awsclient, None) as queue:
+        assert queue is None
+    assert_equal(client.create_queue.call_count, 1)
+
+
+def test_event_queue_wait_matching_event():
+    client = LocalQueue()
+    client.send(_stack_event('other-stack'))
+    client.send(_stack_event(STACK_ID), sns=False)  # raw message delivery
+    queue = EventQueue(client, 'https://sqs/gcdt-events')
+    assert_true(queue.wait(lambda m: STACK_ID in m, timeout=5))
+    # the queue is ours, events of other stacks are dropped
+    assert_equal(client.deleted, ['handle-0', 'handle-1'])
+    assert_equal(client.messages, [])
+
+
+@mock.patch('gcdt.gcdt_events.time.sleep')
+def test_event_queue_fallback_to_polling(mock_sleep):
+    client = mock.Mock()
+    client.receive_message.side_effect = Exception('AccessDenied')
+    queue = EventQueue(client, 'https://sqs/gcdt-events')
+    assert_false(queue.wait(lambda m: True, timeout=10))
+    assert_false(queue.available)
+    # we sleep for the rest of the timeout and the caller polls
+    assert_equal(mock_sleep.call_count, 1)
+    assert mock_sleep.call_args[0][0] > 9
+    queue.wait(lambda m: True, timeout=10)
+    assert_equal(client.receive_message.call_count, 1)
+
+
+@mock.patch('gcdt.kumo_core.time.sleep')
+def test_iter_stack_events_with_event_queue(mock_sleep):
+    events = [
+        {'StackEvents': [{'EventId': '1', 'ResourceStatus': 'IN_PROGRESS'}]},
+        {'StackEvents': [{'EventId': '2', 'ResourceStatus': 'COMPLETE'},
+                         {'EventId': '1', 'ResourceStatus': 'IN_PROGRESS'}]},
+    ]
+    client_cf = mock.Mock()
+    client_cf.describe_stack_events.side_effect = events
+    awsclient = fake_awsclient(client_cf)
+    queue = EventQueue(LocalQueue([_stack_event(STACK_ID)]),
+                       'https://sqs/gcdt-events')
+    stack_events = iter_stack_events(awsclient, STACK_ID, event_queue=queue)
+    assert_equal([next(stack_events)['EventId'],
+                  next(stack_events)['EventId']], ['1', '2'])
+    # the second describe call was triggered by the event
+    assert_equal(mock_sleep.call_count, 0)
+
+
+@mock.patch('gcdt.kumo_core.open_event_queue')
+@mock.patch('gcdt.kumo_core.iter_stack_events')
+def test_poll_stack_events_uses_queue_of_topic(mocked_iter_stack_events,
+                                               mocked_open_event_queue,
+                                               preserve_env, capsys):
+    os.environ['GCDT_EVENT_TOPIC'] = 'arn:topic'
+    mocked_iter_stack_events.return_value = iter([{
+        'LogicalResourceId': 'mystack', 'ResourceStatus': 'UPDATE_COMPLETE',
+        'Timestamp': 1}])
+    client_cf = mock.Mock()
+    awsclient = fake_awsclient(client_cf)
+    for arns, topic in [(['arn:topic'], 'arn:topic'), (['arn:ops'], None)]:
+        client_cf.describe_stacks.return_value = {'Stacks': [
+            {'StackId': STACK_ID, 'NotificationARNs': arns}]}
+        _poll_stack_events(awsclient, 'mystack')
+        # the stack must send its events to the topic, otherwise we poll
+        mocked_open_event_queue.assert_called_with(awsclient, topic)
+
+
+def test_get_notification_arns(preserve_env):
+    client_cf = mock.Mock()
+    client_cf.describe_stacks.return_value = {'Stacks': [
+        {'NotificationARNs': ['arn:ops']}]}
+    awsclient = fake_awsclient(client_cf)
+    assert_equal(_get_notification_arns(awsclient, 'mystack'), {})
+    os.environ['GCDT_EVENT_TOPIC'] = 'arn:topic'
+    assert_equal(_get_notification_arns(awsclient),
+                 {'NotificationARNs': ['arn:topic']})
+    # notifications of the deployed stack are preserved
+    assert_equal(_get_notification_arns(awsclient, 'mystack'),
+                 {'NotificationARNs': ['arn:ops', 'arn:topic']})
+
+
+@mock.patch('gcdt.gcdt_waiter.time.sleep')
+def test_wait_for_deployment_with_event_queue(mock_sleep):
+    client_cd = mock.Mock()
+    client_cd.get_deployment.side_effect = [
+        {'deploymentInfo': {'status': 'InProgress'}},
+        {'deploymentInfo': {'status': 'Succeeded'}}
+    ]
+    awsclient = fake_awsclient(client_cd)
+    sqs = LocalQueue()
+    sqs.send(json.dumps({'deploymentId': 'd-other', 'status': 'FAILED'}))
+    sqs.send(json.dumps({'deploymentId': 'd-1', 'status': 'SUCCEEDED'}))
+    queue = EventQueue(sqs, 'https://sqs/gcdt-events')
+    assert_equal(_wait_for_deployment(awsclient, 'd-1', 100, queue), 0)
+    assert_equal(client_cd.get_deployment.call_count, 2)
+    assert_equal(sqs.receive_calls, 1)
+    assert_equal(mock_sleep.call_count, 0)
+
+
+def test_ensure_deployment_trigger():
+    client_cd = mock.Mock()
+    client_cd.get_deployment_group.return_value = {'deploymentGroupInfo': {
+        'triggerConfigurations': [{'triggerName': 'ops',
+                                   'triggerTargetArn': 'arn:ops',
+                                   'triggerEvents': ['DeploymentFailure']}]
+    }}
+    awsclient = fake_awsclient(client_cd)
+    _ensure_deployment_trigger(awsclient, 'app', 'group', 'arn:topic')
+    _, kwargs = client_cd.update_deployment_group.call_args
+    assert_equal(kwargs['triggerConfigurations'], [
+        {'triggerName': 'ops', 'triggerTargetArn': 'arn:ops',
+         'triggerEvents': ['DeploymentFailure']},
+        {'triggerName': TRIGGER_NAME, 'triggerTargetArn': 'arn:topic',
+         'triggerEvents': TRIGGER_EVENTS}
+    ])
+
+    # trigger is already in place
+    client_cd.reset_mock()
+    client_cd.get_deployment_group.return_value = {'deploymentGroupInfo': {
+        'triggerConfigurations': kwargs['triggerConfigurations']}}
+    _ensure_deployment_trigger(awsclient, 'app', 'group', 'arn:topic')
+    assert_equal(client_cd.update_deployment_group.call_count, 0)
+
+
+def test_get_deployment_topic(preserve_env):
+    client_cd = mock.Mock()
+    client_cd.get_deployment.return_value = {'deploymentInfo': {
+        'applicationName': 'app', 'deploymentGroupName': 'group'}}
+    client_cd.get_deployment_group.return_value = {'deploymentGroupInfo': {
+        'triggerConfigurations': [{'triggerName': TRIGGER_NAME,
+                                   'triggerTargetArn': 'arn:topic',
+                                   'triggerEvents': TRIGGER_EVENTS}]}}
+    awsclient = fake_awsclient(client_cd)
+    assert _get_deployment_topic(awsclient, 'd-1') is None
+    os.environ['GCDT_EVENT_TOPIC'] = 'arn:topic'
+    assert_equal(_get_deployment_topic(awsclient, 'd-1'), 'arn:topic')
+    os.environ['GCDT_EVENT_TOPIC'] = 'arn:other'
+    assert _get_deployment_topic(awsclient, 'd-1') is None
+
+
+@mock.patch('gcdt.tenkai_core.upload_file_to_s3', return_value=('etag', '1'))
+def test_deploy_trigger_is_opt_in(mocked_upload, preserve_env):
+    client_cd = mock.Mock()
+    client_cd.create_deployment.return_value = {'deploymentId': 'd-1'}
+    client_cd.meta.region_name = 'eu-west-1'
+    client_cd.get_deployment_group.return_value = {'deploymentGroupInfo': {}}
+    awsclient = fake_awsclient(client_cd)
+    os.environ['GCDT_EVENT_TOPIC'] = 'arn:topic'
+    deploy(awsclient, 'app', 'group', 'config', 'bucket', 'bundle.tgz')
+    client_cd.update_deployment_group.assert_not_called()
+    os.environ['GCDT_EVENT_TRIGGER'] = 'true'
+    deploy(awsclient, 'app', 'group', 'config', 'bucket', 'bundle.tgz')
+    assert_equal(client_cd.update_deployment_group.call_count, 1)
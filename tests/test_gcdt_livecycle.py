@@ -1,22 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import os
+import time
 import textwrap
+from copy import deepcopy
 
 import pytest
 import mock
 
 from gcdt.gcdt_lifecycle import main, lifecycle, check_vpn_connection, \
-    _load_hooks
+    _load_hooks, read_config
 from gcdt.kumo_main import DOC
 from gcdt import gcdt_signals
 from gcdt_testtools.helpers import create_tempfile
 
 
-@mock.patch('gcdt.gcdt_lifecycle.AWSClient', return_value='my_awsclient')
+@mock.patch('gcdt.gcdt_lifecycle.AWSClient')
 @mock.patch('gcdt.gcdt_lifecycle.docopt')
 @mock.patch('gcdt.gcdt_lifecycle.lifecycle')
 def test_main(mocked_lifecycle, mocked_docopt, mocked_awsclient):
+    awsclient = mocked_awsclient.return_value
+    awsclient.get_cache_stats.return_value = None
     mocked_docopt.return_value = {
         u'--override-stack-policy': False,
         u'-f': False,
@@ -30,8 +34,10 @@ def test_main(mocked_lifecycle, mocked_docopt, mocked_awsclient):
     }
     main(DOC, 'kumo')
     # mocked_check_gcdt_update.assert_called_once()
+    awsclient.create_clients.assert_called_once_with(
+        ['cloudformation', 's3', 'sts'])
     mocked_lifecycle.assert_called_once_with(
-        'my_awsclient', 'dev', 'kumo', 'deploy',
+        awsclient, 'dev', 'kumo', 'deploy',
         {'-f': False, '--override-stack-policy': False, 'version': False,
          'deploy': True, 'preview': False, 'list': False, 'generate': False,
          'dot': False, 'delete': False})
@@ -61,6 +67,28 @@ def test_main_dispatch_only(mocked_docopt, mocked_check_gcdt_update,
          'dot': False, 'delete': False})
 
 
+@mock.patch('gcdt.gcdt_lifecycle.AWSClient')
+@mock.patch('gcdt.gcdt_lifecycle.cmd.dispatch')
+@mock.patch('gcdt.gcdt_lifecycle.check_gcdt_update')
+@mock.patch('gcdt.gcdt_lifecycle.docopt')
+@mock.patch('gcdt.gcdt_lifecycle.lifecycle')
+def test_main_dispatch_only_option(mocked_lifecycle, mocked_docopt,
+                                   mocked_check_gcdt_update,
+                                   mocked_cmd_dispatch, mocked_awsclient):
+    mocked_awsclient.return_value.get_cache_stats.return_value = None
+    arguments = {u'generate': True, u'--envs': None, u'--workers': None}
+    mocked_docopt.return_value = arguments
+    main(DOC, 'kumo', dispatch_only=[('generate', '--envs')])
+    # without the option the command runs in the lifecycle
+    mocked_cmd_dispatch.assert_not_called()
+    assert mocked_lifecycle.call_count == 1
+
+    arguments[u'--envs'] = 'dev,prod'
+    main(DOC, 'kumo', dispatch_only=[('generate', '--envs')])
+    mocked_cmd_dispatch.assert_called_once_with(arguments)
+    assert mocked_lifecycle.call_count == 1
+
+
 def _dummy_signal_factory(name, exp_signals):
     def _dummy_signal_handler(args):
         print('signal fired: %s' % name)
@@ -119,6 +147,25 @@ def test_lifecycle(mocked_load_plugins, mocked_check_gcdt_update,
     mocked_cmd_dispatch.called_once_with('my_awsclient')
 
 
+def test_read_config_without_lookups():
+    signal_handlers = []  # GC cleans them up if there is no ref
+    exp_signals = ['config_read_init', 'config_read_finalized']
+    for s in exp_signals + ['lookup_init', 'config_validation_init']:
+        sig = gcdt_signals.__dict__[s]
+        handler = _dummy_signal_factory(s, exp_signals)
+        sig.connect(handler)
+        signal_handlers.append(handler)
+    try:
+        config = read_config({'env': 'dev'}, lookups=False)
+    finally:
+        for s, handler in zip(['config_read_init', 'config_read_finalized',
+                               'lookup_init', 'config_validation_init'],
+                              signal_handlers):
+            gcdt_signals.__dict__[s].disconnect(handler)
+    assert exp_signals == []
+    assert config['kumo'] == {}
+
+
 @mock.patch('gcdt.gcdt_lifecycle.cmd.dispatch', side_effect=Exception)
 @mock.patch('gcdt.gcdt_lifecycle.are_credentials_still_valid', return_value=False)
 @mock.patch('gcdt.gcdt_lifecycle.check_gcdt_update')
@@ -165,6 +212,52 @@ def test_lifecycle_error(mocked_load_plugins, mocked_check_gcdt_update,
     mocked_cmd_dispatch.called_once_with('my_awsclient')
 
 
+def _slow_lookup(params):
+    context, config = params
+    config['kumo'] = {}
+    time.sleep(0.05)
+
+
+@mock.patch('gcdt.gcdt_lifecycle.cmd.dispatch', return_value=0)
+@mock.patch('gcdt.gcdt_lifecycle.are_credentials_still_valid', return_value=False)
+@mock.patch('gcdt.gcdt_lifecycle.check_gcdt_update')
+@mock.patch('gcdt.gcdt_lifecycle.load_plugins')
+def test_lifecycle_timings(mocked_load_plugins, mocked_check_gcdt_update,
+                           mocked_are_credentials_still_valid,
+                           mocked_cmd_dispatch):
+    timings = []
+
+    def _finalized(context):
+        timings.append(deepcopy(context['timings']))
+
+    gcdt_signals.lookup_init.connect(_slow_lookup)
+    gcdt_signals.finalized.connect(_finalized)
+    try:
+        exit_code = lifecycle('my_awsclient', 'dev', 'kumo', 'deploy',
+                              {u'deploy': True})
+    finally:
+        gcdt_signals.lookup_init.disconnect(_slow_lookup)
+        gcdt_signals.finalized.disconnect(_finalized)
+    assert exit_code == 0
+
+    # timings are available to the finalized signal
+    phases = [p['phase'] for p in timings[0]['phases']]
+    assert phases == [
+        'initialized',
+        'config_read_init', 'config_read_finalized',
+        'lookup_init', 'lookup_finalized',
+        'config_validation_init', 'config_validation_finalized',
+        'bundle_pre', 'bundle_init', 'bundle_finalized',
+        'command_init', 'command', 'command_finalized'
+    ]
+    assert timings[0]['phases'][3]['duration'] >= 0.05
+    receivers = [r for r in timings[0]['receivers']
+                 if r['phase'] == 'lookup_init']
+    assert receivers[0]['receiver'].endswith(
+        'test_gcdt_livecycle._slow_lookup')
+    assert receivers[0]['duration'] >= 0.05
+
+
 @mock.patch('gcdt.gcdt_lifecycle.requests.get',
             return_value={'status_code' == 404})
 def test_check_vpn_connection(mocked_requests_get):
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import gc
+import json
+
+import botocore.session
+import pytest
+from nose.tools import assert_equal
+
+from gcdt import gcdt_signals, gcdt_metrics
+from gcdt.gcdt_awsclient import AWSClient
+from gcdt.gcdt_metrics import ApiMetrics, setup_api_metrics, _get_bucket
+from gcdt_testtools.placebo_awsclient import FakeHttpResponse
+from gcdt_testtools.helpers import Bunch
+from gcdt_testtools.helpers import temp_folder, preserve_env  # fixtures!
+
+
+def _get_awsclient(responses):
+    # awsclient which answers the API calls with the given responses
+    session = botocore.session.get_session()
+    session.set_config_variable('region', 'eu-west-1')
+    session.set_credentials('access_key', 'secret_key')
+    awsclient = AWSClient(session)
+
+    def _fake_response(**kwargs):
+        return responses.pop(0)
+
+    awsclient.register('before-call.*.*', _fake_response,
+                       unique_id='fake-response')
+    return awsclient
+
+
+def _model(operation):
+    return Bunch(name=operation,
+                 service_model=Bunch(endpoint_prefix='cloudformation'))
+
+
+def test_get_bucket():
+    assert_equal(_get_bucket(0.01), '<=0.05')
+    assert_equal(_get_bucket(0.3), '<=0.5')
+    assert_equal(_get_bucket(60), '>10.0')
+
+
+def test_api_metrics():
+    awsclient = _get_awsclient([
+        (FakeHttpResponse(200), {'Stacks': [],
+                                 'ResponseMetadata': {'RetryAttempts': 2}}),
+        (FakeHttpResponse(400), {'Error': {'Code': 'ValidationError',
+                                           'Message': 'does not exist'}})
+    ])
+    api_metrics = ApiMetrics()
+    api_metrics.register(awsclient)
+    client = awsclient.get_client('cloudformation')
+    client.describe_stacks()
+    with pytest.raises(Exception):
+        client.describe_stacks(StackName='foo')
+
+    summary = api_metrics.get_summary()
+    stats = summary['operations']['cloudformation.DescribeStacks']
+    assert_equal(stats['count'], 2)
+    assert_equal(stats['errors'], 1)
+    assert_equal(stats['retries'], 2)
+    assert_equal(sum(stats['histogram'].values()), 2)
+    assert_equal(summary['count'], 2)
+
+
+def test_api_metrics_throttled():
+    api_metrics = ApiMetrics()
+    throttled = (FakeHttpResponse(400), {'Error': {'Code': 'Throttling'}})
+    api_metrics._needs_retry(response=throttled,
+                             operation=_model('DescribeStacks'), attempts=1)
+    api_metrics._needs_retry(response=None,
+                             operation=_model('DescribeStacks'), attempts=2)
+    stats = api_metrics.get_summary()['operations'][
+        'cloudformation.DescribeStacks']
+    assert_equal(stats['throttled'], 1)
+
+
+def test_api_metrics_finalized(temp_folder, preserve_env):
+    os.environ['GCDT_METRICS_FILE'] = 'metrics.json'
+    awsclient = _get_awsclient([(FakeHttpResponse(200), {'Stacks': []})])
+    api_metrics = setup_api_metrics(awsclient)
+    try:
+        awsclient.get_client('cloudformation').describe_stacks()
+        context = {}
+        gcdt_signals.command_finalized.send((context, {}))
+        assert_equal(context['api_metrics']['count'], 1)
+        gcdt_signals.finalized.send(context)
+    finally:
+        gcdt_signals.command_finalized.disconnect(
+            api_metrics.on_command_finalized)
+        gcdt_signals.finalized.disconnect(api_metrics.on_finalized)
+        gcdt_signals.error.disconnect(api_metrics.on_error)
+
+    with open('metrics.json') as mfile:
+        assert_equal(json.load(mfile), context['api_metrics'])
+
+
+def test_api_metrics_error(temp_folder, preserve_env):
+    os.environ['GCDT_METRICS_FILE'] = 'metrics.json'
+    awsclient = _get_awsclient([(FakeHttpResponse(200), {'Stacks': []})])
+    # the receivers of a previous lifecycle are replaced
+    setup_api_metrics(_get_awsclient([]))
+    api_metrics = setup_api_metrics(awsclient)
+    try:
+        awsclient.get_client('cloudformation').describe_stacks()
+        context = {}
+        gcdt_signals.error.send((context, {}))
+    finally:
+        gcdt_signals.command_finalized.disconnect(
+            api_metrics.on_command_finalized)
+        gcdt_signals.finalized.disconnect(api_metrics.on_finalized)
+        gcdt_signals.error.disconnect(api_metrics.on_error)
+
+    assert_equal(context['api_metrics']['count'], 1)
+    with open('metrics.json') as mfile:
+        assert_equal(json.load(mfile)['count'], 1)
+
+
+def test_api_metrics_reset():
+    api_metrics = ApiMetrics()
+    throttled = (FakeHttpResponse(400), {'Error': {'Code': 'Throttling'}})
+    api_metrics._needs_retry(response=throttled,
+                             operation=_model('DescribeStacks'), attempts=1)
+    api_metrics.reset()
+    assert_equal(api_metrics.get_summary()['operations'], {})
+
+
+def test_api_metrics_file_per_job(temp_folder, preserve_env):
+    os.environ['GCDT_METRICS_FILE'] = 'metrics.json'
+    api_metrics = ApiMetrics()
+    api_metrics.reset(job_id='mystack')
+    context = {}
+    api_metrics.on_error((context, {}))
+    # every batch job writes its own file
+    assert not os.path.exists('metrics.json')
+    with open('metrics-mystack.json') as mfile:
+        assert_equal(json.load(mfile), context['api_metrics'])
+    assert_equal(os.listdir('.'), ['metrics-mystack.json'])
+
+
+def test_setup_api_metrics_keeps_reference():
+    # the lifecycle does not hold the ApiMetrics
+    setup_api_metrics(_get_awsclient([]))
+    gc.collect()
+    try:
+        context = {}
+        gcdt_signals.command_finalized.send((context, {}))
+        assert_equal(context['api_metrics']['count'], 0)
+    finally:
+        api_metrics = gcdt_metrics._active
+        gcdt_signals.command_finalized.disconnect(
+            api_metrics.on_command_finalized)
+        gcdt_signals.finalized.disconnect(api_metrics.on_finalized)
+        gcdt_signals.error.disconnect(api_metrics.on_error)
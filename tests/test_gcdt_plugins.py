@@ -1,10 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import os
+import sys
+import textwrap
+
 import mock
+import pytest
 
-from gcdt.gcdt_plugins import load_plugins
+from gcdt import gcdt_plugins, gcdt_signals
+from gcdt.gcdt_plugins import load_plugins, load_plugins_for_signal, \
+    PLUGIN_INDEX_FILE
 from gcdt.gcdt_signals import check_hook_mechanism_is_intact
+from gcdt.utils import read_cache_file
+from gcdt_testtools.helpers import Bunch
+from gcdt_testtools.helpers import temp_folder, temp_cache_dir  # fixtures!
+
+PLUGIN = textwrap.dedent("""
+    from gcdt import gcdt_signals
+
+    calls = []
+
+
+    def _initialized(context):
+        calls.append(context)
+
+
+    def register():
+        gcdt_signals.initialized.connect(_initialized)
+
+
+    def deregister():
+        gcdt_signals.initialized.disconnect(_initialized)
+""")
 
 
 def test_load_plugins():
@@ -35,3 +63,95 @@ def test_check_hook_mechanism_is_intact_detects_missing():
             pass
 
     assert check_hook_mechanism_is_intact(_dummy) is False
+
+
+@pytest.fixture(scope='function')
+def lazy_plugin(temp_folder, temp_cache_dir):
+    # importable plugin module plus a fake entry point
+    with open('lazy_plugin.py', 'w') as pfile:
+        pfile.write(PLUGIN)
+    sys.path.insert(0, temp_folder[0])
+    ep = Bunch(name='lazy_plugin', module_name='lazy_plugin', attrs=(),
+               load=lambda: __import__('lazy_plugin'), path=temp_folder[0])
+    with mock.patch('pkg_resources.iter_entry_points', return_value=[ep]):
+        yield ep
+    # cleanup
+    if 'lazy_plugin' in sys.modules:
+        sys.modules.pop('lazy_plugin').deregister()
+    sys.path.remove(temp_folder[0])
+    del gcdt_plugins._registered_plugins[:]
+    gcdt_plugins._pending_plugins.clear()
+    gcdt_plugins._plugin_signals.clear()
+
+
+def _reset_plugins():
+    # simulate a fresh gcdt process
+    sys.modules.pop('lazy_plugin').deregister()
+    del gcdt_plugins._registered_plugins[:]
+    gcdt_plugins._pending_plugins.clear()
+
+
+def test_load_plugins_lazy_writes_index(lazy_plugin):
+    load_plugins(lazy=True)
+    index = read_cache_file(PLUGIN_INDEX_FILE)
+    assert index['group'] == 'gcdt10'
+    plugin_file = os.path.join(lazy_plugin.path, 'lazy_plugin.py')
+    assert index['plugins'] == [{
+        'name': 'lazy_plugin', 'module': 'lazy_plugin', 'attrs': [],
+        'signals': ['initialized'],
+        'files': {plugin_file: os.path.getmtime(plugin_file)}}]
+
+
+def test_load_plugins_lazy_shared_module(lazy_plugin):
+    # two entry points for the same plugin module
+    other_ep = Bunch(name='other', module_name='lazy_plugin', attrs=(),
+                     load=lambda: __import__('lazy_plugin'))
+    with mock.patch('pkg_resources.iter_entry_points',
+                    return_value=[lazy_plugin, other_ep]):
+        load_plugins(lazy=True)
+    index = read_cache_file(PLUGIN_INDEX_FILE)
+    assert [e['signals'] for e in index['plugins']] == \
+        [['initialized'], ['initialized']]
+
+
+def test_load_plugins_lazy_plugin_changed(lazy_plugin):
+    # e.g. a plugin installed with 'pip install -e'
+    load_plugins(lazy=True)
+    _reset_plugins()
+    plugin_file = os.path.join(lazy_plugin.path, 'lazy_plugin.py')
+    mtime = os.path.getmtime(plugin_file)
+    os.utime(plugin_file, (mtime + 10, mtime + 10))
+
+    load_plugins(lazy=True)
+    # index was rebuilt so the plugin is loaded right away
+    assert 'lazy_plugin' in sys.modules
+
+
+def test_load_plugins_lazy_uses_index(lazy_plugin):
+    load_plugins(lazy=True)
+    _reset_plugins()
+
+    with mock.patch('pkg_resources.iter_entry_points') as mocked_iter:
+        load_plugins(lazy=True)
+        mocked_iter.assert_not_called()
+    # plugin is imported when the signal is about to fire
+    assert 'lazy_plugin' not in sys.modules
+    assert 'initialized' in gcdt_plugins._pending_plugins
+    load_plugins_for_signal('initialized')
+    assert 'lazy_plugin' in sys.modules
+    assert gcdt_plugins._pending_plugins == {}
+
+    gcdt_signals.initialized.send({'foo': 'bar'})
+    assert sys.modules['lazy_plugin'].calls == [{'foo': 'bar'}]
+
+
+def test_load_plugins_lazy_invalid_fingerprint(lazy_plugin):
+    load_plugins(lazy=True)
+    _reset_plugins()
+
+    with mock.patch('gcdt.gcdt_plugins.get_environment_fingerprint',
+                    return_value='changed'):
+        load_plugins(lazy=True)
+    # index was rebuilt so the plugin is loaded right away
+    assert 'lazy_plugin' in sys.modules
+    assert read_cache_file(PLUGIN_INDEX_FILE)['fingerprint'] == 'changed'
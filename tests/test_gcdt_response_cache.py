@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import time
+import threading
+
+import pytest
+from nose.tools import assert_equal
+
+from gcdt.gcdt_response_cache import ResponseCache
+from gcdt_testtools.helpers import Bunch
+
+TTLS = {'cloudformation.DescribeStacks': 60}
+
+
+def _stack(status='CREATE_COMPLETE'):
+    return {'Stacks': [{'StackName': 'foo', 'StackStatus': status}]}
+
+
+class _FakeApi(object):
+    # records the calls which made it to the API
+    def __init__(self, response=None, delay=0):
+        self.calls = []
+        self.response = response or _stack()
+        self.delay = delay
+        self.meta = Bunch(
+            service_model=Bunch(endpoint_prefix='cloudformation'),
+            region_name='eu-west-1')
+
+    def _make_api_call(self, operation_name, api_params):
+        self.calls.append((operation_name, api_params))
+        time.sleep(self.delay)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+def _cached_client(api, ttls=TTLS):
+    cache = ResponseCache(ttls)
+    return cache, cache.wrap_client(api)
+
+
+def test_response_cache_hit():
+    api = _FakeApi()
+    cache, client = _cached_client(api)
+    for _ in range(3):
+        response = client._make_api_call('DescribeStacks',
+                                         {'StackName': 'foo'})
+        assert_equal(response, _stack())
+    assert_equal(len(api.calls), 1)
+    assert_equal(cache.get_stats(), {'hits': 2, 'misses': 1})
+
+
+def test_response_cache_ttl():
+    api = _FakeApi()
+    cache, client = _cached_client(api, {'cloudformation.DescribeStacks': 0})
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    assert_equal(len(api.calls), 2)
+
+
+def test_response_cache_not_configured_operation():
+    api = _FakeApi()
+    cache, client = _cached_client(api)
+    client._make_api_call('DescribeStackEvents', {'StackName': 'foo'})
+    client._make_api_call('DescribeStackEvents', {'StackName': 'foo'})
+    assert_equal(len(api.calls), 2)
+
+
+def test_response_cache_stack_in_transition():
+    api = _FakeApi(_stack('UPDATE_IN_PROGRESS'))
+    cache, client = _cached_client(api)
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    assert_equal(len(api.calls), 2)
+
+
+def test_response_cache_invalidation():
+    api = _FakeApi()
+    cache, client = _cached_client(api)
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    client._make_api_call('DescribeStacks', {'StackName': 'bar'})
+    client._make_api_call('DescribeStacks', {})
+    client._make_api_call('UpdateStack', {'StackName': 'foo',
+                                          'TemplateBody': '{}'})
+    # 'bar' is still cached
+    client._make_api_call('DescribeStacks', {'StackName': 'bar'})
+    assert_equal(len(api.calls), 4)
+    # 'foo' and the list of all stacks are invalidated
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    client._make_api_call('DescribeStacks', {})
+    assert_equal(len(api.calls), 6)
+
+
+def test_response_cache_invalidation_arn():
+    api = _FakeApi()
+    cache, client = _cached_client(api)
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    # the stack id refers to the same stack
+    client._make_api_call('DeleteStack', {
+        'StackName': 'arn:aws:cloudformation:eu-west-1:123:stack/foo/1'})
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    assert_equal(len(api.calls), 3)
+
+
+def test_response_cache_read_during_mutation():
+    api = _FakeApi()
+    update_started, read_done = threading.Event(), threading.Event()
+    make_api_call = api._make_api_call
+
+    def _make_api_call(operation_name, api_params):
+        if operation_name == 'UpdateStack':
+            update_started.set()
+            read_done.wait()
+        return make_api_call(operation_name, api_params)
+
+    api._make_api_call = _make_api_call
+    cache, client = _cached_client(api)
+    update = threading.Thread(target=client._make_api_call,
+                              args=('UpdateStack', {'StackName': 'foo'}))
+    update.start()
+    update_started.wait()
+    # this response shows the stack before the update
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    read_done.set()
+    update.join()
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    assert_equal([c[0] for c in api.calls],
+                 ['DescribeStacks', 'UpdateStack', 'DescribeStacks'])
+
+
+def test_response_cache_coalesce_in_flight():
+    api = _FakeApi(delay=0.1)
+    cache, client = _cached_client(api)
+    threads = [threading.Thread(
+        target=client._make_api_call,
+        args=('DescribeStacks', {'StackName': 'foo'})) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert_equal(len(api.calls), 1)
+    assert_equal(cache.get_stats(), {'hits': 4, 'misses': 1})
+
+
+def test_response_cache_failed_call():
+    api = _FakeApi()
+    cache, client = _cached_client(api)
+    api.response = Exception('Throttling')
+    with pytest.raises(Exception):
+        client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    api.response = _stack()
+    client._make_api_call('DescribeStacks', {'StackName': 'foo'})
+    assert_equal(len(api.calls), 2)
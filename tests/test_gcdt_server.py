@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import io
+import os
+import threading
+
+import mock
+import pytest
+
+from gcdt.gcdt_server import _ForkingUnixServer, _JobHandler, submit
+from gcdt_testtools.helpers import temp_folder, preserve_env  # fixtures!
+
+
+def _fake_execute_job(job):
+    # runs in the forked worker, output goes to the client
+    print('running %s %s in %s' % (job['tool'], job['command'], job['path']))
+    return {'id': job['id'], 'exit_code': 0 if job['tool'] == 'kumo' else 3,
+            'duration': 0.0}
+
+
+@pytest.fixture(scope='function')
+def server(temp_folder):
+    socket_path = os.path.join(temp_folder[0], 'gcdt.sock')
+    server = _ForkingUnixServer(socket_path, _JobHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    with mock.patch('gcdt.gcdt_server.execute_job',
+                    side_effect=_fake_execute_job):
+        thread.start()
+        yield socket_path
+        server.shutdown()
+    server.server_close()
+
+
+def test_submit(server, preserve_env):
+    os.environ['ENV'] = 'dev'
+    out = io.BytesIO()
+    assert submit('kumo', 'deploy -v', server, out=out) == 0
+    assert out.getvalue() == b'running kumo deploy -v in %s\n' % os.getcwd()
+
+    out = io.BytesIO()
+    assert submit('ramuda', 'deploy', server, out=out) == 3
+
+
+def test_submit_invalid_job(server, preserve_env):
+    os.environ['ENV'] = 'dev'
+    out = io.BytesIO()
+    assert submit('sumo', 'deploy', server, out=out) == 1
+    assert b'unknown tool' in out.getvalue()
+
+
+def test_submit_no_server(temp_folder):
+    assert submit('kumo', 'deploy', 'no.sock') == 1
+
+
+@mock.patch('gcdt.gcdt_server.warm_up')
+@mock.patch('gcdt.gcdt_server.are_credentials_still_valid')
+def test_server_credentials_expired(mocked_are_credentials_still_valid,
+                                    mocked_warm_up, temp_folder):
+    server = _ForkingUnixServer(os.path.join(temp_folder[0], 'gcdt.sock'),
+                                _JobHandler)
+    awsclients = [mock.Mock(), mock.Mock()]
+    server.create_awsclient = lambda: awsclients.pop(0)
+    try:
+        server.warm_up()
+        awsclient = server.awsclient
+        with mock.patch('SocketServer.ForkingMixIn.process_request') as \
+                mocked_process_request:
+            # valid credentials
+            mocked_are_credentials_still_valid.return_value = 0
+            server.process_request('request', 'address')
+            assert server.awsclient is awsclient
+            # expired credentials, the server starts over
+            mocked_are_credentials_still_valid.return_value = 1
+            server.process_request('request', 'address')
+            assert server.awsclient is not awsclient
+        assert mocked_process_request.call_count == 2
+        assert mocked_warm_up.call_count == 2
+    finally:
+        server.server_close()
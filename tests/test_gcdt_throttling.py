@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import time
+
+import botocore.session
+import mock
+from nose.tools import assert_equal, assert_true, assert_is_none
+
+from gcdt.gcdt_awsclient import AWSClient
+from gcdt.gcdt_throttling import TokenBucket, ThrottleAwareRetryHandler, \
+    is_throttled, get_backoff, share_rate_limits, MAX_BACKOFF
+from gcdt_testtools.placebo_awsclient import FakeHttpResponse
+
+THROTTLED = (FakeHttpResponse(400), {'Error': {'Code': 'Throttling'}})
+SERVER_ERROR = (FakeHttpResponse(500), {'Error': {'Code': 'InternalError'}})
+CLIENT_ERROR = (FakeHttpResponse(400), {'Error': {'Code': 'ValidationError'}})
+SUCCESS = (FakeHttpResponse(200), {})
+
+
+def _checker(attempts, response, caught_exception):
+    # retry server errors only
+    return attempts < 3 and response is not None and \
+        response[0].status_code >= 500
+
+
+def test_is_throttled():
+    assert_true(is_throttled(THROTTLED))
+    assert_true(is_throttled((FakeHttpResponse(429), {})))
+    assert_equal(is_throttled(CLIENT_ERROR), False)
+    assert_equal(is_throttled(None), False)
+
+
+def test_get_backoff():
+    for attempts in range(1, 10):
+        assert 0 <= get_backoff(attempts) <= MAX_BACKOFF
+        assert 0 <= get_backoff(attempts, throttled=True) <= MAX_BACKOFF
+    assert get_backoff(1) <= 0.1
+
+
+def test_token_bucket_acquire():
+    bucket = TokenBucket(20)
+    start = time.time()
+    for _ in range(30):
+        bucket.acquire()
+    # 20 tokens burst, 10 tokens at 20/s
+    assert 0.4 <= time.time() - start < 1.0
+
+
+def test_token_bucket_rate_below_one():
+    now = [1000.0]
+    sleeps = []
+
+    def _sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    with mock.patch('gcdt.gcdt_throttling.time.time', lambda: now[0]), \
+            mock.patch('gcdt.gcdt_throttling.time.sleep', _sleep):
+        bucket = TokenBucket(0.5)
+        bucket.acquire()
+        bucket.acquire()
+        # the bucket holds one token which is refilled in 2 seconds
+        assert_equal(sum(sleeps), 2.0)
+
+
+def test_token_bucket_min_rate():
+    # the default min_rate (rate / 10) is raised to one request per second
+    bucket = TokenBucket(8)
+    for _ in range(10):
+        bucket.throttled()
+    assert_equal(bucket.rate, 1)
+
+
+def test_token_bucket_throttled():
+    bucket = TokenBucket(8, min_rate=1)
+    bucket.throttled()
+    assert_equal(bucket.rate, 4)
+    for _ in range(5):
+        bucket.throttled()
+    assert_equal(bucket.rate, 1)
+    bucket.succeeded()
+    assert_equal(bucket.rate, 1.1)
+
+
+def test_retry_handler():
+    bucket = TokenBucket(8)
+    handler = ThrottleAwareRetryHandler(_checker, 5, bucket)
+    # throttling is retried until max_attempts
+    assert handler(1, THROTTLED, None) is not None
+    assert_equal(bucket.rate, 4)
+    assert handler(4, THROTTLED, None) is not None
+    assert_is_none(handler(5, THROTTLED, None))
+    # errors are retried as configured in the checker
+    assert handler(1, SERVER_ERROR, None) <= 0.1
+    assert_is_none(handler(3, SERVER_ERROR, None))
+    assert_is_none(handler(1, CLIENT_ERROR, None))
+    # success recovers the rate
+    rate = bucket.rate
+    assert_is_none(handler(1, SUCCESS, None))
+    assert bucket.rate > rate
+
+
+def test_awsclient_rate_limits():
+    session = botocore.session.get_session()
+    session.set_config_variable('region', 'eu-west-1')
+    session.set_credentials('access_key', 'secret_key')
+    awsclient = AWSClient(session, rate_limits={'__default__': None,
+                                                'cloudformation': 2})
+    awsclient.get_client('cloudformation')
+    awsclient.get_client('s3')
+    handlers = session.get_component('event_emitter')._unique_id_handlers
+    assert 'rate-limit-cloudformation' in handlers
+    assert 'rate-limit-s3' not in handlers
+    assert isinstance(handlers['retry-config-s3']['handler'],
+                      ThrottleAwareRetryHandler)
+
+
+def test_share_rate_limits():
+    assert_equal(share_rate_limits({'__default__': None, 'lambda': 15}, 4),
+                 {'__default__': None, 'lambda': 3.75})
+    assert_equal(share_rate_limits({'lambda': 15}, 0), {'lambda': 15.0})
+    # more workers than requests per second
+    assert_equal(share_rate_limits({'cloudformation': 8}, 16),
+                 {'cloudformation': 1.0})
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import mock
+import pytest
+from nose.tools import assert_equal
+
+from gcdt.gcdt_waiter import Waiter, WaiterTimeout, wait_for, wait_for_all
+
+
+class _FakeClock(object):
+    """time.time and time.sleep which do not take any time."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(scope='function')
+def clock():
+    clock = _FakeClock()
+    with mock.patch('gcdt.gcdt_waiter.time.time', clock.time), \
+            mock.patch('gcdt.gcdt_waiter.time.sleep', clock.sleep):
+        yield clock
+
+
+def _check(*states):
+    # check which reports the states and is done after the last one
+    states = list(states)
+
+    def check():
+        state = states.pop(0)
+        return not states, state
+    return check
+
+
+def test_wait_for_backoff(clock):
+    result = wait_for(_check('PENDING', 'PENDING', 'PENDING', 'DONE'),
+                      'resource', delay=2, max_delay=4)
+    assert_equal(result, 'DONE')
+    assert_equal(len(clock.sleeps), 3)
+    assert 1 <= clock.sleeps[0] <= 2
+    assert 2 <= clock.sleeps[1] <= 4
+    assert 2 <= clock.sleeps[2] <= 4
+
+
+def test_wait_for_state_change_resets_backoff(clock):
+    wait_for(_check('A', 'A', 'A', 'B', 'DONE'), 'resource', delay=2,
+             max_delay=16)
+    assert 4 <= clock.sleeps[2] <= 8
+    # B is a new state so we check again soon
+    assert 1 <= clock.sleeps[3] <= 2
+
+
+def test_wait_for_timeout(clock):
+    with pytest.raises(WaiterTimeout) as einfo:
+        wait_for(lambda: (False, None), 'change set ABC', timeout=60)
+    assert_equal(str(einfo.value), 'timeout while waiting for change set ABC')
+    # we do not wait past the deadline
+    assert_equal(sum(clock.sleeps), 60)
+
+
+def test_wait_for_all(clock):
+    waiters = [
+        Waiter('slow', _check(*['PENDING'] * 5 + ['slow']), delay=4,
+               max_delay=4),
+        Waiter('fast', _check('PENDING', 'fast'), delay=1, max_delay=1)
+    ]
+    assert_equal(wait_for_all(waiters), ['slow', 'fast'])
+    # the resources are waited for concurrently
+    assert clock.now - 1000.0 <= 5 * 4
+
+
+def test_wait_for_sleep_returns_early(clock):
+    # e.g. an event arrived, we check immediately
+    sleep = mock.Mock()
+    wait_for(_check('PENDING', 'DONE'), 'resource', sleep=sleep)
+    assert_equal(sleep.call_count, 1)
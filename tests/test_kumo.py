@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import os
 import json
+from datetime import datetime, timedelta
 from tempfile import NamedTemporaryFile
 
+import mock
+from botocore.exceptions import ClientError
+
 from nose.tools import assert_dict_equal
 from nose.tools import assert_equal, assert_true, \
     assert_regexp_matches, assert_list_equal, raises
@@ -11,10 +16,17 @@ import pytest
 from gcdt.kumo_core import _generate_parameters, \
     load_cloudformation_template, generate_template_file, _get_stack_name, \
     _get_stack_policy, _get_stack_policy_during_update, _get_conf_value, \
-    _generate_parameter_entry, _call_hook
+    _generate_parameter_entry, _call_hook, iter_stack_events, \
+    _get_new_stack_events, _poll_stack_events, StackProgress, \
+    get_fingerprint, _update_stack, FINGERPRINT_KEY, _s3_upload, \
+    _get_template_key, wait_for_change_set, describe_change_set, \
+    iter_stacks, list_stacks, compact_template, _get_template_location, \
+    generate_template_files, delete_stack
 
 from gcdt_testtools.helpers import cleanup_tempfiles, temp_folder  # fixtures!
-from gcdt_testtools.helpers import Bunch
+from gcdt_testtools.helpers import json_config_reader, mocked_client, \
+    mocked_awsclient  # fixtures!
+from gcdt_testtools.helpers import Bunch, fake_awsclient
 from . import here
 
 
@@ -246,3 +258,425 @@ def test_new_cloudformation_template_hooks():
     assert module.COUNTER['register'] == 1
     # currently deregister is not called (but we need that later!)
     #assert module.COUNTER['deregister'] == 1
+
+
+def _event(idx, resource='S3Bucket1', status='CREATE_IN_PROGRESS'):
+    return {'EventId': 'event-%d' % idx, 'LogicalResourceId': resource,
+            'ResourceStatus': status,
+            'Timestamp': datetime(2017, 1, 1) + timedelta(seconds=idx)}
+
+
+class _FakeCloudformation(object):
+    # describe_stack_events returns the scripted polls (newest event first)
+    def __init__(self, polls, page_size=2):
+        self.polls = polls
+        self.page_size = page_size
+        self.calls = []
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackId': 'stack-id'}]}
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        self.calls.append(NextToken)
+        if NextToken is None and len(self.polls) > 1:
+            events = self.polls.pop(0)
+        else:
+            events = self.polls[0]
+        start = int(NextToken or 0)
+        response = {'StackEvents': events[start:start + self.page_size]}
+        if start + self.page_size < len(events):
+            response['NextToken'] = str(start + self.page_size)
+        return response
+
+
+def test_get_new_stack_events_pagination():
+    events = [_event(i) for i in range(5, 0, -1)]
+    client = _FakeCloudformation([events])
+    new_events = _get_new_stack_events(client, 'stack-id', set())
+    assert_equal(new_events, events)
+    assert_equal(client.calls, [None, '2', '4'])
+
+    # stop paging when we reach events we have seen
+    client.calls = []
+    seen = set(['event-4'])
+    new_events = _get_new_stack_events(client, 'stack-id', seen)
+    assert_equal([e['EventId'] for e in new_events], ['event-5'])
+    assert_equal(client.calls, [None])
+
+    new_events = _get_new_stack_events(client, 'stack-id', set(),
+                                       last_event=events[1]['Timestamp'])
+    assert_equal([e['EventId'] for e in new_events], ['event-5'])
+
+
+@mock.patch('gcdt.kumo_core.time.sleep')
+def test_iter_stack_events(mocked_sleep):
+    poll1 = [_event(2), _event(1)]
+    poll2 = [_event(4), _event(3)] + poll1
+    client = _FakeCloudformation([poll1, poll2])
+    awsclient = fake_awsclient(client)
+    events = iter_stack_events(awsclient, 'stack-id')
+    assert_equal([next(events)['EventId'] for _ in range(4)],
+                 ['event-1', 'event-2', 'event-3', 'event-4'])
+    mocked_sleep.assert_called_once_with(5)
+
+
+def test_stack_progress():
+    progress = StackProgress('mystack', resource_count=3)
+    progress.update(_event(1, 'mystack'))
+    progress.update(_event(2, 'S3Bucket1'))
+    progress.update(_event(3, 'S3Bucket2'))
+    progress.update(_event(4, 'S3Bucket1', 'CREATE_COMPLETE'))
+    assert_equal(str(progress), '1/3')
+
+
+@mock.patch('gcdt.kumo_core.time.sleep')
+def test_poll_stack_events(mocked_sleep, capsys):
+    client = _FakeCloudformation([[
+        _event(3, 'mystack', 'CREATE_COMPLETE'),
+        _event(2, 'S3Bucket1', 'CREATE_COMPLETE'),
+        _event(1, 'mystack', 'CREATE_IN_PROGRESS')
+    ]])
+    awsclient = fake_awsclient(client)
+    assert_equal(_poll_stack_events(awsclient, 'mystack', resource_count=1), 0)
+    out, _ = capsys.readouterr()
+    assert '1/1' in out
+    mocked_sleep.assert_not_called()
+
+
+def test_get_fingerprint():
+    template = json.dumps({'Resources': {'S3Bucket1': {}}})
+    parameters = [
+        {'ParameterKey': 'a', 'ParameterValue': '1'},
+        {'ParameterKey': 'b', 'ParameterValue': '2'}
+    ]
+    fingerprint = get_fingerprint(template, parameters, '{}')
+    # the order of the parameters does not matter
+    assert_equal(get_fingerprint(template, parameters[::-1], '{}'),
+                 fingerprint)
+    assert get_fingerprint(template, parameters[:1], '{}') != fingerprint
+    assert get_fingerprint('{}', parameters, '{}') != fingerprint
+    assert get_fingerprint(template, parameters,
+                           '{"Statement": []}') != fingerprint
+
+
+def _conf(**cloudformation):
+    return {'cloudformation': dict(StackName='mystack', **cloudformation)}
+
+
+def _deployed_stack(client, fingerprint, status='UPDATE_COMPLETE'):
+    # let the client answer like cloudformation for a deployed stack
+    client.describe_stacks.return_value = {'Stacks': [{
+        'StackId': 'stack-id', 'StackStatus': status,
+        'Tags': [{'Key': 'team', 'Value': 'ops'}]
+    }]}
+    client.get_template_summary.return_value = {
+        'Metadata': json.dumps({FINGERPRINT_KEY: fingerprint})}
+    client.describe_stack_events.return_value = {'StackEvents': [
+        _event(1, 'mystack', 'UPDATE_COMPLETE')]}
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def cloudformation():
+    # stand-in for the cloudformation.py template module
+    return Bunch(generate_template=lambda: '{"Resources": {}}')
+
+
+@mock.patch('gcdt.kumo_core._poll_stack_events', return_value=0)
+@mock.patch('gcdt.kumo_core.invalidate_stack_outputs')
+def test_update_stack_unchanged(mocked_invalidate, mocked_poll,
+                                mocked_client, mocked_awsclient,
+                                cloudformation, capsys):
+    fingerprint = get_fingerprint('{"Resources": {}}', [],
+                                  _get_stack_policy(None))
+    _deployed_stack(mocked_client, fingerprint)
+    hooks = []
+    cloudformation.pre_update_hook = lambda: hooks.append('pre')
+    cloudformation.post_update_hook = lambda: hooks.append('post')
+    assert_equal(_update_stack(mocked_awsclient, _conf(), cloudformation,
+                               [], False), 0)
+    mocked_client.update_stack.assert_not_called()
+    # the hooks run even if the stack is not updated
+    assert_equal(hooks, ['pre', 'post'])
+    mocked_client.get_template_summary.assert_called_once_with(
+        StackName='mystack')
+    # nothing else happens for a no-op update
+    mocked_client.describe_stack_events.assert_not_called()
+    mocked_poll.assert_not_called()
+    mocked_invalidate.assert_not_called()
+    out, _ = capsys.readouterr()
+    assert 'No updates are to be performed.' in out
+
+
+@mock.patch('gcdt.kumo_core._poll_stack_events', return_value=0)
+@mock.patch('gcdt.kumo_core.invalidate_stack_outputs')
+def test_update_stack_changed(mocked_invalidate, mocked_poll, mocked_client,
+                              mocked_awsclient, cloudformation):
+    _deployed_stack(mocked_client, 'outdated')
+    assert_equal(_update_stack(mocked_awsclient, _conf(), cloudformation,
+                               [], False), 0)
+    fingerprint = get_fingerprint('{"Resources": {}}', [],
+                                  _get_stack_policy(None))
+    _, kwargs = mocked_client.update_stack.call_args
+    # the stack tags (and thus the tags of all resources) are not touched
+    assert 'Tags' not in kwargs
+    assert_equal(json.loads(kwargs['TemplateBody'])['Metadata'],
+                 {FINGERPRINT_KEY: fingerprint})
+    mocked_invalidate.assert_called_once_with(mocked_awsclient, 'mystack')
+    _, kwargs = mocked_poll.call_args
+    assert_equal(kwargs['resource_count'], 0)
+
+
+@mock.patch('gcdt.kumo_core._poll_stack_events', return_value=0)
+@mock.patch('gcdt.kumo_core.invalidate_stack_outputs')
+def test_delete_stack_resource_count(mocked_invalidate, mocked_poll,
+                                     mocked_client, mocked_awsclient):
+    _deployed_stack(mocked_client, 'outdated')
+    mocked_client.describe_stack_resources.return_value = {
+        'StackResources': [{'LogicalResourceId': 'a'},
+                           {'LogicalResourceId': 'b'}]}
+    assert_equal(delete_stack(mocked_awsclient, _conf()), 0)
+    mocked_client.delete_stack.assert_called_once_with(StackName='mystack')
+    _, kwargs = mocked_poll.call_args
+    assert_equal(kwargs['resource_count'], 2)
+
+
+@mock.patch('gcdt.kumo_core._poll_stack_events', return_value=0)
+@mock.patch('gcdt.kumo_core.invalidate_stack_outputs')
+def test_update_stack_after_rollback(mocked_invalidate, mocked_poll,
+                                     mocked_client, mocked_awsclient,
+                                     cloudformation):
+    # the fingerprint of a rolled back update does not match the stack
+    fingerprint = get_fingerprint('{"Resources": {}}', [],
+                                  _get_stack_policy(None))
+    _deployed_stack(mocked_client, fingerprint,
+                    status='UPDATE_ROLLBACK_COMPLETE')
+    _update_stack(mocked_awsclient, _conf(), cloudformation, [], False)
+    assert_equal(mocked_client.update_stack.call_count, 1)
+
+
+@mock.patch('gcdt.kumo_core._poll_stack_events', return_value=0)
+@mock.patch('gcdt.kumo_core.invalidate_stack_outputs')
+def test_update_stack_without_fingerprint(mocked_invalidate, mocked_poll,
+                                          mocked_client, mocked_awsclient,
+                                          cloudformation, capsys):
+    # stack deployed by an older kumo version
+    _deployed_stack(mocked_client, None)
+    mocked_client.get_template_summary.return_value = {}
+    # cloudformation does not update a stack if only the metadata changed
+    mocked_client.update_stack.side_effect = Exception(
+        'An error occurred (ValidationError) when calling the UpdateStack '
+        'operation: No updates are to be performed.')
+    assert_equal(_update_stack(mocked_awsclient, _conf(), cloudformation,
+                               [], False), 0)
+    _, kwargs = mocked_client.update_stack.call_args
+    assert FINGERPRINT_KEY in json.loads(kwargs['TemplateBody'])['Metadata']
+    mocked_poll.assert_not_called()
+    out, _ = capsys.readouterr()
+    assert 'No updates are to be performed.' in out
+
+
+def test_get_template_key():
+    key = _get_template_key('eu-west-1', '{"Resources": {}}')
+    assert_regexp_matches(key, r'^kumo/eu-west-1/templates/[0-9a-f]{64}\.json$')
+    assert_equal(_get_template_key('eu-west-1', '{"Resources": {}}'), key)
+    assert _get_template_key('eu-west-1', '{}') != key
+
+
+def test_s3_upload(temp_folder, mocked_client, mocked_awsclient):
+    mocked_client.head_object.side_effect = ClientError(
+        {'Error': {'Code': '404'}}, 'HeadObject')
+    s3url = _s3_upload(mocked_awsclient, _conf(artifactBucket='mybucket'),
+                       None, template_body='{"Resources": {}}')
+    key = _get_template_key('eu-west-1', '{"Resources": {}}')
+    assert_equal(s3url, 'https://s3-eu-west-1.amazonaws.com/mybucket/%s' % key)
+    mocked_client.put_object.assert_called_once_with(
+        Bucket='mybucket', Key=key, Body=b'{"Resources": {}}')
+    # the template is uploaded from memory
+    assert_equal(os.listdir('.'), [])
+
+
+def test_s3_upload_existing_template(mocked_client, mocked_awsclient):
+    _s3_upload(mocked_awsclient, _conf(artifactBucket='mybucket'), None,
+               template_body='{"Resources": {}}')
+    mocked_client.put_object.assert_not_called()
+
+
+def _change(resource):
+    return {'Type': 'Resource', 'ResourceChange': {
+        'Action': 'Add', 'LogicalResourceId': resource,
+        'ResourceType': 'AWS::S3::Bucket', 'Scope': [], 'Details': []}}
+
+
+@mock.patch('gcdt.kumo_core.time.sleep')
+def test_wait_for_change_set(mocked_sleep):
+    client = mock.Mock()
+    client.describe_change_set.side_effect = [
+        {'Status': 'CREATE_PENDING'},
+        {'Status': 'CREATE_IN_PROGRESS'},
+        {'Status': 'CREATE_IN_PROGRESS'},
+        {'Status': 'CREATE_COMPLETE', 'Changes': []}
+    ]
+    response = wait_for_change_set(client, 'ABC', 'mystack', delay=2,
+                                   max_delay=4)
+    assert_equal(response['Status'], 'CREATE_COMPLETE')
+    delays = [c[0][0] for c in mocked_sleep.call_args_list]
+    assert_equal(len(delays), 3)
+    assert 1 <= delays[0] <= 2
+    assert 2 <= delays[1] <= 4
+    assert 2 <= delays[2] <= 4
+
+
+@mock.patch('gcdt.kumo_core.time.sleep')
+def test_describe_change_set(mocked_sleep):
+    client = mock.Mock()
+    client.describe_change_set.side_effect = [
+        {'Status': 'CREATE_IN_PROGRESS'},
+        {'Status': 'CREATE_COMPLETE', 'Changes': [_change('S3Bucket1')],
+         'NextToken': 'page2'},
+        {'Status': 'CREATE_COMPLETE', 'Changes': [_change('S3Bucket2')]}
+    ]
+    awsclient = fake_awsclient(client)
+    diff = describe_change_set(awsclient, 'ABC', 'mystack',
+                               print_changes=False)
+    assert_equal(diff['Status'], 'CREATE_COMPLETE')
+    assert_equal([c['LogicalResourceId'] for c in diff['Changes']],
+                 ['S3Bucket1', 'S3Bucket2'])
+    assert_equal(diff['Changes'][0]['Action'], 'Add')
+    client.describe_change_set.assert_called_with(
+        ChangeSetName='ABC', StackName='mystack', NextToken='page2')
+    # the diff can be consumed as json
+    json.dumps(diff)
+
+
+def _summary(name, status='CREATE_COMPLETE'):
+    return {'StackName': name, 'StackStatus': status,
+            'CreationTime': datetime(2017, 1, 1)}
+
+
+def _list_stacks_client():
+    client = mock.Mock()
+    client.list_stacks.side_effect = [
+        {'StackSummaries': [_summary('infra-dev-a'), _summary('app-dev-b')],
+         'NextToken': 'page2'},
+        {'StackSummaries': [_summary('infra-dev-c', 'UPDATE_COMPLETE')]}
+    ]
+    return client
+
+
+def test_iter_stacks():
+    client = _list_stacks_client()
+    awsclient = fake_awsclient(client)
+    stacks = iter_stacks(awsclient, prefix='infra-',
+                         statuses=['CREATE_COMPLETE', 'UPDATE_COMPLETE'])
+    assert_equal(next(stacks)['StackName'], 'infra-dev-a')
+    # the second page is requested when we need it
+    assert_equal(client.list_stacks.call_count, 1)
+    assert_equal([s['StackName'] for s in stacks], ['infra-dev-c'])
+    client.list_stacks.assert_called_with(
+        StackStatusFilter=['CREATE_COMPLETE', 'UPDATE_COMPLETE'],
+        NextToken='page2')
+
+
+def test_list_stacks_json():
+    from StringIO import StringIO
+    client = _list_stacks_client()
+    awsclient = fake_awsclient(client)
+    out = StringIO()
+    assert_equal(list_stacks(awsclient, as_json=True, out=out), 3)
+    lines = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert_equal(lines[2], {'StackName': 'infra-dev-c',
+                            'StackStatus': 'UPDATE_COMPLETE',
+                            'CreationTime': '2017-01-01T00:00:00'})
+
+
+def test_compact_template():
+    template_body = json.dumps(
+        {'Resources': {'S3Bucket1': {'Type': 'AWS::S3::Bucket'}}}, indent=4)
+    compact = compact_template(template_body)
+    assert_equal(compact,
+                 '{"Resources":{"S3Bucket1":{"Type":"AWS::S3::Bucket"}}}')
+    assert_equal(json.loads(compact), json.loads(template_body))
+
+
+@pytest.fixture(scope='function')  # 'function' or 'module'
+def template_bucket(mocked_client):
+    # the template is not uploaded yet, the bucket does not exist
+    mocked_client.head_object.side_effect = ClientError(
+        {'Error': {'Code': '404'}}, 'HeadObject')
+    mocked_client.head_bucket.side_effect = ClientError(
+        {'Error': {'Code': '404'}}, 'HeadBucket')
+    return 'gcdt-kumo-templates-123456789012-eu-west-1'
+
+
+def test_get_template_location_inline(mocked_client, mocked_awsclient):
+    location = _get_template_location(mocked_awsclient, _conf(), None,
+                                      '{"a":1}')
+    assert_equal(location, {'TemplateBody': '{"a":1}'})
+    mocked_client.put_object.assert_not_called()
+
+
+def test_get_template_location_oversized(mocked_client, mocked_awsclient,
+                                         template_bucket, capsys):
+    template_body = json.dumps({'Description': 'x' * 51200})
+    location = _get_template_location(mocked_awsclient, _conf(), None,
+                                      template_body)
+    assert_equal(location, {
+        'TemplateURL': 'https://s3-eu-west-1.amazonaws.com/%s/%s' % (
+            template_bucket, _get_template_key('eu-west-1', template_body))})
+    mocked_client.create_bucket.assert_called_once_with(
+        Bucket=template_bucket,
+        CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+    assert_equal(mocked_client.put_object.call_args[1]['Bucket'],
+                 template_bucket)
+    out, _ = capsys.readouterr()
+    assert 'uploading it to S3 bucket %s' % template_bucket in out
+
+
+def test_get_template_location_bucket_created_concurrently(
+        mocked_client, mocked_awsclient, template_bucket):
+    mocked_client.create_bucket.side_effect = ClientError(
+        {'Error': {'Code': 'BucketAlreadyOwnedByYou'}}, 'CreateBucket')
+    template_body = json.dumps({'Description': 'x' * 51200})
+    location = _get_template_location(mocked_awsclient, _conf(), None,
+                                      template_body)
+    assert 'TemplateURL' in location
+    assert_equal(mocked_client.put_object.call_count, 1)
+
+
+def test_get_template_location_bucket_forbidden(mocked_client,
+                                                mocked_awsclient,
+                                                template_bucket):
+    mocked_client.head_bucket.side_effect = ClientError(
+        {'Error': {'Code': '403'}}, 'HeadBucket')
+    template_body = json.dumps({'Description': 'x' * 51200})
+    with pytest.raises(Exception) as einfo:
+        _get_template_location(mocked_awsclient, _conf(), None,
+                               template_body)
+    assert 'not accessible with your credentials (403)' in str(einfo.value)
+    mocked_client.create_bucket.assert_not_called()
+
+
+def test_generate_template_files(temp_folder, json_config_reader, capsys):
+    # the config is read via the lifecycle signals in the workers
+    # the template reads the env at import time
+    with open('cloudformation.py', 'w') as tfile:
+        tfile.write(
+            'import json\n'
+            'from gcdt.utils import get_env\n'
+            'ENV = get_env()\n'
+            'def generate_template():\n'
+            '    return json.dumps({"Description": ENV})\n')
+    for env in ['dev', 'prod']:
+        with open('gcdt_%s.json' % env, 'w') as cfile:
+            # the envs share the StackName
+            json.dump({'kumo': {'cloudformation': {
+                'StackName': 'mystack'}}}, cfile)
+
+    assert_equal(generate_template_files(['dev', 'prod', 'qa'], workers=2),
+                 1)
+    for env in ['dev', 'prod']:
+        with open('mystack-%s-generated-cf-template.json' % env) as tfile:
+            assert_equal(json.load(tfile), {'Description': env})
+    out, _ = capsys.readouterr()
+    assert 'gcdt_qa.json: config file is missing' in out
+    assert 'generated 2 templates' in out
@@ -10,7 +10,8 @@ import pytest
 from gcdt.kumo_core import load_cloudformation_template, \
     print_parameter_diff, deploy_stack, \
     delete_stack, create_change_set, _get_stack_name, describe_change_set, \
-    _get_artifact_bucket, _s3_upload, _get_stack_state
+    _get_artifact_bucket, _s3_upload, _get_stack_state, \
+    _get_template_key, compact_template
 from gcdt.kumo_util import ensure_ebs_volume_tags_ec2_instance, \
     ensure_ebs_volume_tags_autoscaling_group
 from gcdt.utils import are_credentials_still_valid
@@ -124,14 +125,15 @@ def test_s3_upload(cleanup_buckets, awsclient):
     artifact_bucket = _get_artifact_bucket(upload_conf)
     prepare_artifacts_bucket(awsclient, artifact_bucket)
     cleanup_buckets.append(artifact_bucket)
-    dest_key = 'kumo/%s/%s-cloudformation.json' % (region,
-                                                   _get_stack_name(upload_conf))
-    expected_s3url = 'https://s3-%s.amazonaws.com/%s/%s' % (region,
-                                                            artifact_bucket,
-                                                            dest_key)
     cloudformation_simple_stack, _ = load_cloudformation_template(
         here('resources/simple_cloudformation_stack/cloudformation.py')
     )
+    dest_key = _get_template_key(
+        region,
+        compact_template(cloudformation_simple_stack.generate_template()))
+    expected_s3url = 'https://s3-%s.amazonaws.com/%s/%s' % (region,
+                                                            artifact_bucket,
+                                                            dest_key)
     actual_s3url = _s3_upload(awsclient, upload_conf,
                               cloudformation_simple_stack)
     assert expected_s3url == actual_s3url
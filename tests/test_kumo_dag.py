@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import os
+import json
+
+import mock
+import pytest
+from nose.tools import assert_equal
+
+from gcdt.kumo_dag import read_stack_config, get_stack_jobs, deploy_stacks
+from gcdt_testtools.helpers import temp_folder, preserve_env  # fixtures!
+from gcdt_testtools.helpers import json_config_reader  # fixtures!
+
+
+def _write_stack(folder, stackname, **kumo):
+    os.mkdir(folder)
+    kumo.setdefault('cloudformation', {})['StackName'] = stackname
+    with open(os.path.join(folder, 'gcdt_dev.json'), 'w') as cfile:
+        json.dump({'kumo': kumo}, cfile)
+
+
+def test_read_stack_config(temp_folder, json_config_reader):
+    _write_stack('app', 'infra-dev-app', dependsOn=['infra-dev-db'],
+                 cloudformation={
+                     'VpcId': 'lookup:stack:infra-dev-vpc:VpcId',
+                     'Subnets': ['lookup:stack:infra-dev-vpc:SubnetA',
+                                 'lookup:secret:foo']
+                 })
+    config, stackname, depends_on = read_stack_config('app', 'dev')
+    assert_equal(stackname, 'infra-dev-app')
+    assert_equal(depends_on, ['infra-dev-db', 'infra-dev-vpc'])
+
+
+def test_read_stack_config_missing(temp_folder, json_config_reader):
+    os.mkdir('app')
+    with pytest.raises(Exception) as einfo:
+        read_stack_config('app', 'dev')
+    assert einfo.match(r'config file is missing')
+
+
+def test_get_stack_jobs(temp_folder, json_config_reader):
+    _write_stack('vpc', 'infra-dev-vpc')
+    _write_stack('app', 'infra-dev-app', cloudformation={
+        'VpcId': 'lookup:stack:infra-dev-vpc:VpcId',
+        'Domain': 'lookup:stack:infra-dev-dns:Domain'  # not deployed here
+    })
+    jobs = get_stack_jobs(['vpc', 'app'], 'dev', override_stack_policy=True)
+    assert_equal([(j['id'], j['dependsOn']) for j in jobs],
+                 [('infra-dev-vpc', []), ('infra-dev-app', ['infra-dev-vpc'])])
+    assert_equal(jobs[1]['path'], os.path.abspath('app'))
+    assert_equal(jobs[1]['command'], 'deploy --override-stack-policy')
+
+
+def test_get_stack_jobs_cycle(temp_folder, json_config_reader):
+    _write_stack('a', 'stack-a', dependsOn=['stack-b'])
+    _write_stack('b', 'stack-b', dependsOn=['stack-a'])
+    with pytest.raises(Exception) as einfo:
+        get_stack_jobs(['a', 'b'], 'dev')
+    assert einfo.match(r'dependency cycle')
+
+
+@mock.patch('gcdt.kumo_dag.run_batch', return_value=0)
+def test_deploy_stacks(mocked_run_batch, temp_folder, preserve_env,
+                       json_config_reader):
+    os.environ['ENV'] = 'dev'
+    _write_stack('vpc', 'infra-dev-vpc')
+    assert_equal(deploy_stacks(['vpc'], workers=8, fail_fast=True), 0)
+    args, kwargs = mocked_run_batch.call_args
+    assert_equal(args[0][0]['id'], 'infra-dev-vpc')
+    assert_equal(kwargs, {'workers': 8, 'logdir': None, 'fail_fast': True})
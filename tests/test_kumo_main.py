@@ -44,7 +44,7 @@ def test_list_cmd(awsclient, capsys):
         awsclient, 'kumo', 'list',
         config_base_name='gcdt_large',
         location=here('./resources/simple_cloudformation_stack/'))
-    list_cmd(**tooldata)
+    list_cmd(None, None, False, **tooldata)
     out, err = capsys.readouterr()
     # using regular expression search in captured output
     assert regex.search('listed \d+ stacks', out) is not None
@@ -58,7 +58,7 @@ def test_preview_cmd(awsclient, simple_cloudformation_stack,
         awsclient, 'kumo', 'preview',
         config_base_name='gcdt_large',
         location=here('./resources/simple_cloudformation_stack/'))
-    preview_cmd(**tooldata)
+    preview_cmd(False, **tooldata)
     out, err = capsys.readouterr()
     # verify diff results
     assert 'InstanceType │ t2.micro      │ t2.medium ' in out
@@ -69,7 +69,7 @@ def test_preview_cmd(awsclient, simple_cloudformation_stack,
 @check_dot_precondition
 def test_dot_cmd(awsclient, sample_ec2_cloudformation_stack_folder):
     tooldata = get_tooldata(awsclient, 'kumo', 'dot')
-    assert dot_cmd(**tooldata) == 0
+    assert dot_cmd(False, **tooldata) == 0
     assert os.path.exists('cloudformation.svg')
     os.unlink('cloudformation.svg')
 
@@ -78,7 +78,7 @@ def test_dot_cmd(awsclient, sample_ec2_cloudformation_stack_folder):
 @check_preconditions
 def test_generate_cmd(awsclient, simple_cloudformation_stack_folder):
     tooldata = get_tooldata(awsclient, 'kumo', 'generate')
-    assert generate_cmd(**tooldata) == 0
+    assert generate_cmd(None, None, **tooldata) == 0
     filename = 'infra-dev-kumo-sample-stack-generated-cf-template.json'
     assert os.path.exists(filename)
     os.unlink(filename)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import mock
+import pytest
 import troposphere
-from gcdt.kumo_util import StackLookup
+from gcdt.kumo_util import StackLookup, StackReference, add_exports
 
 
 def test_StackLookup():
@@ -16,3 +18,54 @@ def test_StackLookup():
     # as_reference: Is the parameter a reference (Default) or a string
     vpcid = stack_lookup.get_att('vpcid', as_reference=False)
     assert vpcid.data == {'Fn::GetAtt': ['StackOutput', 'vpcid']}
+
+
+def test_StackReference_import_value():
+    t = troposphere.Template()
+    stack_name = t.add_parameter(troposphere.Parameter(
+        'StackDependentOn', Type='String'))
+    output_name = t.add_parameter(troposphere.Parameter(
+        'OutputName', Type='String'))
+
+    stack_reference = StackReference('dp-dev')
+    vpcid = stack_reference.get_att('vpcid', as_reference=False)
+    assert vpcid.to_dict() == {'Fn::ImportValue': {'Fn::Sub': [
+        '${StackName}-${Output}', {'StackName': 'dp-dev', 'Output': 'vpcid'}
+    ]}}
+
+    stack_reference = StackReference(stack_name)
+    vpcid = stack_reference.get_att(output_name)
+    assert vpcid.to_dict() == {'Fn::ImportValue': {'Fn::Sub': [
+        '${StackName}-${Output}', {'StackName': {'Ref': 'StackDependentOn'},
+                                   'Output': {'Ref': 'OutputName'}}
+    ]}}
+
+
+def test_StackReference_outputs_index():
+    with mock.patch('gcdt.kumo_util.get_outputs_for_stack',
+                    return_value={'vpcid': 'vpc-123'}) as mocked_outputs:
+        stack_reference = StackReference('dp-dev', awsclient='awsclient')
+        assert stack_reference.get_att('vpcid', as_reference=False) == \
+            'vpc-123'
+        mocked_outputs.assert_called_once_with('awsclient', 'dp-dev')
+        with pytest.raises(Exception) as einfo:
+            stack_reference.get_att('subnetid', as_reference=False)
+        assert einfo.match('stack \'dp-dev\' has no output \'subnetid\'')
+        # parameters are resolved by cloudformation
+        with pytest.raises(Exception):
+            stack_reference.get_att('vpcid')
+
+
+def test_add_exports():
+    t = troposphere.Template()
+    t.add_output(troposphere.Output('vpcid', Value='vpc-123'))
+    t.add_output(troposphere.Output(
+        'subnetid', Value='subnet-123',
+        Export=troposphere.Export('my-subnet')))
+    add_exports(t)
+    outputs = t.to_dict()['Outputs']
+    assert outputs['vpcid']['Export'] == {'Name': {'Fn::Sub': [
+        '${StackName}-${Output}',
+        {'StackName': {'Ref': 'AWS::StackName'}, 'Output': 'vpcid'}
+    ]}}
+    assert outputs['subnetid']['Export'] == {'Name': 'my-subnet'}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+import json
+
+import mock
+from nose.tools import assert_equal
+
+from gcdt.kumo_core import deploy_stack
+from gcdt.kumo_validate import validate_template
+from gcdt_testtools.helpers import Bunch, fake_awsclient
+from . import here
+
+
+def _parameters(*names):
+    return [{'ParameterKey': name, 'ParameterValue': 'value',
+             'UsePreviousValue': False} for name in names]
+
+
+def _template(**sections):
+    template = {'Resources': {'Bucket': {'Type': 'AWS::S3::Bucket'}}}
+    template.update(sections)
+    return json.dumps(template)
+
+
+def test_validate_sample_template():
+    with open(here('resources/sample_kumo_viz/ELBStickinessSample.template'),
+              'r') as tfile:
+        template_body = tfile.read()
+    errors, warnings = validate_template(
+        template_body, _parameters('KeyName', 'InstanceType'))
+    assert_equal(errors, [])
+    assert_equal(warnings, [])
+
+
+def test_validate_template_invalid_json():
+    errors, _ = validate_template('{"Resources": ', [])
+    assert errors[0].startswith('template is no valid json')
+
+
+def test_validate_template_limits():
+    template_body = _template(Description='x' * 51200)
+    errors, _ = validate_template(template_body, [])
+    assert_equal(len(errors), 1)
+    assert 'for inline templates' in errors[0]
+    # templates uploaded to S3 can be larger
+    errors, _ = validate_template(template_body, [], s3_upload=True)
+    assert_equal(errors, [])
+
+    resources = dict(('Bucket%d' % i, {'Type': 'AWS::S3::Bucket'})
+                     for i in range(3))
+    errors, warnings = validate_template(
+        json.dumps({'Resources': resources}), [],
+        limits={'TemplateBody': 51200, 'TemplateURL': 1048576,
+                'Resources': 2, 'Parameters': 200, 'Outputs': 200})
+    # AWS raises the quotas from time to time so we only warn
+    assert_equal(errors, [])
+    assert_equal(warnings, ['3 resources exceed the limit of 2'])
+
+
+def test_validate_template_size_limit_s3():
+    template_body = _template(Description='x' * 1048576)
+    errors, _ = validate_template(template_body, [], s3_upload=True)
+    assert_equal(len(errors), 1)
+    assert 'exceeds the limit of 1048576 bytes' in errors[0]
+
+
+def test_validate_template_dangling_refs():
+    template_body = json.dumps({
+        'Parameters': {'Env': {'Type': 'String'}},
+        'Conditions': {'IsProd': {'Fn::Equals': [{'Ref': 'Env'}, 'prod']}},
+        'Resources': {
+            'Bucket': {
+                'Type': 'AWS::S3::Bucket',
+                'Condition': 'IsProd',
+                'Properties': {'BucketName': {
+                    'Fn::Sub': '${Env}-${AWS::Region}-${Unknown}'}}
+            },
+            'Topic': {
+                'Type': 'AWS::SNS::Topic',
+                'DependsOn': ['Bucket', 'Missing'],
+                'Condition': 'IsDev',
+                'Properties': {
+                    'TopicName': {'Ref': 'Buckett'},
+                    'DisplayName': {'Fn::ImportValue': 'other-stack-name'}
+                }
+            }
+        },
+        'Outputs': {
+            'BucketArn': {'Value': {'Fn::GetAtt': ['Env', 'Arn']}}
+        }
+    })
+    errors, _ = validate_template(template_body, _parameters('Env'))
+    assert_equal(errors, [
+        'Bucket: Ref to unknown resource or parameter \'Unknown\'',
+        'Topic: Ref to unknown resource or parameter \'Buckett\'',
+        'Topic: DependsOn unknown resource \'Missing\'',
+        'Topic: unknown condition \'IsDev\'',
+        'BucketArn: Fn::GetAtt of unknown resource \'Env\''
+    ])
+
+
+def test_validate_template_parameters():
+    template_body = _template(Parameters={
+        'InstanceType': {'Type': 'String'},
+        'KeyName': {'Type': 'String', 'Default': 'mykey'}
+    })
+    errors, warnings = validate_template(template_body,
+                                         _parameters('Unused'))
+    assert_equal(errors, [
+        'parameter \'InstanceType\' is missing in the config',
+        'config value \'Unused\' is not a parameter of the template'
+    ])
+    assert_equal(warnings, [])
+
+
+def test_deploy_stack_validation_failed(capsys):
+    conf = {'cloudformation': {'StackName': 'mystack'}}
+    cloudformation = Bunch(
+        generate_template=lambda: _template(Outputs={
+            'Arn': {'Value': {'Fn::GetAtt': ['Buckett', 'Arn']}}}))
+    client = mock.Mock()
+    awsclient = fake_awsclient(client)
+    assert_equal(deploy_stack(awsclient, conf, cloudformation), 1)
+    # we fail before we talk to cloudformation
+    assert_equal(client.mock_calls, [])
+    out, _ = capsys.readouterr()
+    assert 'Fn::GetAtt of unknown resource \'Buckett\'' in out
@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import json
+import time
+import logging
 from StringIO import StringIO
 
 from nose.tools import assert_equal
 import nose
 import pytest
 
-from gcdt.kumo_viz import cfn_viz, _analyze_sg
+from gcdt.kumo_viz import cfn_viz, _analyze_sg, _find_refs, _extract_graph
 from . import here
 
+log = logging.getLogger(__name__)
+
 
 def test_cfn_viz():
     template_path = here(
@@ -65,3 +69,96 @@ def test_analyze_sg():
     known_sg, open_sg = _analyze_sg(template['Resources'])
     nose.tools.assert_in('InstanceSecurityGroup', known_sg)
     nose.tools.assert_in('InstanceSecurityGroup', open_sg)
+
+
+def test_find_refs():
+    elem = {'Properties': {
+        'A': {'Ref': 'Param'},
+        'B': [{'Fn::GetAtt': ['Bucket', 'Arn']}, 'text', 42, True, None],
+        'C': {'Fn::Sub': 'arn:${AWS::Region}:${Topic.Name}:${!Literal}'},
+        'D': {'Fn::Sub': ['${Host}.${Zone}', {'Host': {'Ref': 'HostParam'}}]},
+        'E': {'Fn::ImportValue': 'vpc-id'},
+        'F': {'Fn::ImportValue': {'Fn::Sub': '${Env}-subnet'}}
+    }}
+    refs = sorted(r['from'] for r in _find_refs('Node', elem))
+    assert_equal(refs, ['AWS::Region', 'Bucket', 'Env', 'HostParam',
+                        'Import:vpc-id', 'Param', 'Topic', 'Zone'])
+
+
+def test_extract_graph_depends_on():
+    resources = {
+        'Instance': {'Type': 'AWS::EC2::Instance', 'DependsOn': 'Gateway'},
+        'Service': {'Type': 'AWS::ECS::Service',
+                    'DependsOn': ['Instance', 'Gateway']}
+    }
+    _, edges = _extract_graph('test', resources)
+    assert_equal(sorted((e['from'], e['to']) for e in edges), [
+        ('Gateway', 'Instance'), ('Gateway', 'Service'),
+        ('Instance', 'Service')])
+
+
+def test_cfn_viz_cluster_by_type():
+    template = {'Resources': {
+        'Bucket1': {'Type': 'AWS::S3::Bucket'},
+        'Bucket2': {'Type': 'AWS::S3::Bucket'},
+        'Queue': {'Type': 'AWS::SQS::Queue',
+                  'Properties': {'Name': {'Fn::ImportValue': 'queue-name'}}}
+    }}
+    out = StringIO()
+    cfn_viz(template, out=out, cluster_by_type=True)
+    dot = out.getvalue()
+    assert 'subgraph "cluster_Bucket" {\nlabeljust=l;\nlabel="Bucket";' in dot
+    assert 'subgraph "cluster_Queue" {' in dot
+    assert 'subgraph "Imports" {' in dot
+    assert '"Import:queue-name" -> "Queue";' in dot
+
+
+def _scale_template(template, copies):
+    # copy the resources of the template, refs to resources point to the
+    # resources of the same copy
+    names = set(template['Resources'])
+
+    def _rename(elem, idx):
+        if isinstance(elem, dict):
+            result = {}
+            for k, v in elem.items():
+                if k == 'Ref' and v in names:
+                    result[k] = '%s%d' % (v, idx)
+                elif k == 'Fn::GetAtt' and v[0] in names:
+                    result[k] = ['%s%d' % (v[0], idx)] + v[1:]
+                else:
+                    result[k] = _rename(v, idx)
+            return result
+        elif isinstance(elem, list):
+            return [_rename(e, idx) for e in elem]
+        return elem
+
+    scaled = dict(template)
+    scaled['Resources'] = {}
+    for idx in range(copies):
+        for name, details in template['Resources'].items():
+            scaled['Resources']['%s%d' % (name, idx)] = _rename(details, idx)
+    return scaled
+
+
+@pytest.mark.slow
+def test_cfn_viz_benchmark():
+    # the sample template scaled up to 1500 resources
+    template_path = here(
+        'resources/sample_kumo_viz/ELBStickinessSample.template')
+    with open(template_path, 'r') as tfile:
+        template = json.loads(tfile.read())
+    out = StringIO()
+    cfn_viz(template, parameters={'KeyName': 'abc123'}, out=out)
+    edges = out.getvalue().count(' -> ')
+
+    scaled = _scale_template(template, 375)
+    assert_equal(len(scaled['Resources']), 1500)
+    out = StringIO()
+    start = time.time()
+    cfn_viz(scaled, parameters={'KeyName': 'abc123'}, out=out)
+    log.info('cfn_viz for 1500 resources: %.3fs', time.time() - start)
+    # the outputs of the template refer to the resources once
+    outputs = len(template['Outputs'])
+    assert_equal(out.getvalue().count(' -> '),
+                 (edges - outputs) * 375 + outputs)
@@ -8,12 +8,15 @@ from tempfile import NamedTemporaryFile
 import json
 import time
 
+import mock
+from botocore.exceptions import ClientError
 from s3transfer.subscribers import BaseSubscriber
 from nose.tools import assert_true, assert_false, assert_equal, \
     assert_regexp_matches
 import pytest
 
-from gcdt.ramuda_core import cleanup_bundle, bundle_lambda
+from gcdt.ramuda_core import cleanup_bundle, bundle_lambda, \
+    _call_when_ready
 from gcdt.ramuda_utils import unit, \
     aggregate_datapoints, json2table, create_sha256, ProgressPercentage, \
     list_of_dict_equals, create_aws_s3_arn, get_rule_name_from_event_arn, \
@@ -210,3 +213,27 @@ def test_bundle_lambda(temp_folder, capsys):
 
 
 
+
+
+@mock.patch('gcdt.gcdt_waiter.time.sleep')
+def test_call_when_ready(mocked_sleep):
+    call = mock.Mock(side_effect=[
+        ClientError({'Error': {'Code': 'ResourceConflictException'}},
+                    'UpdateFunctionConfiguration'),
+        ClientError({'Error': {
+            'Code': 'InvalidParameterValueException',
+            'Message': 'The role defined for the function cannot be assumed '
+                       'by Lambda.'}}, 'UpdateFunctionConfiguration'),
+        {'Version': '1'}
+    ])
+    assert_equal(_call_when_ready('myfunction', call), {'Version': '1'})
+    assert_equal(mocked_sleep.call_count, 2)
+
+    # other errors are not retried
+    call = mock.Mock(side_effect=ClientError(
+        {'Error': {'Code': 'InvalidParameterValueException',
+                   'Message': 'Unsupported runtime'}},
+        'UpdateFunctionConfiguration'))
+    with pytest.raises(ClientError):
+        _call_when_ready('myfunction', call)
+    assert_equal(call.call_count, 1)
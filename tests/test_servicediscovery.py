@@ -1,11 +1,117 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import os
 from datetime import datetime
 
-from gcdt.servicediscovery import parse_ts
+import mock
+from nose.tools import assert_equal
 import pytest
 
+from gcdt.servicediscovery import parse_ts, StackOutputsIndex
+from gcdt_testtools.helpers import temp_cache_dir  # fixtures!
+from gcdt_testtools.helpers import cleanup_credentials_cache  # fixtures!
+from gcdt_testtools.helpers import Bunch
+
 
 def test_parse_ts():
     assert parse_ts('2016-06-22T06:51:59.000Z') == \
         datetime(2016, 06, 22, 06, 51, 59, 0)
+
+
+def _stack(name, outputs=None):
+    stack = {'StackName': name, 'StackStatus': 'CREATE_COMPLETE'}
+    if outputs is not None:
+        stack['Outputs'] = [{'OutputKey': k, 'OutputValue': v}
+                            for k, v in outputs.items()]
+    return stack
+
+
+def _awsclient():
+    cloudformation = mock.Mock()
+    cloudformation.meta.region_name = 'eu-west-1'
+    sts = mock.Mock()
+    sts.get_caller_identity.return_value = {
+        'Account': '123456789012',
+        'Arn': 'arn:aws:iam::123456789012:user/me', 'UserId': 'AIDAFAKE'}
+    clients = {'cloudformation': cloudformation, 'sts': sts}
+    return Bunch(get_client=lambda service: clients[service],
+                 get_credentials=lambda: Bunch(access_key='AKID'),
+                 sts=sts), cloudformation
+
+
+def test_stack_outputs_index_memoized(temp_cache_dir,
+                                      cleanup_credentials_cache):
+    awsclient, cloudformation = _awsclient()
+    cloudformation.describe_stacks.return_value = {
+        'Stacks': [_stack('mystack', {'Key': 'value'})]}
+    index = StackOutputsIndex(ttl=300)
+    assert_equal(index.get(awsclient, 'mystack'), {'Key': 'value'})
+    assert_equal(index.get(awsclient, 'mystack'), {'Key': 'value'})
+    assert_equal(cloudformation.describe_stacks.call_count, 1)
+    assert os.path.isfile(os.path.join(
+        temp_cache_dir, 'stack_outputs_123456789012-eu-west-1.json'))
+
+    # another process uses the outputs from the cache file
+    other_awsclient, other_cloudformation = _awsclient()
+    assert_equal(StackOutputsIndex(ttl=300).get(other_awsclient, 'mystack'),
+                 {'Key': 'value'})
+    other_cloudformation.describe_stacks.assert_not_called()
+    # the account of the access key is looked up only once
+    other_awsclient.sts.get_caller_identity.assert_not_called()
+
+
+def test_stack_outputs_index_ttl(temp_cache_dir,
+                                 cleanup_credentials_cache):
+    awsclient, cloudformation = _awsclient()
+    cloudformation.describe_stacks.return_value = {
+        'Stacks': [_stack('mystack')]}
+    index = StackOutputsIndex(ttl=300)
+    with mock.patch('gcdt.servicediscovery.time.time', return_value=1000):
+        assert_equal(index.get(awsclient, 'mystack'), None)
+    with mock.patch('gcdt.servicediscovery.time.time', return_value=1301):
+        index.get(awsclient, 'mystack')
+    assert_equal(cloudformation.describe_stacks.call_count, 2)
+
+
+def test_stack_outputs_index_prefetch(temp_cache_dir,
+                                      cleanup_credentials_cache):
+    awsclient, cloudformation = _awsclient()
+    cloudformation.describe_stacks.side_effect = [
+        {'Stacks': [_stack('a', {'A': '1'})], 'NextToken': 'page2'},
+        {'Stacks': [_stack('b', {'B': '2'})]}
+    ]
+    index = StackOutputsIndex(ttl=300)
+    assert_equal(index.prefetch(awsclient), 2)
+    cloudformation.describe_stacks.assert_called_with(NextToken='page2')
+    assert_equal(index.get(awsclient, 'a'), {'A': '1'})
+    assert_equal(index.get(awsclient, 'b'), {'B': '2'})
+    assert_equal(cloudformation.describe_stacks.call_count, 2)
+
+
+def test_stack_outputs_index_invalidate(temp_cache_dir,
+                                        cleanup_credentials_cache):
+    awsclient, cloudformation = _awsclient()
+    cloudformation.describe_stacks.return_value = {
+        'Stacks': [_stack('mystack', {'Key': 'value'})]}
+    index = StackOutputsIndex(ttl=300)
+    other_index = StackOutputsIndex(ttl=300)
+    index.get(awsclient, 'mystack')
+    other_index.get(awsclient, 'mystack')
+
+    cloudformation.describe_stacks.return_value = {
+        'Stacks': [_stack('mystack', {'Key': 'changed'})]}
+    index.invalidate(awsclient, 'mystack')
+    # other processes notice the invalidation via the cache file
+    assert_equal(other_index.get(awsclient, 'mystack'), {'Key': 'changed'})
+    assert_equal(cloudformation.describe_stacks.call_count, 2)
+
+
+def test_stack_outputs_index_disabled(temp_cache_dir):
+    awsclient, cloudformation = _awsclient()
+    cloudformation.describe_stacks.return_value = {
+        'Stacks': [_stack('mystack', {'Key': 'value'})]}
+    index = StackOutputsIndex(ttl=0)
+    index.get(awsclient, 'mystack')
+    index.get(awsclient, 'mystack')
+    assert_equal(cloudformation.describe_stacks.call_count, 2)
+    assert_equal(os.listdir(temp_cache_dir), [])
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import pytest
+
+from gcdt_testtools.startup_benchmark import measure_in_subprocess
+
+
+# note: gcdt.gcdt_main is not part of this since the generators (banana)
+# are loaded on startup.
+@pytest.mark.parametrize('module', [
+    'gcdt.gcdt_lifecycle', 'gcdt.kumo_main', 'gcdt.ramuda_main',
+    'gcdt.tenkai_main', 'gcdt.yugen_main'
+])
+def test_entry_points_do_not_import_heavy_modules(module):
+    result = measure_in_subprocess(module)
+    assert result['heavy_modules'] == []
+    assert module in result['timings']
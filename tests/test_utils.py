@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 import os
+import time
+from datetime import datetime
 
 from nose.tools import assert_equal
+import mock
 import pytest
 
 from gcdt.utils import version, __version__, retries,  \
-    get_command, dict_merge, get_env
+    get_command, dict_merge, get_env, check_gcdt_update, read_cache_file, \
+    write_cache_file, are_credentials_still_valid, get_caller_identity, \
+    _credentials_cache, _refresh_latest_version, CREDENTIALS_CACHE_TTL
 from gcdt_testtools.helpers import create_tempfile, preserve_env  # fixtures!
+from gcdt_testtools.helpers import temp_cache_dir  # fixtures!
+from gcdt_testtools.helpers import cleanup_credentials_cache, \
+    mocked_client, mocked_awsclient  # fixtures!
 from . import here
 
 
@@ -132,3 +140,102 @@ def test_get_env(preserve_env):
 
 # TODO get_outputs_for_stack
 # TODO test_make_command
+
+
+def test_cache_file(temp_cache_dir):
+    assert read_cache_file('foo.json') is None
+    write_cache_file('foo.json', {'foo': 'bar'})
+    assert read_cache_file('foo.json') == {'foo': 'bar'}
+    assert os.listdir(temp_cache_dir) == ['foo.json']
+
+
+@mock.patch('gcdt.utils.get_package_versions', return_value=('0.0.1', '99.0.0'))
+def test_refresh_latest_version(mocked_get_package_versions, temp_cache_dir):
+    _refresh_latest_version()
+    assert read_cache_file('update_check.json')['latest_version'] == '99.0.0'
+    mocked_get_package_versions.assert_called_once_with('gcdt')
+
+
+@mock.patch('gcdt.utils.subprocess.Popen')
+def test_check_gcdt_update_refreshes_cache(mocked_popen, temp_cache_dir,
+                                           capsys):
+    assert check_gcdt_update() is mocked_popen.return_value
+    out, err = capsys.readouterr()
+    assert out == ''  # nothing cached yet
+    # the refresh runs in a separate process
+    args, kwargs = mocked_popen.call_args
+    assert '_refresh_latest_version()' in args[0][-1]
+    assert kwargs['close_fds'] is True
+
+    write_cache_file('update_check.json',
+                     {'latest_version': '99.0.0', 'timestamp': time.time()})
+    mocked_popen.reset_mock()
+    assert check_gcdt_update() is None
+    out, err = capsys.readouterr()
+    assert out == 'Please consider an update to gcdt version: 99.0.0\n'
+    mocked_popen.assert_not_called()
+
+
+@mock.patch('gcdt.utils.subprocess.Popen')
+def test_check_gcdt_update_stale_cache(mocked_popen, temp_cache_dir, capsys):
+    write_cache_file('update_check.json',
+                     {'latest_version': __version__, 'timestamp': 0})
+    assert check_gcdt_update() is mocked_popen.return_value
+    out, err = capsys.readouterr()
+    assert out == ''
+
+
+@mock.patch('gcdt.utils.get_package_versions')
+def test_check_gcdt_update_offline(mocked_get_package_versions,
+                                   temp_cache_dir, preserve_env):
+    os.environ['GCDT_OFFLINE'] = '1'
+    try:
+        assert check_gcdt_update() is None
+    finally:
+        del os.environ['GCDT_OFFLINE']
+    mocked_get_package_versions.assert_not_called()
+
+
+def test_get_caller_identity_is_cached(mocked_client, mocked_awsclient,
+                                       cleanup_credentials_cache):
+    assert get_caller_identity(mocked_awsclient)['Account'] == \
+        '123456789012'
+    assert are_credentials_still_valid(mocked_awsclient) == 0
+    mocked_client.get_caller_identity.assert_called_once_with()
+
+
+def test_get_caller_identity_expired_credentials(mocked_client,
+                                                 mocked_awsclient,
+                                                 cleanup_credentials_cache):
+    # expired credentials are checked again
+    mocked_awsclient.get_credentials()._expiry_time = datetime(2017, 1, 1)
+    get_caller_identity(mocked_awsclient)
+    get_caller_identity(mocked_awsclient)
+    assert mocked_client.get_caller_identity.call_count == 2
+
+
+def test_get_caller_identity_ttl(mocked_client, mocked_awsclient,
+                                 cleanup_credentials_cache):
+    # credentials without an expiry are checked again after the TTL
+    with mock.patch('gcdt.utils.time', return_value=1000.0):
+        get_caller_identity(mocked_awsclient)
+        get_caller_identity(mocked_awsclient)
+    with mock.patch('gcdt.utils.time',
+                    return_value=1000.0 + CREDENTIALS_CACHE_TTL + 1):
+        get_caller_identity(mocked_awsclient)
+    assert mocked_client.get_caller_identity.call_count == 2
+
+
+def test_are_credentials_still_valid_fails(mocked_client, mocked_awsclient,
+                                           cleanup_credentials_cache, capsys):
+    mocked_client.get_caller_identity.side_effect = Exception('ExpiredToken')
+    assert are_credentials_still_valid(mocked_awsclient) == 1
+    out, err = capsys.readouterr()
+    assert out == 'ExpiredToken\n'
+    assert _credentials_cache == {}
+
+
+def test_are_credentials_still_valid_no_credentials(capsys):
+    awsclient = mock.Mock()
+    awsclient.get_credentials.return_value = None
+    assert are_credentials_still_valid(awsclient) == 1